@@ -0,0 +1,78 @@
+"""
+Compare benchmark results with the baseline and fail on regressions.
+
+    python -m benchmarks.compare baseline.json current.json --tolerance 0.1
+"""
+
+import argparse
+import json
+import sys
+import typing as t
+
+HIGHER_IS_BETTER = ("ticks_per_sec", "alerts_per_sec", "api_rps.")
+"""Metrics (or prefixes of nested metrics) which regress when they go down"""
+IGNORED = ("searches", "delivered")
+"""Metrics which are reported but are not compared"""
+
+
+def flatten(metrics: t.Dict[str, t.Any], prefix: str = "") -> t.Dict[str, float]:
+    flat: t.Dict[str, float] = {}
+    for key, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def higher_is_better(name: str) -> bool:
+    return any(
+        name == metric or (metric.endswith(".") and name.startswith(metric))
+        for metric in HIGHER_IS_BETTER
+    )
+
+
+def compare(
+    baseline: t.Dict[str, float], current: t.Dict[str, float], tolerance: float
+) -> t.List[t.Tuple[str, float, float, float, bool]]:
+    """Name, baseline, current, relative change and whether it's a regression"""
+    rows = []
+    for name in sorted(baseline.keys() & current.keys()):
+        if name in IGNORED:
+            continue
+        old, new = baseline[name], current[name]
+        change = (new - old) / old if old else 0.0
+        if higher_is_better(name):
+            regression = change < -tolerance
+        else:
+            regression = change > tolerance
+        rows.append((name, old, new, change, regression))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="allowed relative change"
+    )
+    args = parser.parse_args()
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline.get("params") != current.get("params"):
+        print("Warning: results were taken with different parameters")
+    rows = compare(
+        flatten(baseline["metrics"]), flatten(current["metrics"]), args.tolerance
+    )
+    for name, old, new, change, regression in rows:
+        mark = "REGRESSION" if regression else ""
+        print(f"{name:<40} {old:>12.4f} {new:>12.4f} {change:>+8.1%} {mark}")
+    if any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
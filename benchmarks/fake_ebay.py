@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import random
+import typing as t
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+
+class FakeBrowseApi:
+    """
+    Local stand-in for eBay OAuth and Browse API search endpoints
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        expires_in: int = 7200,
+        error_rate: float = 0.0,
+        fresh_items: bool = False,
+        record_requests: bool = True,
+        seed: int = 0,
+        total: int = 10000,
+    ):
+        """
+        :param latency: delay of every search response (in seconds)
+        :param expires_in: lifetime of issued tokens (in seconds)
+        :param error_rate: share of search requests which fail with 503
+        :param fresh_items: return new items on every search, so every result is a change
+        :param record_requests: keep every search request in search_requests
+        :param seed: seed of random errors
+        :param total: number of matching items reported for every search
+        """
+        self.latency = latency
+        self.expires_in = expires_in
+        self.error_rate = error_rate
+        self.fresh_items = fresh_items
+        self.record_requests = record_requests
+        self.random = random.Random(seed)
+        self.total = total
+        self.token_requests = 0
+        self.search_count = 0
+        self.search_requests: t.List[dict] = []
+        self.concurrent = 0
+        self.max_concurrent = 0
+        self.fail_next: t.List[int] = []
+        app = web.Application()
+        app.router.add_post("/identity/v1/oauth2/token", self.token)
+        app.router.add_get("/buy/browse/v1/item_summary/search", self.search)
+        self.server = TestServer(app)
+
+    @property
+    def api_url(self) -> str:
+        return str(self.server.make_url("/buy/browse/v1"))
+
+    @property
+    def oauth_url(self) -> str:
+        return str(self.server.make_url("/identity/v1/oauth2/token"))
+
+    async def start(self):
+        await self.server.start_server()
+
+    async def close(self):
+        await self.server.close()
+
+    async def token(self, request: web.Request) -> web.Response:
+        self.token_requests += 1
+        return web.json_response(
+            {
+                "access_token": f"token-{self.token_requests}",
+                "expires_in": self.expires_in,
+                "token_type": "Application Access Token",
+            }
+        )
+
+    async def search(self, request: web.Request) -> web.Response:
+        self.concurrent += 1
+        self.max_concurrent = max(self.max_concurrent, self.concurrent)
+        self.search_count += 1
+        try:
+            if self.record_requests:
+                self.search_requests.append(
+                    {
+                        "q": request.query["q"],
+                        "authorization": request.headers.get("Authorization"),
+                    }
+                )
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self.fail_next:
+                return web.Response(status=self.fail_next.pop(0), text="error")
+            if self.error_rate and self.random.random() < self.error_rate:
+                return web.Response(status=503, text="error")
+            limit = int(request.query.get("limit", 20))
+            generation = self.search_count if self.fresh_items else 0
+            items = make_items(request.query["q"], limit, generation)
+            return web.json_response({"total": self.total, "itemSummaries": items})
+        finally:
+            self.concurrent -= 1
+
+
+def make_items(phrase: str, count: int, generation: int = 0) -> t.List[dict]:
+    """Items of the phrase, their ids are the same in every process"""
+    digest = hashlib.blake2b(phrase.encode(), digest_size=8).hexdigest()
+    return [
+        {
+            "itemId": f"v1|{digest}-{i}|{generation}",
+            "title": f"{phrase} #{i}",
+            "price": {"value": f"{10 + i}.00", "currency": "USD"},
+            "itemWebUrl": f"https://www.ebay.com/itm/{i}",
+        }
+        for i in range(count)
+    ]
@@ -0,0 +1,56 @@
+"""
+Memory used by the scheduler per alert: the alert registry and the timer wheel.
+
+    python -m benchmarks.registry_memory --sizes 10000 100000 1000000
+"""
+
+import argparse
+import tracemalloc
+import typing as t
+
+from ebay_alerts_service.registry import AlertRegistry
+from ebay_alerts_service.wheel import TimerWheel
+
+INTERVALS = (2, 10, 30)
+
+
+def alert_rows(
+    count: int, alerts_per_email: int, alerts_per_phrase: int
+) -> t.Iterator[t.Tuple[int, str, str, int]]:
+    for alert_id in range(1, count + 1):
+        email = f"user{alert_id // alerts_per_email}@example.com"
+        phrase = f"search phrase {alert_id // alerts_per_phrase}"
+        yield alert_id, email, phrase, INTERVALS[alert_id % len(INTERVALS)]
+
+
+def measure(count: int, alerts_per_email: int, alerts_per_phrase: int) -> int:
+    """Bytes allocated by the registry and the wheel for count alerts"""
+    tracemalloc.start()
+    registry = AlertRegistry()
+    wheel = TimerWheel(lambda interval, ids: None)
+    for alert_id, email, phrase, interval in alert_rows(
+        count, alerts_per_email, alerts_per_phrase
+    ):
+        registry.put(alert_id, email, phrase)
+        wheel.add(alert_id, interval)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000, 1000000]
+    )
+    parser.add_argument("--alerts-per-email", type=int, default=3)
+    parser.add_argument("--alerts-per-phrase", type=int, default=10)
+    args = parser.parse_args()
+    print(f"{'alerts':>10} {'total MiB':>10} {'bytes/alert':>12}")
+    for count in args.sizes:
+        size = measure(count, args.alerts_per_email, args.alerts_per_phrase)
+        print(f"{count:>10} {size / 2 ** 20:>10.1f} {size / count:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+End-to-end benchmark of the service against the local fake Browse API.
+
+    python -m benchmarks.service --alerts 10000 --ticks 5 --output current.json
+
+The application is started in-process with a temporary database seeded with
+alerts, the only processor is a sink which records delivery time.
+Every tick makes all alerts due at once and waits until all results are delivered.
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import typing as t
+
+from httpx import AsyncClient
+from sqlalchemy import insert
+
+from benchmarks.fake_ebay import FakeBrowseApi
+from ebay_alerts_service import app as app_module
+from ebay_alerts_service import db
+from ebay_alerts_service.processors.base import AbstractProcessor
+
+WORDS = (
+    "iphone ipad macbook pixel galaxy thinkpad kindle switch playstation xbox "
+    "camera lens tripod drone watch headphones speaker keyboard mouse monitor "
+    "vintage new used refurbished pro max mini ultra lite black white silver"
+).split()
+INTERVALS = (2, 10, 30)
+IDLE_POLL_INTERVAL = 0.05
+"""How often the benchmark checks whether the tick is delivered (in seconds)"""
+
+
+class SinkProcessor(AbstractProcessor):
+    """
+    Processor which only records how long results took to be delivered
+    """
+
+    def __init__(self):
+        self.scheduled_at = 0.0
+        self.latencies: t.List[float] = []
+
+    async def load(self, result):
+        self.latencies.append(time.monotonic() - self.scheduled_at)
+
+
+def make_phrases(count: int, rng: random.Random) -> t.List[str]:
+    phrases: t.Set[str] = set()
+    while len(phrases) < count:
+        phrases.add(" ".join(rng.sample(WORDS, rng.randint(1, 3))))
+    return sorted(phrases)
+
+
+def alert_rows(
+    count: int, phrases: int, alerts_per_email: int, seed: int
+) -> t.List[dict]:
+    """
+    Alerts with realistic phrase overlap: popularity of phrases follows Zipf's law
+    and some alerts spell the same phrase differently
+    """
+    rng = random.Random(seed)
+    pool = make_phrases(phrases, rng)
+    weights = [1 / rank for rank in range(1, len(pool) + 1)]
+    rows: t.List[dict] = []
+    seen: t.Set[t.Tuple[str, str]] = set()
+    while len(rows) < count:
+        email = f"user{len(rows) // alerts_per_email}@example.com"
+        phrase = rng.choices(pool, weights)[0]
+        if rng.random() < 0.1:
+            phrase = f" {phrase.upper()} "
+        if (email, phrase) in seen:
+            continue
+        seen.add((email, phrase))
+        rows.append(dict(email=email, phrase=phrase, interval=rng.choice(INTERVALS)))
+    return rows
+
+
+async def seed_alerts(db_path: str, rows: t.List[dict], chunk_size: int = 10000):
+    conn = db.DbConnection(db_path)
+    await conn.init_schema()
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:][:chunk_size]
+        async with conn.session() as session:
+            await session.execute(insert(db.Alert), chunk)
+            await session.commit()
+    await conn.close()
+
+
+def percentile(values: t.List[float], percent: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100)[percent - 1]
+
+
+async def wait_idle(scheduler):
+    """
+    Wait until all results are delivered. The outbox backlog is a query,
+    so it's counted only once everything else is idle and checks are sparse
+    to keep the benchmark from measuring its own polling.
+    """
+    outbox = scheduler.outbox
+    while True:
+        await asyncio.sleep(IDLE_POLL_INTERVAL)
+        if (
+            scheduler.pending
+            or scheduler.running
+            or not all(queue.idle for queue in scheduler.queues)
+        ):
+            continue
+        if outbox and (outbox.buffered or await outbox.backlog()):
+            continue
+        return
+
+
+async def run_ticks(scheduler, sink: SinkProcessor, ticks: int) -> t.Dict[str, float]:
+    alert_ids = list(scheduler.jobs)
+    started = time.monotonic()
+    for _ in range(ticks):
+        sink.scheduled_at = time.monotonic()
+        scheduler.schedule(alert_ids)
+        await wait_idle(scheduler)
+    elapsed = time.monotonic() - started
+    return {
+        "ticks_per_sec": ticks / elapsed,
+        "alerts_per_sec": ticks * len(alert_ids) / elapsed,
+        "delivered": len(sink.latencies),
+        "delivery_latency_p50": percentile(sink.latencies, 50),
+        "delivery_latency_p95": percentile(sink.latencies, 95),
+        "delivery_latency_p99": percentile(sink.latencies, 99),
+    }
+
+
+async def measure_rps(
+    requests: t.List[t.Callable[[], t.Awaitable[t.Any]]], concurrency: int
+) -> t.Tuple[float, t.List[t.Any]]:
+    """Requests per second and responses of all requests"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(request):
+        async with semaphore:
+            res = await request()
+            res.raise_for_status()
+            return res
+
+    started = time.monotonic()
+    responses = await asyncio.gather(*(call(r) for r in requests))
+    elapsed = time.monotonic() - started
+    return len(responses) / elapsed, responses
+
+
+async def run_api(count: int, concurrency: int) -> t.Dict[str, float]:
+    results = {}
+    async with AsyncClient(app=app_module.api, base_url="http://bench.local") as client:
+
+        def create(i: int):
+            alert = dict(email=f"api{i}@example.com", phrase="api phrase", interval=2)
+            return client.post("/alerts", json=alert)
+
+        creates = [functools.partial(create, i) for i in range(count)]
+        results["POST /alerts"], responses = await measure_rps(creates, concurrency)
+        ids = [res.json()["id"] for res in responses]
+        steps = {
+            "GET /alerts/{alert_id}": lambda i: client.get(f"/alerts/{i}"),
+            "GET /alerts": lambda i: client.get("/alerts", params={"after_id": i}),
+            "PATCH /alerts/{alert_id}": lambda i: client.patch(
+                f"/alerts/{i}", json={"interval": 10}
+            ),
+            "DELETE /alerts/{alert_id}": lambda i: client.delete(f"/alerts/{i}"),
+        }
+        for route, request in steps.items():
+            calls = [functools.partial(request, i) for i in ids]
+            results[route], _ = await measure_rps(calls, concurrency)
+    return results
+
+
+async def run(args: argparse.Namespace) -> dict:
+    fake = FakeBrowseApi(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        fresh_items=True,
+        record_requests=False,
+        seed=args.seed,
+    )
+    await fake.start()
+    workdir = tempfile.mkdtemp(prefix="ebay-alerts-bench-")
+    db_path = os.path.join(workdir, "db.sqlite")
+    os.environ.update(
+        APP_DB_PATH=db_path,
+        APP_EBAY_API_KEY="bench",
+        APP_EBAY_API_URL=fake.api_url,
+        APP_EBAY_RATE_PER_SECOND="1000000",
+        APP_EBAY_DAILY_QUOTA="1000000000",
+        APP_EBAY_MAX_CONCURRENCY=str(args.ebay_concurrency),
+        APP_TICK_WINDOW="0",
+        APP_SEARCH_CACHE_TTL=str(args.cache_ttl),
+        APP_SUBSUMPTION_TTL=str(args.cache_ttl),
+        APP_PUBLISH_SPILL_DIR=os.path.join(workdir, "spill"),
+        APP_LOG_LEVEL="WARNING",
+    )
+    rows = alert_rows(args.alerts, args.phrases, args.alerts_per_email, args.seed)
+    await seed_alerts(db_path, rows)
+
+    sink = SinkProcessor()
+    app_module.get_processors = lambda config, resilience=None: [sink]
+    api = app_module.api
+    try:
+        await api.router.startup()
+        await api.state.loading_task
+        scheduler = api.state.scheduler
+        # Alerts are made due by the benchmark only
+        scheduler.wheel.stop()
+        metrics = {"ready_in": scheduler.ready_in}
+        metrics.update(await run_ticks(scheduler, sink, args.ticks))
+        metrics["searches"] = fake.search_count
+        metrics["api_rps"] = await run_api(args.requests, args.concurrency)
+        metrics["rss_max_mib"] = (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        )
+    finally:
+        await api.router.shutdown()
+        await fake.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    params = {key: value for key, value in vars(args).items() if key not in ("output",)}
+    return {"name": args.name, "params": params, "metrics": metrics}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--name", default="service")
+    parser.add_argument("--alerts", type=int, default=10000)
+    parser.add_argument("--phrases", type=int, default=1000)
+    parser.add_argument("--alerts-per-email", type=int, default=3)
+    parser.add_argument("--ticks", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake eBay latency")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--ebay-concurrency", type=int, default=10)
+    parser.add_argument("--cache-ttl", type=int, default=0)
+    parser.add_argument("--requests", type=int, default=500, help="per API route")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="path of the JSON result")
+    args = parser.parse_args()
+    result = asyncio.get_event_loop().run_until_complete(run(args))
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    sys.stdout.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,25 @@
+import asyncio
 import logging
-from typing import Type
+import time
+import typing as t
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from sqlalchemy import select
 
-from ebay_alerts_service import db
+from ebay_alerts_service import db, metrics
+from ebay_alerts_service.changes import ChangeEvent, ChangeFeed
+from ebay_alerts_service.cluster import Cluster, SqliteMembershipStore
 from ebay_alerts_service.config import Config
+from ebay_alerts_service.diagnostics import LoopMonitor, Profiler
+from ebay_alerts_service.ebay import EbayClient
+from ebay_alerts_service.history import PriceRecorder
+from ebay_alerts_service.outbox import Outbox
 from ebay_alerts_service.processors import get_processors
+from ebay_alerts_service.responses import ResponseCache
 from ebay_alerts_service.routers import alerts
+from ebay_alerts_service.routers import diagnostics as diagnostics_router
+from ebay_alerts_service.routers import metrics as metrics_router
+from ebay_alerts_service.routers import scheduler as scheduler_router
 from ebay_alerts_service.scheduler import AlertsScheduler
 from ebay_alerts_service.utils import setup_logging
 
@@ -15,51 +27,190 @@ logger = logging.getLogger(__name__)
 
 api = FastAPI()
 api.include_router(alerts.router)
+api.include_router(scheduler_router.router)
+api.include_router(metrics_router.router)
+api.include_router(diagnostics_router.router)
 
+ROUTE_PATHS = {route.endpoint: route.path for route in api.routes}
+"""Path templates of routes by endpoint, so requests are counted per route, not per URL"""
 
-async def on_create_object(model: Type[db.Base], obj_id: int):
-    logger.debug(f"Model created: {model}, id: {obj_id}")
-    if model == db.Alert:
-        alert = (
-            await api.state.conn.select(select(model).where(model.id == obj_id))
-        ).scalar()
-        api.state.scheduler.upsert_job(alert)
+REQUEST_DURATIONS: t.Dict[t.Tuple[str, str, int], metrics.HistogramValue] = {}
+"""Children of the request duration histogram by method, route and status"""
 
 
-async def on_update_object(model: Type[db.Base], obj_id: int):
-    logger.debug(f"Model updated: {model}, id: {obj_id}")
-    if model == db.Alert:
-        alert = (
-            await api.state.conn.select(select(model).where(model.id == obj_id))
-        ).scalar()
-        api.state.scheduler.upsert_job(alert)
+@api.middleware("http")
+async def measure_latency(request: Request, call_next):
+    started = time.monotonic()
+    response = await call_next(request)
+    # The router puts matched endpoint into the scope
+    route = ROUTE_PATHS.get(request.scope.get("endpoint"), "unmatched")
+    key = (request.method, route, response.status_code)
+    duration = REQUEST_DURATIONS.get(key)
+    if duration is None:
+        duration = REQUEST_DURATIONS[key] = metrics.API_REQUEST_DURATION.labels(*key)
+    duration.observe(time.monotonic() - started)
+    return response
 
 
-async def on_delete_object(model: Type[db.Base], obj_id: int):
-    logger.debug(f"Model deleted: {model}, id: {obj_id}")
-    if model == db.Alert:
-        api.state.scheduler.delete_job(obj_id)
+RESYNC_DELAY = 1
+"""Delay between attempts to reload owned alerts after failed changes (in seconds)"""
+
+
+def apply_batch(
+    events: t.List[ChangeEvent], scheduler: AlertsScheduler, cluster: Cluster
+) -> int:
+    """Apply changes of alerts to the scheduler, returns the number of changes"""
+    changes = [e for e in events if e.model is db.Alert]
+    # Not owned alerts are dropped too, update could come after rebalance
+    scheduler.delete_jobs(
+        e.id for e in changes if e.kind == "delete" or not cluster.owns(e.id)
+    )
+    scheduler.upsert_jobs(
+        db.Alert(**e.values)
+        for e in changes
+        if e.kind != "delete" and cluster.owns(e.id)
+    )
+    return len(changes)
+
+
+async def apply_changes(
+    feed: ChangeFeed,
+    scheduler: AlertsScheduler,
+    cluster: Cluster,
+    lock: asyncio.Lock,
+    batch_size: int,
+    resync: t.Callable[[], t.Awaitable[int]],
+):
+    """
+    Single consumer of the change feed, it applies committed changes of alerts
+    owned by this instance to the scheduler in batches. If a batch fails, owned alerts
+    are reloaded with resync before the batch is marked applied, so no change is lost.
+    """
+    while True:
+        events = await feed.next_batch(batch_size)
+        try:
+            async with lock:
+                count = apply_batch(events, scheduler, cluster)
+            logger.debug(f"Applied {count} alerts changes")
+        except Exception as e:
+            logger.error("Failed to apply alerts changes, reloading alerts", exc_info=e)
+            while True:
+                try:
+                    await resync()
+                    break
+                except Exception as e:
+                    logger.error("Failed to reload alerts", exc_info=e)
+                    await asyncio.sleep(RESYNC_DELAY)
+        feed.mark_applied(max(e.version for e in events))
+
+
+async def sync_owned_alerts(
+    conn: db.DbConnection,
+    scheduler: AlertsScheduler,
+    cluster: Cluster,
+    lock: asyncio.Lock,
+    chunk_size: int,
+) -> int:
+    """
+    Reload alerts owned by this instance and drop jobs of alerts it doesn't own anymore.
+    Changes committed while reloading wait for the lock and are applied on top.
+    """
+    stmt = select(db.Alert.id, db.Alert.email, db.Alert.phrase, db.Alert.interval)
+    owned = set()
+    async with lock:
+        async for rows in conn.stream(stmt, chunk_size):
+            rows = [row for row in rows if cluster.owns(row.id)]
+            scheduler.upsert_jobs(rows)
+            owned.update(row.id for row in rows)
+        scheduler.delete_jobs([id_ for id_ in scheduler.jobs if id_ not in owned])
+    logger.info(f"Owned alerts: {len(owned)}")
+    return len(owned)
 
 
 @api.on_event("startup")
 async def init_application():
+    started = time.monotonic()
     config = Config()
     setup_logging(config)
+    loop_monitor = None
+    if config.loop_monitor_enabled:
+        loop_monitor = LoopMonitor.from_config(config)
+        loop_monitor.start()
+    api.state.loop_monitor = loop_monitor
+    api.state.profiler = Profiler.from_config(config)
+    feed = ChangeFeed()
     conn = db.DbConnection(
         config.db_path,
-        on_create=on_create_object,
-        on_update=on_update_object,
-        on_delete=on_delete_object,
+        feed=feed,
+        read_pool_size=config.db_read_pool_size,
+        pragmas=dict(
+            db.DEFAULT_PRAGMAS,
+            synchronous=config.db_synchronous,
+            cache_size=-config.db_cache_size,
+            mmap_size=config.db_mmap_size,
+        ),
     )
+    ebay_client = EbayClient(config)
     api.state.config = config
     api.state.conn = conn
-    current_alerts = (await conn.select(select(db.Alert))).scalars()
-    scheduler = AlertsScheduler(config, get_processors(), list(current_alerts))
+    api.state.ebay_client = ebay_client
+    api.state.response_cache = ResponseCache(config.response_cache_max_entries)
+    await conn.create_missing_tables()
+    history = PriceRecorder.from_config(conn, config)
+    api.state.history = history
+    processors = get_processors(config, ebay_client.resilience)
+    outbox = None
+    if config.outbox_enabled:
+        outbox = Outbox.from_config(
+            conn, config, [type(p).__name__ for p in processors]
+        )
+    scheduler = AlertsScheduler(config, processors, [], ebay_client, history, outbox)
     api.state.scheduler = scheduler
+    lock = asyncio.Lock()
+
+    async def rebalance() -> int:
+        return await sync_owned_alerts(
+            conn, scheduler, cluster, lock, config.change_batch_size
+        )
+
+    async def load():
+        """Load owned alerts while the application already serves requests"""
+        count = await rebalance()
+        scheduler.ready_in = time.monotonic() - started
+        logger.info(f"Scheduler is ready in {scheduler.ready_in:.2f}s, alerts: {count}")
+
+    cluster = Cluster(
+        SqliteMembershipStore(conn),
+        rebalance,
+        heartbeat_interval=config.cluster_heartbeat_interval,
+        lease_ttl=config.cluster_lease_ttl,
+        reconcile_interval=config.cluster_reconcile_interval,
+        replicas=config.cluster_replicas,
+    )
+    api.state.cluster = cluster
+    await cluster.join()
+    cluster.start()
+    history.start()
     scheduler.start()
+    api.state.loading_task = asyncio.get_event_loop().create_task(load())
+    api.state.changes_task = asyncio.get_event_loop().create_task(
+        apply_changes(
+            feed, scheduler, cluster, lock, config.change_batch_size, rebalance
+        )
+    )
 
 
 @api.on_event("shutdown")
 async def shutdown_application():
-    await api.state.conn.close()
+    api.state.loading_task.cancel()
+    api.state.changes_task.cancel()
+    await api.state.cluster.leave()
     api.state.scheduler.shutdown()
+    # Delivered results are acked in the outbox, so processors are drained first
+    await api.state.scheduler.close()
+    # Jobs record prices until they are stopped, the recorder is flushed after them
+    await api.state.history.close()
+    await api.state.conn.close()
+    await api.state.ebay_client.close()
+    if api.state.loop_monitor:
+        api.state.loop_monitor.stop()
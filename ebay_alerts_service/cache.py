@@ -0,0 +1,101 @@
+import json
+import logging
+import time
+import typing as t
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CacheKey = t.Tuple[str, str, int]
+
+
+class CacheEntry(t.NamedTuple):
+    items: t.List[dict]
+    size: int
+    expires_at: float
+
+
+class SearchCache:
+    """
+    In-process cache of search results keyed by normalized phrase, sort and limit.
+    Entries are fresh for `ttl` seconds, least recently used entries are evicted
+    when the cache holds more than `max_entries` entries or `max_bytes` bytes
+    (size of an entry is the length of its JSON representation).
+    Expired entries are kept for `max_stale` seconds more to be served while eBay
+    is unavailable.
+    """
+
+    def __init__(
+        self, ttl: float, max_entries: int, max_bytes: int, max_stale: float = 0
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_stale = max_stale
+        self.size = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, phrase: str, sort: str, limit: int) -> t.Optional[t.List[dict]]:
+        """Get fresh search results or None"""
+        key = (phrase, sort, limit)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        now = time.monotonic()
+        if entry.expires_at <= now:
+            if entry.expires_at + self.max_stale <= now:
+                self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.items
+
+    def get_stale(self, phrase: str, sort: str, limit: int) -> t.Optional[t.List[dict]]:
+        """Get search results which expired less than `max_stale` seconds ago"""
+        entry = self._entries.get((phrase, sort, limit))
+        if entry is None or entry.expires_at + self.max_stale <= time.monotonic():
+            return None
+        self.stale_hits += 1
+        return entry.items
+
+    def put(self, phrase: str, sort: str, limit: int, items: t.List[dict]):
+        """Put search results to the cache and evict entries above the limits"""
+        key = (phrase, sort, limit)
+        if key in self._entries:
+            self._remove(key)
+        size = len(json.dumps(items))
+        if size > self.max_bytes:
+            logger.debug(f"Search results for {phrase!r} are too big to cache")
+            return
+        self._entries[key] = CacheEntry(items, size, time.monotonic() + self.ttl)
+        self.size += size
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def stats(self) -> t.Dict[str, int]:
+        """Cache counters"""
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _remove(self, key: CacheKey):
+        entry = self._entries.pop(key)
+        self.size -= entry.size
@@ -0,0 +1,82 @@
+import asyncio
+import typing as t
+from collections import deque
+
+if t.TYPE_CHECKING:
+    from ebay_alerts_service.db import Base
+
+ChangeKind = t.Literal["insert", "update", "delete"]
+
+
+class ChangeEvent(t.NamedTuple):
+    """
+    Committed change of one row
+    """
+
+    version: int
+    """Monotonic version of the change, versions follow commits order"""
+    kind: ChangeKind
+    model: t.Type["Base"]
+    id: int
+    values: t.Optional[t.Dict[str, t.Any]]
+    """Committed values of all row columns, empty for delete"""
+
+
+def merge_events(events: t.Iterable[ChangeEvent]) -> t.List[ChangeEvent]:
+    """Keep only the last change of each row, changes are ordered by version"""
+    last: t.Dict[t.Tuple[t.Type["Base"], int], ChangeEvent] = {}
+    for event in events:
+        last.pop((event.model, event.id), None)
+        last[(event.model, event.id)] = event
+    return list(last.values())
+
+
+class ChangeFeed:
+    """
+    In-process feed of committed changes for a single consumer.
+    Writers publish changes in commit order, the consumer reads all available
+    changes at once, so bursts of writes are applied as one batch.
+    """
+
+    def __init__(self):
+        self.version = 0
+        """Version of the last published change"""
+        self.applied_version = 0
+        """Version of the last change applied by the consumer"""
+        self._events: t.Deque[ChangeEvent] = deque()
+        self._available = asyncio.Event()
+        self._applied = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def publish(
+        self,
+        kind: ChangeKind,
+        model: t.Type["Base"],
+        rows: t.Iterable[t.Tuple[int, t.Optional[t.Dict[str, t.Any]]]],
+    ):
+        """Publish committed changes, rows are pairs of id and column values"""
+        for obj_id, values in rows:
+            self.version += 1
+            self._events.append(ChangeEvent(self.version, kind, model, obj_id, values))
+        self._available.set()
+
+    async def next_batch(self, max_size: int) -> t.List[ChangeEvent]:
+        """Wait for changes and take up to max_size of them, merged by row"""
+        while not self._events:
+            self._available.clear()
+            await self._available.wait()
+        size = min(max_size, len(self._events))
+        return merge_events(self._events.popleft() for _ in range(size))
+
+    def mark_applied(self, version: int):
+        """Called by the consumer when all changes up to version are applied"""
+        self.applied_version = version
+        self._applied.set()
+
+    async def join(self):
+        """Wait until all published changes are applied"""
+        while self.applied_version < self.version:
+            self._applied.clear()
+            await self._applied.wait()
@@ -0,0 +1,188 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import time
+import typing as t
+import uuid
+from abc import ABC, abstractmethod
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+
+from ebay_alerts_service import db
+
+logger = logging.getLogger(__name__)
+
+
+def stable_hash(key: str) -> int:
+    """Hash which is the same in every process, unlike built-in hash of str"""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+def new_member_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class HashRing:
+    """
+    Consistent hashing ring of members with virtual nodes.
+    When member joins or leaves, only alerts of its share of the ring change owner.
+    """
+
+    def __init__(self, members: t.Iterable[str], replicas: int = 64):
+        self.members = frozenset(members)
+        points = sorted(
+            (stable_hash(f"{member}#{i}"), member)
+            for member in self.members
+            for i in range(replicas)
+        )
+        self._hashes = [h for h, _ in points]
+        self._owners = [member for _, member in points]
+
+    def owner(self, alert_id: int) -> t.Optional[str]:
+        """Member which owns the alert"""
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, stable_hash(str(alert_id)))
+        return self._owners[index % len(self._owners)]
+
+
+class MembershipStore(ABC):
+    """
+    Interface for storages of live members
+    """
+
+    @abstractmethod
+    async def heartbeat(self, member_id: str, now: float):
+        """Register member or prolong its lease"""
+        pass
+
+    @abstractmethod
+    async def live_members(self, since: float) -> t.Set[str]:
+        """Members with heartbeat after since, expired members are removed"""
+        pass
+
+    @abstractmethod
+    async def leave(self, member_id: str):
+        """Remove member"""
+        pass
+
+
+class SqliteMembershipStore(MembershipStore):
+    """
+    Members table in the application database
+    """
+
+    def __init__(self, conn: db.DbConnection):
+        self.conn = conn
+
+    async def heartbeat(self, member_id: str, now: float):
+        stmt = insert(db.Member).values(id=member_id, heartbeat_at=now)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[db.Member.id], set_={"heartbeat_at": now}
+        )
+        async with self.conn.session() as session:
+            await session.execute(stmt)
+            await session.commit()
+
+    async def live_members(self, since: float) -> t.Set[str]:
+        async with self.conn.session() as session:
+            await session.execute(
+                delete(db.Member).where(db.Member.heartbeat_at < since)
+            )
+            await session.commit()
+        stmt = select(db.Member.id).where(db.Member.heartbeat_at >= since)
+        return set((await self.conn.select(stmt)).scalars())
+
+    async def leave(self, member_id: str):
+        async with self.conn.session() as session:
+            await session.execute(delete(db.Member).where(db.Member.id == member_id))
+            await session.commit()
+
+
+class Cluster:
+    """
+    Membership of this scheduler instance among all instances (processes or nodes)
+    which share the database. Every instance sends heartbeats, builds the same hash
+    ring from live members and schedules only alerts which it owns on the ring.
+    """
+
+    def __init__(
+        self,
+        store: MembershipStore,
+        on_rebalance: t.Callable[[], t.Awaitable[None]],
+        heartbeat_interval: float,
+        lease_ttl: float,
+        reconcile_interval: float,
+        replicas: int = 64,
+        member_id: t.Optional[str] = None,
+    ):
+        """
+        :param store: storage of live members
+        :param on_rebalance: called when the ring is changed or reconcile is due
+        :param heartbeat_interval: how often heartbeats are sent (in seconds)
+        :param lease_ttl: member without heartbeat for this long is dead (in seconds)
+        :param reconcile_interval: how often owned alerts are reloaded (in seconds)
+        :param replicas: number of virtual nodes of each member
+        :param member_id: unique id of this instance
+        """
+        self.store = store
+        self.on_rebalance = on_rebalance
+        self.heartbeat_interval = heartbeat_interval
+        self.lease_ttl = lease_ttl
+        self.reconcile_interval = reconcile_interval
+        self.replicas = replicas
+        self.member_id = member_id or new_member_id()
+        self.ring = HashRing([self.member_id], replicas)
+        self._reconciled_at = 0.0
+        self._task: t.Optional[asyncio.Task] = None
+
+    def owns(self, alert_id: int) -> bool:
+        """Whether this instance schedules the alert"""
+        return self.ring.owner(alert_id) == self.member_id
+
+    async def join(self):
+        """Register this instance and build the ring"""
+        await self._refresh()
+        self._reconciled_at = time.monotonic()
+        logger.info(f"Joined as {self.member_id}, members: {len(self.ring.members)}")
+
+    def start(self):
+        """Start heartbeats"""
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def leave(self):
+        """Stop heartbeats and unregister this instance"""
+        if self._task:
+            self._task.cancel()
+        await self.store.leave(self.member_id)
+        logger.info(f"Left as {self.member_id}")
+
+    async def _refresh(self) -> bool:
+        """Send heartbeat and rebuild the ring, returns whether the ring is changed"""
+        now = time.time()
+        await self.store.heartbeat(self.member_id, now)
+        members = await self.store.live_members(now - self.lease_ttl)
+        members.add(self.member_id)
+        if members == self.ring.members:
+            return False
+        logger.info(f"Members changed: {len(self.ring.members)} -> {len(members)}")
+        self.ring = HashRing(members, self.replicas)
+        return True
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                changed = await self._refresh()
+                reconcile_due = (
+                    time.monotonic() - self._reconciled_at >= self.reconcile_interval
+                )
+                if changed or reconcile_due:
+                    await self.on_rebalance()
+                    self._reconciled_at = time.monotonic()
+            except Exception as e:
+                logger.error("Cluster heartbeat failed", exc_info=e)
@@ -1,4 +1,4 @@
-from typing import Literal
+from typing import Literal, Optional
 
 from pydantic import BaseSettings
 
@@ -8,10 +8,154 @@ class Config(BaseSettings):
     """eBay API key for their REST API"""
     ebay_api_url: str
     """Base URL for eBay search API"""
+    ebay_client_secret: Optional[str] = None
+    """eBay client secret, if set API key is used as client id to get OAuth application token"""
+    ebay_oauth_url: str = "https://api.ebay.com/identity/v1/oauth2/token"
+    """URL to request eBay OAuth application token"""
+    ebay_oauth_scope: str = "https://api.ebay.com/oauth/api_scope"
+    """Scope of eBay OAuth application token"""
+    ebay_token_refresh_margin: int = 300
+    """How long before expiration OAuth token is refreshed (in seconds)"""
+    ebay_marketplace_id: str = "EBAY_US"
+    """eBay marketplace to search items on"""
+    ebay_pool_size: int = 20
+    """Max number of connections kept open to eBay API"""
+    ebay_keepalive_timeout: float = 30
+    """How long idle connection to eBay API is kept open (in seconds)"""
+    ebay_max_concurrency: int = 10
+    """Max number of concurrent requests to eBay API"""
+    ebay_rate_per_second: float = 5
+    """Max number of requests to eBay API per second"""
+    ebay_daily_quota: int = 5000
+    """Max number of requests to eBay API per day"""
+    ebay_hedge_percentile: Optional[float] = None
+    """Latency percentile of eBay requests after which the second request is sent, disabled if it isn't set"""
+    retries: int = 2
+    """Number of retries of failed eBay requests and processor loads"""
+    retry_base_delay: float = 0.1
+    """Backoff before the first retry, it doubles with every retry and is jittered (in seconds)"""
+    retry_max_delay: float = 2
+    """Max backoff between retries (in seconds)"""
+    breaker_failure_threshold: int = 5
+    """Number of consecutive failures which opens the circuit breaker of eBay API or a processor"""
+    breaker_reset_timeout: float = 30
+    """How long the open circuit breaker rejects calls before the probe call (in seconds)"""
     db_path: str = "data/db.sqlite"
     """Path to the SQLite database"""
+    db_read_pool_size: int = 4
+    """Number of read-only connections to the database"""
+    db_synchronous: Literal["OFF", "NORMAL", "FULL"] = "NORMAL"
+    """SQLite synchronous pragma, NORMAL is durable enough in WAL mode"""
+    db_cache_size: int = 64000
+    """SQLite page cache size of each connection (in KiB)"""
+    db_mmap_size: int = 256 * 1024 * 1024
+    """Size of the database file mapped into memory (in bytes)"""
+    change_batch_size: int = 1000
+    """Max number of committed changes applied to the scheduler at once"""
+    cluster_heartbeat_interval: float = 5
+    """How often the scheduler instance renews its membership (in seconds)"""
+    cluster_lease_ttl: float = 15
+    """Instance without heartbeat for this long leaves the cluster (in seconds)"""
+    cluster_reconcile_interval: float = 60
+    """How often owned alerts are reloaded to pick up other instances writes (in seconds)"""
+    cluster_replicas: int = 64
+    """Number of virtual nodes of every instance on the hash ring"""
+    etag_refresh_interval: float = 1
+    """How often versions of tables written by other instances are read for ETags (in seconds)"""
+    response_cache_max_entries: int = 10000
+    """Max number of serialized API responses cached for the current versions of tables"""
+    loop_monitor_enabled: bool = True
+    """Whether event loop lag is sampled and stacks of blocking calls are captured"""
+    loop_monitor_interval: float = 0.5
+    """How often event loop lag is sampled (in seconds)"""
+    loop_slow_threshold: float = 0.1
+    """Event loop blocked longer than this is reported with the stack (in seconds)"""
+    loop_max_stalls: int = 20
+    """Number of recent event loop stalls kept with their stacks"""
+    profile_dir: str = "profiles"
+    """Directory sampling profiles are written to"""
+    profile_interval: float = 0.005
+    """Time between samples of the profiler (in seconds)"""
+    profile_max_duration: float = 60
+    """Max duration of one sampling profile (in seconds)"""
     request_timeout: int = 10
     """Timeout for any external requests (in seconds)"""
+    job_concurrency: int = 50
+    """Max number of search jobs running at once, the rest wait in the deadline order"""
+    tick_window: float = 1.0
+    """Time window (in seconds) to collect due alerts into one scheduler tick"""
+    schedule_resolution: float = 1.0
+    """Length of one scheduler slot (in seconds), alerts are spread across slots of their interval"""
+    search_cache_ttl: float = 60
+    """How long search results are reused by alerts with the same phrase (in seconds)"""
+    search_cache_max_entries: int = 10000
+    """Max number of search results kept in the cache"""
+    search_cache_max_bytes: int = 64 * 1024 * 1024
+    """Max size of search results kept in the cache (in bytes)"""
+    search_cache_max_stale: float = 3600
+    """How long expired search results are kept to be served while eBay is unavailable (in seconds)"""
+    subsumption_ttl: float = 60
+    """How long complete search results serve narrower phrases (in seconds)"""
+    subsumption_fetch_limit: int = 50
+    """Number of items fetched per search, more items make more result sets complete"""
+    delta_max_items: int = 200
+    """Max number of already sent items remembered for each alert"""
+    history_batch_size: int = 1000
+    """Number of buffered price observations written in one transaction"""
+    history_flush_interval: float = 5
+    """Max time price observations wait in the buffer (in seconds)"""
+    history_retention: float = 2592000
+    """How long raw price observations are kept, rollups are kept forever (in seconds, 0 disables pruning)"""
+    smtp_host: Optional[str] = None
+    """SMTP server to send emails, emails are not sent if it isn't set"""
+    smtp_port: int = 25
+    """SMTP server port"""
+    smtp_user: Optional[str] = None
+    """SMTP user, authentication is skipped if it isn't set"""
+    smtp_password: Optional[str] = None
+    """SMTP password"""
+    smtp_tls: bool = False
+    """Whether connection to SMTP server is encrypted from the start (implicit TLS, usually port 465)"""
+    smtp_starttls: bool = False
+    """Whether plain connection to SMTP server is upgraded with STARTTLS (usually port 587)"""
+    smtp_insecure_auth: bool = False
+    """Whether credentials may be sent over unencrypted connection"""
+    smtp_sender: str = "alerts@localhost"
+    """Sender address of emails"""
+    smtp_pool_size: int = 4
+    """Max number of concurrent SMTP connections"""
+    smtp_batch_size: int = 50
+    """Max number of emails sent over one SMTP connection at once"""
+    digest_window: float = 5
+    """Time window to collect results for the same email into one digest (in seconds)"""
+    render_cache_max_entries: int = 10000
+    """Max number of rendered result sets shared by recipients of identical results"""
+    outbox_enabled: bool = True
+    """Whether results are kept in the durable outbox in the database until processors load them"""
+    outbox_batch_size: int = 1000
+    """Number of rows written or claimed in one transaction"""
+    outbox_flush_interval: float = 0.05
+    """Max time results wait before they are written to the outbox (in seconds)"""
+    outbox_lease: float = 60
+    """How long claimed results aren't claimed again, unless they are delivered (in seconds)"""
+    outbox_max_attempts: int = 5
+    """Results which failed to load this many times aren't claimed anymore and are dead"""
+    outbox_retention: float = 600
+    """How long delivered results are kept to skip duplicates and dead ones for inspection (in seconds)"""
+    outbox_poll_interval: float = 1
+    """How often results added by other instances are checked (in seconds)"""
+    outbox_prune_interval: float = 60
+    """How often delivered results are pruned (in seconds)"""
+    publish_workers: int = 4
+    """Default number of concurrent loads for each processor"""
+    publish_queue_size: int = 10000
+    """Default max number of results waiting for each processor"""
+    publish_overflow: Literal["block", "drop_oldest", "spill"] = "block"
+    """Default policy for new results when processor's queue is full"""
+    publish_spill_dir: str = "data/spill"
+    """Directory for results spilled from full processor queues"""
+    publish_drain_timeout: float = 10
+    """How long to wait for queued results on shutdown (in seconds)"""
     log_level: Literal["DEBUG", "INFO", "WARNING", "ERROR"] = "INFO"
 
     class Config:
@@ -1,21 +1,54 @@
 import asyncio
+import time
 import typing as t
+from contextlib import asynccontextmanager
 
-from sqlalchemy import Column, Integer, String, UniqueConstraint
-from sqlalchemy.engine import Result
+from sqlalchemy import (
+    Column,
+    Float,
+    Index,
+    Integer,
+    String,
+    Text,
+    UniqueConstraint,
+    delete,
+    event,
+    insert,
+    select,
+    update,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Result, Row
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.sql import Select
 
+from ebay_alerts_service.changes import ChangeFeed, ChangeKind
+
 Base = declarative_base()
 
-CALLBACK_FUNCTION_TYPE = t.Callable[[t.Type[Base], int], t.Awaitable[None]]
+BulkStatus = t.Literal["created", "updated", "deleted", "not_found", "conflict"]
+
+DEFAULT_PRAGMAS: t.Dict[str, t.Any] = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    "busy_timeout": 5000,
+}
+"""SQLite pragmas applied to every connection"""
 
 
 class Alert(Base):
     __tablename__ = "alerts"
-    __table_args__ = (UniqueConstraint("email", "phrase"),)
+    __table_args__ = (
+        UniqueConstraint("email", "phrase"),
+        # SQLite indexes include rowid, so they also serve keyset pagination by id
+        Index("ix_alerts_email", "email"),
+        Index("ix_alerts_phrase", "phrase"),
+    )
 
     id = Column(Integer, primary_key=True)
     email = Column(String)
@@ -23,93 +56,391 @@ class Alert(Base):
     interval = Column(Integer)
 
 
-async def noop_callback(model: t.Type[Base], obj_id: int):
-    """Nullable callback for default callback function"""
-    pass
+class TableVersion(Base):
+    """Version of the table, it's bumped by every write through DbConnection"""
+
+    __tablename__ = "table_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+
+class Member(Base):
+    """Live scheduler instance, it owns a part of alerts"""
+
+    __tablename__ = "scheduler_members"
+
+    id = Column(String, primary_key=True)
+    heartbeat_at = Column(Float, index=True)
+    """Unix time of the last heartbeat"""
+
+
+class PriceObservation(Base):
+    """Price of the item found for the normalized search phrase, rows are only appended"""
+
+    __tablename__ = "price_observations"
+    __table_args__ = (
+        Index("ix_price_observations_phrase", "phrase", "observed_at"),
+        Index("ix_price_observations_observed_at", "observed_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    phrase = Column(String, nullable=False)
+    item_id = Column(String)
+    price = Column(Float, nullable=False)
+    observed_at = Column(Float, nullable=False)
+    """Unix time of the search"""
+
+
+class PriceRollup(Base):
+    """Aggregated prices of the normalized search phrase for one time bucket"""
+
+    __tablename__ = "price_rollups"
+
+    phrase = Column(String, primary_key=True)
+    period = Column(String, primary_key=True)
+    """Bucket length: minute, hour or day"""
+    bucket = Column(Integer, primary_key=True)
+    """Unix time of the bucket start"""
+    count = Column(Integer, nullable=False)
+    total = Column(Float, nullable=False)
+    """Sum of prices, average is total / count"""
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
+
+
+class OutboxEntry(Base):
+    """
+    Result waiting for one processor. Rows are claimed with leases,
+    marked as delivered once loaded and pruned after the retention period.
+    """
+
+    __tablename__ = "outbox"
+    __table_args__ = (
+        UniqueConstraint("processor", "idempotency_key"),
+        # Serves both claims (undelivered rows by id) and pruning (delivered rows by time)
+        Index("ix_outbox_processor_delivered", "processor", "delivered_at", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    processor = Column(String, nullable=False)
+    idempotency_key = Column(String, nullable=False)
+    """Alert and tick the result was found in, the same result is added only once"""
+    alert_id = Column(Integer)
+    email = Column(String, nullable=False)
+    phrase = Column(String, nullable=False)
+    result_key = Column(String, nullable=False)
+    """Content address of items in the payloads table"""
+    created_at = Column(Float, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    lease_until = Column(Float, nullable=False, default=0)
+    """Unix time until the row is claimed by a consumer"""
+    lease_token = Column(String)
+    delivered_at = Column(Float)
+
+
+class OutboxPayload(Base):
+    """Items of results in the outbox, stored once for all recipients and processors"""
+
+    __tablename__ = "outbox_payloads"
+
+    key = Column(String, primary_key=True)
+    items = Column(Text, nullable=False)
+    """JSON list of items"""
+    created_at = Column(Float, nullable=False)
+
+
+def row_values(obj: Base) -> t.Dict[str, t.Any]:
+    """Values of all columns of the object"""
+    return {column.key: getattr(obj, column.key) for column in obj.__table__.columns}
+
+
+def set_pragmas(pragmas: t.Dict[str, t.Any]):
+    """Get connect event listener which applies pragmas to a new DBAPI connection"""
+
+    def listener(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return listener
 
 
 class DbConnection:
     """
-    Wrapper for DB connection
+    Wrapper for DB connection.
+    Every operation runs in its own session (unit of work).
+    Writes go through the single writer connection, reads use the separate
+    pool of query-only connections, so in WAL mode they never wait for writers.
+    Committed changes are published to the change feed in commit order,
+    connections without the feed (e.g. of CLI commands) don't publish them.
+    Every write bumps the version of the table in the same transaction, versions
+    written by other instances are picked up when versions are refreshed.
     """
 
     def __init__(
         self,
         db_path: str,
-        on_create: t.Optional[CALLBACK_FUNCTION_TYPE] = None,
-        on_update: t.Optional[CALLBACK_FUNCTION_TYPE] = None,
-        on_delete: t.Optional[CALLBACK_FUNCTION_TYPE] = None,
+        feed: t.Optional[ChangeFeed] = None,
         *args,
+        read_pool_size: int = 4,
+        pragmas: t.Optional[t.Dict[str, t.Any]] = None,
         **kwargs,
     ):
+        pragmas = pragmas or DEFAULT_PRAGMAS
         self._engine: AsyncEngine = create_async_engine(
             f"sqlite+aiosqlite:///{db_path}",
             future=True,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=1,
+            max_overflow=0,
+            *args,
+            **kwargs,
+        )
+        event.listen(self._engine.sync_engine, "connect", set_pragmas(pragmas))
+        self._read_engine: AsyncEngine = create_async_engine(
+            f"sqlite+aiosqlite:///{db_path}",
+            future=True,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=read_pool_size,
+            max_overflow=0,
             *args,
             **kwargs,
         )
-        self.session: AsyncSession = AsyncSession(
-            self._engine, expire_on_commit=False, future=True
+        event.listen(
+            self._read_engine.sync_engine,
+            "connect",
+            set_pragmas(dict(pragmas, query_only="ON")),
         )
-        self.on_create = on_create or noop_callback
-        self.on_update = on_update or noop_callback
-        self.on_delete = on_delete or noop_callback
+        self._write_lock = asyncio.Lock()
+        self.feed = feed
+        self.versions: t.Dict[str, int] = {}
+        """Last known versions of tables"""
+        self._versions_loaded_at = 0.0
 
     async def init_schema(self):
         """Drops existing tables and create all tables from the metadata"""
-        async with self._engine.begin() as conn:
+        async with self._write_lock, self._engine.begin() as conn:
             await conn.run_sync(Base.metadata.drop_all)
             await conn.run_sync(Base.metadata.create_all)
 
+    async def create_missing_tables(self):
+        """Create tables from the metadata which don't exist yet"""
+        async with self._write_lock, self._engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    @asynccontextmanager
+    async def session(self) -> t.AsyncIterator[AsyncSession]:
+        """
+        Session for one unit of work with writes.
+        Writers are serialized, transaction is rolled back on any exception.
+        """
+        async with self._write_lock:
+            async with AsyncSession(
+                self._engine, expire_on_commit=False, future=True
+            ) as session:
+                try:
+                    yield session
+                except BaseException:
+                    await session.rollback()
+                    raise
+
+    @asynccontextmanager
+    async def read_session(self) -> t.AsyncIterator[AsyncSession]:
+        """Session for reads, it uses query-only connections pool"""
+        async with AsyncSession(
+            self._read_engine, expire_on_commit=False, future=True
+        ) as session:
+            yield session
+
+    async def table_version(self, model: t.Type[Base], max_age: float) -> int:
+        """
+        Version of the table, versions are read from the database
+        only if they were read more than max_age seconds ago
+        """
+        if time.monotonic() - self._versions_loaded_at > max_age:
+            self._versions_loaded_at = time.monotonic()
+            rows = await self.select(select(TableVersion.name, TableVersion.version))
+            for name, version in rows:
+                self.versions[name] = max(version, self.versions.get(name, 0))
+        return self.versions.get(model.__tablename__, 0)
+
+    async def bump_version(self, session: AsyncSession, model: t.Type[Base]) -> int:
+        """Increment the version of the table in the transaction of the session"""
+        name = model.__tablename__
+        stmt = sqlite_insert(TableVersion).values(name=name, version=1)
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[TableVersion.name],
+                set_={"version": TableVersion.version + 1},
+            )
+        )
+        stmt = select(TableVersion.version).where(TableVersion.name == name)
+        return (await session.execute(stmt)).scalar_one()
+
+    def _publish(
+        self,
+        kind: ChangeKind,
+        model: t.Type[Base],
+        rows: t.Iterable[t.Tuple[int, t.Optional[t.Dict[str, t.Any]]]],
+    ):
+        """Publish committed changes to the feed, if the connection has one"""
+        if self.feed is not None:
+            self.feed.publish(kind, model, rows)
+
+    def _set_version(self, model: t.Type[Base], version: int):
+        """Remember the version bumped by the committed transaction"""
+        self.versions[model.__tablename__] = version
+
     async def bulk_create(self, entries: t.List[Base]):
         """Insert entries as bulk"""
-        self.session.add_all(entries)
-        await self.session.commit()
+        async with self.session() as session:
+            session.add_all(entries)
+            models = {type(entry) for entry in entries}
+            versions = [(m, await self.bump_version(session, m)) for m in models]
+            await session.commit()
+            for model, version in versions:
+                self._set_version(model, version)
+
+    async def bulk_insert(
+        self, model: t.Type[Base], rows: t.List[t.Dict[str, t.Any]]
+    ) -> t.List[t.Tuple[BulkStatus, t.Optional[int]]]:
+        """
+        Insert rows in one transaction, rows which violate constraints are skipped
+        :return: status and id of each row
+        """
+        results: t.List[t.Tuple[BulkStatus, t.Optional[int]]] = []
+        created = []
+        async with self.session() as session:
+            for values in rows:
+                try:
+                    res = await session.execute(insert(model).values(**values))
+                except IntegrityError:
+                    # SQLite rolls back only the failed statement, not the transaction
+                    results.append(("conflict", None))
+                    continue
+                obj_id = res.inserted_primary_key[0]
+                results.append(("created", obj_id))
+                if self.feed is not None:
+                    created.append((obj_id, dict(values, id=obj_id)))
+            version = await self.bump_version(session, model)
+            await session.commit()
+            self._set_version(model, version)
+            self._publish("insert", model, created)
+        return results
+
+    async def bulk_update(
+        self, model: t.Type[Base], rows: t.List[t.Dict[str, t.Any]]
+    ) -> t.List[t.Tuple[BulkStatus, int]]:
+        """
+        Update rows by their "id" in one transaction,
+        rows which violate constraints are skipped
+        :return: status and id of each row
+        """
+        results: t.List[t.Tuple[BulkStatus, int]] = []
+        async with self.session() as session:
+            ids = [values["id"] for values in rows]
+            current = {
+                obj.id: row_values(obj)
+                for obj in (
+                    await session.execute(select(model).where(model.id.in_(ids)))
+                ).scalars()
+            }
+            updated = {}
+            for values in rows:
+                values = dict(values)
+                obj_id = values.pop("id")
+                if obj_id not in current:
+                    results.append(("not_found", obj_id))
+                    continue
+                if values:
+                    stmt = update(model).where(model.id == obj_id).values(**values)
+                    try:
+                        await session.execute(stmt)
+                    except IntegrityError:
+                        results.append(("conflict", obj_id))
+                        continue
+                current[obj_id].update(values)
+                updated[obj_id] = current[obj_id]
+                results.append(("updated", obj_id))
+            version = await self.bump_version(session, model)
+            await session.commit()
+            self._set_version(model, version)
+            self._publish("update", model, updated.items())
+        return results
+
+    async def bulk_delete(
+        self, model: t.Type[Base], ids: t.List[int]
+    ) -> t.List[t.Tuple[BulkStatus, int]]:
+        """
+        Delete rows by ids in one transaction
+        :return: status and id of each row
+        """
+        async with self.session() as session:
+            existing = set(
+                (await session.execute(select(model.id).where(model.id.in_(ids))))
+                .scalars()
+                .all()
+            )
+            await session.execute(delete(model).where(model.id.in_(existing)))
+            version = await self.bump_version(session, model)
+            await session.commit()
+            self._set_version(model, version)
+            self._publish("delete", model, ((obj_id, None) for obj_id in existing))
+        return [
+            ("deleted" if obj_id in existing else "not_found", obj_id) for obj_id in ids
+        ]
 
     async def create(self, obj: Base) -> Base:
         """Insert an instance to the database"""
-        self.session.add(obj)
-        try:
-            await self.session.commit()
-        except IntegrityError as e:
-            await self.session.rollback()
-            raise e
-
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.on_create(type(obj), obj.id))
+        async with self.session() as session:
+            session.add(obj)
+            await session.flush()
+            version = await self.bump_version(session, type(obj))
+            await session.commit()
+            self._set_version(type(obj), version)
+            self._publish("insert", type(obj), [(obj.id, row_values(obj))])
         return obj
 
     async def update(self, obj: Base, **values):
         """Update the object with given values"""
-        for field, value in values.items():
-            setattr(obj, field, value)
-        try:
-            await self.session.commit()
-        except IntegrityError as e:
-            await self.session.rollback()
-            raise e
-
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.on_update(type(obj), obj.id))
+        async with self.session() as session:
+            obj = await session.merge(obj, load=False)
+            for field, value in values.items():
+                setattr(obj, field, value)
+            await session.flush()
+            version = await self.bump_version(session, type(obj))
+            await session.commit()
+            self._set_version(type(obj), version)
+            self._publish("update", type(obj), [(obj.id, row_values(obj))])
         return obj
 
     async def select(self, stmt: Select) -> Result:
         """Execute select statement and returns results"""
-        return await self.session.execute(stmt)
+        async with self.read_session() as session:
+            return await session.execute(stmt)
+
+    async def stream(
+        self, stmt: Select, chunk_size: int = 1000
+    ) -> t.AsyncIterator[t.List[Row]]:
+        """Execute select statement with server-side cursor and yield rows in chunks"""
+        async with self.read_session() as session:
+            result = await session.stream(stmt)
+            async for rows in result.partitions(chunk_size):
+                yield rows
 
     async def delete(self, obj: Base):
         """Delete object from the database"""
-        try:
-            await self.session.delete(obj)
-            await self.session.commit()
-        except IntegrityError as e:
-            await self.session.rollback()
-            raise e
-
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.on_delete(type(obj), obj.id))
+        async with self.session() as session:
+            await session.delete(await session.merge(obj, load=False))
+            await session.flush()
+            version = await self.bump_version(session, type(obj))
+            await session.commit()
+            self._set_version(type(obj), version)
+            self._publish("delete", type(obj), [(obj.id, None)])
 
     async def close(self):
-        """Close the session and dispose the engine"""
-        await self.session.close()
+        """Dispose the engines"""
         await self._engine.dispose()
+        await self._read_engine.dispose()
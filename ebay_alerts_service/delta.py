@@ -0,0 +1,63 @@
+import typing as t
+from collections import OrderedDict
+
+
+def item_price(item: dict) -> t.Optional[float]:
+    """Price of the item from eBay item summary"""
+    try:
+        return float(item["price"]["value"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class DeltaTracker:
+    """
+    Keeps ids and last seen prices of items which were already sent for each alert,
+    so alert gets only new items or items with dropped price.
+    At most `max_items` most recently seen items are remembered per alert.
+    """
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._seen: t.Dict[int, "OrderedDict[str, t.Optional[float]]"] = {}
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def diff(self, alert_id: int, items: t.List[dict]) -> t.List[dict]:
+        """Items which are new or cheaper than the last time for the alert"""
+        seen = self._seen.get(alert_id)
+        if not seen:
+            return list(items)
+        changed = []
+        for item in items:
+            item_id = item.get("itemId")
+            if item_id not in seen:
+                changed.append(item)
+                continue
+            last_price, price = seen[item_id], item_price(item)
+            if last_price is not None and price is not None and price < last_price:
+                changed.append(item)
+        return changed
+
+    def remember(self, alert_id: int, items: t.List[dict]):
+        """Mark items as sent for the alert"""
+        seen = self._seen.setdefault(alert_id, OrderedDict())
+        for item in items:
+            item_id = item.get("itemId")
+            seen[item_id] = item_price(item)
+            seen.move_to_end(item_id)
+        while len(seen) > self.max_items:
+            seen.popitem(last=False)
+
+    def forget(self, alert_id: int, items: t.List[dict]):
+        """Unmark items which failed to be delivered, so they are sent again"""
+        seen = self._seen.get(alert_id)
+        if not seen:
+            return
+        for item in items:
+            seen.pop(item.get("itemId"), None)
+
+    def reset(self, alert_id: int):
+        """Forget everything sent for the alert"""
+        self._seen.pop(alert_id, None)
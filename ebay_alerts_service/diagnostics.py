@@ -0,0 +1,206 @@
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import typing as t
+
+from ebay_alerts_service import metrics
+
+if t.TYPE_CHECKING:
+    from ebay_alerts_service.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class Stall(t.NamedTuple):
+    started_at: float
+    """Unix time when the loop stopped running callbacks"""
+    duration: float
+    """How long the loop was blocked (in seconds), it's updated until the loop runs again"""
+    stack: t.List[str]
+    """Stack of the loop thread when the stall was detected"""
+
+
+class LoopMonitor:
+    """
+    Health of the event loop. A task wakes up every interval and measures how late it was,
+    which is the lag every callback on the loop had at that moment. A watchdog thread
+    checks how long ago the task should have woken up, and if the loop has been blocked
+    longer than the threshold it captures the stack of the loop thread, which is the
+    blocking call. Both run on timers, so the overhead doesn't depend on the load.
+    """
+
+    def __init__(self, interval: float, slow_threshold: float, max_stalls: int):
+        """
+        :param interval: how often the lag is sampled (in seconds)
+        :param slow_threshold: the loop blocked longer than this is a stall (in seconds)
+        :param max_stalls: number of recent stalls kept with their stacks
+        """
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.stalls_count = 0
+        self.stalls: t.Deque[Stall] = collections.deque(maxlen=max_stalls)
+        self._due = time.monotonic()
+        self._loop_thread_id: t.Optional[int] = None
+        self._task: t.Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+        self._watchdog: t.Optional[threading.Thread] = None
+        self._lag = metrics.LOOP_LAG.labels()
+        self._stalls = metrics.LOOP_STALLS.labels()
+
+    @classmethod
+    def from_config(cls, config: "Config") -> "LoopMonitor":
+        return cls(
+            config.loop_monitor_interval,
+            config.loop_slow_threshold,
+            config.loop_max_stalls,
+        )
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._due = time.monotonic() + self.interval
+        self._task = asyncio.get_event_loop().create_task(self._sample())
+        self._stopped.clear()
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._watchdog.start()
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+        self._stopped.set()
+
+    def stats(self) -> t.Dict[str, t.Any]:
+        return {
+            "lag": self.lag,
+            "max_lag": self.max_lag,
+            "stalls": self.stalls_count,
+            "recent_stalls": [stall._asdict() for stall in list(self.stalls)],
+        }
+
+    async def _sample(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lag = max(now - self._due, 0.0)
+            self.max_lag = max(self.max_lag, self.lag)
+            self._lag.observe(self.lag)
+            self._due = now + self.interval
+
+    def _watch(self):
+        # Checks twice per threshold, so stalls are detected at most half of it late
+        period = min(self.interval, self.slow_threshold / 2)
+        reported = None
+        while not self._stopped.wait(period):
+            due = self._due
+            blocked = time.monotonic() - due
+            if blocked < self.slow_threshold:
+                continue
+            if reported == due:
+                # The same stall, its duration grows until the loop runs again
+                self.stalls[-1] = self.stalls[-1]._replace(duration=blocked)
+                continue
+            reported = due
+            self._record_stall(blocked)
+
+    def _record_stall(self, blocked: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = traceback.format_stack(frame) if frame else []
+        self.stalls.append(Stall(time.time() - blocked, blocked, stack))
+        self.stalls_count += 1
+        self._stalls.inc()
+        logger.warning(
+            f"Event loop is blocked for {blocked:.3f}s:\n{''.join(stack[-5:])}"
+        )
+
+
+def task_counts(loop: t.Optional[asyncio.AbstractEventLoop] = None) -> t.Dict[str, int]:
+    """Number of pending tasks by name of their coroutine"""
+    counts: t.Counter[str] = collections.Counter()
+    for task in asyncio.all_tasks(loop or asyncio.get_event_loop()):
+        coro = task.get_coro()
+        counts[getattr(coro, "__qualname__", type(coro).__name__)] += 1
+    return dict(counts.most_common())
+
+
+def frame_key(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+class Profiler:
+    """
+    Sampling profiler of one thread. Another thread reads the stack of the profiled one
+    every interval and counts identical stacks, so the profiled code isn't slowed down
+    apart from the GIL taken by sampling. The profile is written in the collapsed stack
+    format ("outer;inner count" lines) read by flamegraph.pl and speedscope.
+    Only one profile is recorded at a time.
+    """
+
+    def __init__(self, output_dir: str, interval: float, max_duration: float):
+        """
+        :param output_dir: directory the profiles are written to
+        :param interval: time between samples (in seconds)
+        :param max_duration: max duration of one profile (in seconds)
+        """
+        self.output_dir = output_dir
+        self.interval = interval
+        self.max_duration = max_duration
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: "Config") -> "Profiler":
+        return cls(
+            config.profile_dir, config.profile_interval, config.profile_max_duration
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def profile(self, duration: float) -> t.Dict[str, t.Any]:
+        """Record the profile of the event loop thread for duration seconds"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("Profile is already being recorded")
+        try:
+            thread_id = threading.get_ident()
+            duration = min(duration, self.max_duration)
+            return await asyncio.get_event_loop().run_in_executor(
+                None, self._record, thread_id, duration
+            )
+        finally:
+            self._lock.release()
+
+    def _record(self, thread_id: int, duration: float) -> t.Dict[str, t.Any]:
+        stacks: t.Counter[str] = collections.Counter()
+        samples = 0
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            keys = []
+            while frame is not None:
+                keys.append(frame_key(frame))
+                frame = frame.f_back
+            stacks[";".join(reversed(keys))] += 1
+            samples += 1
+            time.sleep(self.interval)
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = time.strftime(f"profile-%Y%m%d-%H%M%S-{os.getpid()}.folded")
+        path = os.path.join(self.output_dir, name)
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info(f"Profile of {samples} samples is written to {path}")
+        return {
+            "path": os.path.abspath(path),
+            "duration": duration,
+            "samples": samples,
+            "stacks": len(stacks),
+        }
@@ -0,0 +1,276 @@
+import asyncio
+import functools
+import logging
+import time
+import typing as t
+
+import aiohttp
+
+from ebay_alerts_service import metrics
+from ebay_alerts_service.resilience import Resilience
+
+if t.TYPE_CHECKING:
+    from ebay_alerts_service.config import Config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SORT = "price"
+"""Sort order of search results, the cheapest items go first"""
+DEFAULT_LIMIT = 20
+"""Number of items in search results"""
+
+
+class EbayError(Exception):
+    """Raised when eBay API responds with an unexpected status"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"eBay API error {status}: {message}")
+        self.status = status
+
+
+def retriable(exc: Exception) -> bool:
+    """Server errors, throttling, timeouts and connection errors are worth retrying"""
+    if isinstance(exc, EbayError):
+        return exc.status >= 500 or exc.status == 429
+    return isinstance(exc, (asyncio.TimeoutError, aiohttp.ClientError))
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter.
+    Bucket holds up to `capacity` tokens and is refilled with `rate` tokens per second.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    async def acquire(self):
+        """Take one token, waits until the token is available"""
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def try_acquire(self) -> bool:
+        """Take one token if it's available right away"""
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def release(self):
+        """Return the token which wasn't used"""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class EbayClient:
+    """
+    Shared client for eBay Browse API.
+    All requests go through one keep-alive connection pool, limited by global
+    concurrency and token buckets for per-second and daily eBay quotas.
+    OAuth application token is cached and refreshed before it expires.
+    Searches go through the circuit breaker with retries and hedging,
+    so jobs fail fast instead of waiting out the timeout while eBay is down.
+    """
+
+    def __init__(self, config: "Config", resilience: t.Optional[Resilience] = None):
+        self.config = config
+        self.resilience = resilience or Resilience.from_config(config)
+        self.semaphore = asyncio.Semaphore(config.ebay_max_concurrency)
+        self.per_second_limit = TokenBucket(
+            config.ebay_rate_per_second, config.ebay_rate_per_second
+        )
+        self.daily_limit = TokenBucket(
+            config.ebay_daily_quota / 86400, config.ebay_daily_quota
+        )
+        self._session: t.Optional[aiohttp.ClientSession] = None
+        self._token: t.Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_lock = asyncio.Lock()
+        self._refresh_handle: t.Optional[asyncio.TimerHandle] = None
+        self._refresh_task: t.Optional[asyncio.Task] = None
+        self._request_duration = metrics.EBAY_REQUEST_DURATION.labels()
+        self._requests: t.Dict[t.Union[int, str], metrics.CounterValue] = {}
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Connection pool shared by all requests"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.config.ebay_pool_size,
+                keepalive_timeout=self.config.ebay_keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.config.request_timeout),
+            )
+        return self._session
+
+    async def search(
+        self, phrase: str, limit: int = DEFAULT_LIMIT, sort: str = DEFAULT_SORT
+    ) -> t.List[dict]:
+        """
+        Search items with given phrase
+        :param phrase: search phrase
+        :param limit: max number of items to return
+        :param sort: sort order
+        :return: list of item summaries
+        """
+        items, _ = await self.search_page(phrase, limit, sort)
+        return items
+
+    async def search_page(
+        self, phrase: str, limit: int = DEFAULT_LIMIT, sort: str = DEFAULT_SORT
+    ) -> t.Tuple[t.List[dict], t.Optional[int]]:
+        """
+        Search items with given phrase
+        :return: list of item summaries and total number of matching items
+        """
+        return await self.resilience.call(
+            "ebay_search",
+            functools.partial(self._search_page, phrase, limit, sort),
+            retriable,
+        )
+
+    async def _search_page(
+        self, phrase: str, limit: int, sort: str
+    ) -> t.Tuple[t.List[dict], t.Optional[int]]:
+        """One attempt of the search, every retry takes rate limit tokens again"""
+        await self.daily_limit.acquire()
+        await self.per_second_limit.acquire()
+        token = await self.get_token()
+        async with self.semaphore:
+            # Only the request is hedged, so the hedge percentile is eBay latency
+            data = await self.resilience.hedged(
+                "ebay_search",
+                functools.partial(self._request, phrase, limit, sort, token),
+                self._may_hedge,
+                functools.partial(self._hedge_request, phrase, limit, sort, token),
+            )
+        return data.get("itemSummaries", []), data.get("total")
+
+    def _may_hedge(self) -> bool:
+        """
+        Hedged request is sent only if rate limit tokens are available right away,
+        it doesn't wait for them, and the concurrency limit isn't reached
+        """
+        if self.semaphore.locked() or not self.daily_limit.try_acquire():
+            return False
+        if not self.per_second_limit.try_acquire():
+            self.daily_limit.release()
+            return False
+        return True
+
+    async def _hedge_request(
+        self, phrase: str, limit: int, sort: str, token: str
+    ) -> dict:
+        """
+        Hedged request takes its own concurrency slot, it's free when the hedge is
+        decided, so requests in flight never exceed the concurrency limit
+        """
+        async with self.semaphore:
+            return await self._request(phrase, limit, sort, token)
+
+    async def _request(self, phrase: str, limit: int, sort: str, token: str) -> dict:
+        started = time.monotonic()
+        status = "error"
+        try:
+            async with self.session.get(
+                f"{self.config.ebay_api_url}/item_summary/search",
+                params={"q": phrase, "sort": sort, "limit": str(limit)},
+                headers={
+                    "Authorization": f"Bearer {token}",
+                    "X-EBAY-C-MARKETPLACE-ID": self.config.ebay_marketplace_id,
+                },
+            ) as response:
+                status = response.status
+                if response.status != 200:
+                    raise EbayError(response.status, await response.text())
+                return await response.json()
+        finally:
+            self._request_duration.observe(time.monotonic() - started)
+            counter = self._requests.get(status)
+            if counter is None:
+                counter = self._requests[status] = metrics.EBAY_REQUESTS.labels(status)
+            counter.inc()
+
+    async def get_token(self) -> str:
+        """
+        Get OAuth application token.
+        Without client secret the API key is used as a token as is.
+        """
+        if not self.config.ebay_client_secret:
+            return self.config.ebay_api_key
+        if self._token and time.monotonic() < self._token_expires_at:
+            return self._token
+        async with self._token_lock:
+            if self._token and time.monotonic() < self._token_expires_at:
+                return self._token
+            await self._refresh_token()
+        return self._token
+
+    async def _refresh_token(self):
+        auth = aiohttp.BasicAuth(
+            self.config.ebay_api_key, self.config.ebay_client_secret
+        )
+        async with self.session.post(
+            self.config.ebay_oauth_url,
+            auth=auth,
+            data={
+                "grant_type": "client_credentials",
+                "scope": self.config.ebay_oauth_scope,
+            },
+        ) as response:
+            if response.status != 200:
+                raise EbayError(response.status, await response.text())
+            data = await response.json()
+        self._token = data["access_token"]
+        # Token is considered expired a bit earlier to never send a stale one
+        lifetime = max(
+            0, int(data["expires_in"]) - self.config.ebay_token_refresh_margin
+        )
+        self._token_expires_at = time.monotonic() + lifetime
+        if lifetime:
+            self._schedule_refresh(lifetime)
+        logger.debug(f"eBay token refreshed, expires in {data['expires_in']}s")
+
+    def _schedule_refresh(self, delay: float):
+        if self._refresh_handle:
+            self._refresh_handle.cancel()
+        loop = asyncio.get_event_loop()
+        self._refresh_handle = loop.call_later(delay, self._start_proactive_refresh)
+
+    def _start_proactive_refresh(self):
+        self._refresh_task = asyncio.get_event_loop().create_task(
+            self._proactive_refresh()
+        )
+
+    async def _proactive_refresh(self):
+        async with self._token_lock:
+            try:
+                await self._refresh_token()
+            except Exception as e:
+                logger.error("Proactive eBay token refresh failed", exc_info=e)
+
+    async def close(self):
+        """Close connection pool"""
+        if self._refresh_handle:
+            self._refresh_handle.cancel()
+            self._refresh_handle = None
+        if self._refresh_task:
+            self._refresh_task.cancel()
+        if self._session is not None:
+            await self._session.close()
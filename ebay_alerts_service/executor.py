@@ -0,0 +1,126 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+DURATION_SMOOTHING = 0.1
+"""Weight of the last job in the moving average of job durations"""
+
+
+class JobExecutor:
+    """
+    Runs jobs with the global concurrency limit. Waiting jobs are ordered by
+    round, deadline and priority. Every key (email) gets the next round with each
+    of its jobs, so a key with hundreds of jobs gets one job per round like any other
+    and can't starve them. Jobs which can't finish before their deadline anymore
+    are shed instead of being started late.
+    """
+
+    def __init__(self, limit: int):
+        """
+        :param limit: max number of jobs running at once
+        """
+        self.limit = limit
+        self.running = 0
+        self.started = 0
+        self.shed = 0
+        self.avg_duration = 0.0
+        """Moving average of job durations (in seconds)"""
+        self._heap: t.List[tuple] = []
+        self._seq = itertools.count()
+        self._rounds: t.Dict[str, int] = {}
+        self._round = 0
+        self._tasks: t.Set[asyncio.Task] = set()
+        self._dispatch_handle: t.Optional[asyncio.Handle] = None
+
+    def __len__(self) -> int:
+        """Number of waiting jobs"""
+        return len(self._heap)
+
+    def submit(
+        self,
+        keys: t.Sequence[str],
+        deadline: float,
+        run: t.Callable[[], t.Awaitable[None]],
+        on_shed: t.Callable[[], None],
+        priority: int = 0,
+    ):
+        """
+        Queue the job
+        :param keys: keys which share the fairness, job takes the earliest round among them
+        :param deadline: monotonic time when job's result is useless
+        :param run: job itself
+        :param on_shed: called instead of the job when it's shed
+        :param priority: jobs with the same round and deadline go in the order of priority
+        """
+        rounds = [max(self._rounds.get(key, 0), self._round) for key in keys]
+        for key, key_round in zip(keys, rounds):
+            self._rounds[key] = key_round + 1
+        job_round = min(rounds, default=self._round)
+        heapq.heappush(
+            self._heap, (job_round, deadline, priority, next(self._seq), run, on_shed)
+        )
+        self._prune_rounds()
+        # Jobs submitted together (one tick) are ordered before any of them starts
+        if self._dispatch_handle is None:
+            self._dispatch_handle = asyncio.get_event_loop().call_soon(self._dispatch)
+
+    def stop(self):
+        """Drop waiting jobs and cancel running ones"""
+        self._heap.clear()
+        if self._dispatch_handle:
+            self._dispatch_handle.cancel()
+            self._dispatch_handle = None
+        for task in self._tasks:
+            task.cancel()
+
+    def stats(self) -> t.Dict[str, t.Any]:
+        return {
+            "limit": self.limit,
+            "running": self.running,
+            "queued": len(self._heap),
+            "started": self.started,
+            "shed": self.shed,
+            "avg_duration": self.avg_duration,
+        }
+
+    def _dispatch(self):
+        self._dispatch_handle = None
+        now = time.monotonic()
+        while self.running < self.limit and self._heap:
+            job_round, deadline, _, _, run, on_shed = heapq.heappop(self._heap)
+            self._round = max(self._round, job_round)
+            if now + self.avg_duration > deadline:
+                self.shed += 1
+                on_shed()
+                continue
+            self.running += 1
+            self.started += 1
+            task = asyncio.get_event_loop().create_task(self._run(run))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, run: t.Callable[[], t.Awaitable[None]]):
+        started = time.monotonic()
+        try:
+            await run()
+        except Exception as e:
+            logger.error("Job failed", exc_info=e)
+        finally:
+            self.running -= 1
+            duration = time.monotonic() - started
+            self.avg_duration += DURATION_SMOOTHING * (duration - self.avg_duration)
+            self._dispatch()
+
+    def _prune_rounds(self):
+        """Forget keys which are not ahead of the current round"""
+        if len(self._rounds) > 4 * len(self._heap) + 1024:
+            self._rounds = {
+                key: key_round
+                for key, key_round in self._rounds.items()
+                if key_round > self._round
+            }
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import time
+import typing as t
+
+from sqlalchemy import delete, func, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from ebay_alerts_service import db
+from ebay_alerts_service.delta import item_price
+
+if t.TYPE_CHECKING:
+    from ebay_alerts_service.config import Config
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"minute": 60, "hour": 3600, "day": 86400}
+"""Length of rollup buckets (in seconds)"""
+PRUNE_INTERVAL = 600
+"""How often raw observations older than the retention are deleted (in seconds)"""
+
+Observation = t.Tuple[str, t.Optional[str], float, float]
+"""Phrase, item id, price and unix time of the observation"""
+
+
+def rollups(observations: t.List[Observation]) -> t.List[t.Dict[str, t.Any]]:
+    """Aggregate observations into buckets of every period"""
+    buckets: t.Dict[t.Tuple[str, str, int], t.Dict[str, t.Any]] = {}
+    for phrase, _, price, observed_at in observations:
+        for period, length in PERIODS.items():
+            bucket = int(observed_at // length * length)
+            row = buckets.get((phrase, period, bucket))
+            if row is None:
+                buckets[phrase, period, bucket] = dict(
+                    phrase=phrase,
+                    period=period,
+                    bucket=bucket,
+                    count=1,
+                    total=price,
+                    min=price,
+                    max=price,
+                )
+                continue
+            row["count"] += 1
+            row["total"] += price
+            row["min"] = min(row["min"], price)
+            row["max"] = max(row["max"], price)
+    return list(buckets.values())
+
+
+def upsert_rollup():
+    """Statement which adds aggregates of the batch to the stored bucket"""
+    stmt = sqlite_insert(db.PriceRollup)
+    table = db.PriceRollup.__table__.c
+    return stmt.on_conflict_do_update(
+        index_elements=[table.phrase, table.period, table.bucket],
+        set_={
+            "count": table.count + stmt.excluded.count,
+            "total": table.total + stmt.excluded.total,
+            "min": func.min(table.min, stmt.excluded.min),
+            "max": func.max(table.max, stmt.excluded.max),
+        },
+    )
+
+
+class PriceRecorder:
+    """
+    Buffered writer of price observations. Observations are kept in memory and
+    written in batches, every batch is one transaction (group commit) which appends
+    raw rows and adds the batch aggregates to minute, hour and day rollups,
+    so insights are read from rollups and never scan raw rows. Raw rows older than
+    the retention are deleted with the flush, rollups are kept.
+    """
+
+    def __init__(
+        self,
+        conn: db.DbConnection,
+        batch_size: int,
+        flush_interval: float,
+        retention: float = 0,
+    ):
+        """
+        :param conn: database connection
+        :param batch_size: number of buffered observations which triggers the flush
+        :param flush_interval: max time observations wait in the buffer (in seconds)
+        :param retention: how long raw observations are kept (in seconds), 0 keeps them forever
+        """
+        self.conn = conn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self.pruned = 0
+        self._pruned_at = 0.0
+        self.written = 0
+        self.failed = 0
+        self._buffer: t.List[Observation] = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: t.Optional[asyncio.Task] = None
+        self._task: t.Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(cls, conn: db.DbConnection, config: "Config") -> "PriceRecorder":
+        return cls(
+            conn,
+            config.history_batch_size,
+            config.history_flush_interval,
+            config.history_retention,
+        )
+
+    def record(
+        self, phrase: str, items: t.List[dict], observed_at: t.Optional[float] = None
+    ):
+        """Buffer prices of items found for the normalized phrase"""
+        observed_at = observed_at or time.time()
+        for item in items:
+            price = item_price(item)
+            if price is not None:
+                self._buffer.append((phrase, item.get("itemId"), price, observed_at))
+        if len(self._buffer) >= self.batch_size and not self._flush_task:
+            self._flush_task = asyncio.get_event_loop().create_task(self.flush())
+            self._flush_task.add_done_callback(self._flushed)
+
+    def start(self):
+        """Start periodic flushes"""
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def flush(self):
+        """Write buffered observations and their rollups in one transaction"""
+        async with self._flush_lock:
+            batch, self._buffer = self._buffer, []
+            if not batch:
+                return
+            try:
+                async with self.conn.session() as session:
+                    await session.execute(
+                        insert(db.PriceObservation),
+                        [
+                            dict(phrase=p, item_id=i, price=price, observed_at=at)
+                            for p, i, price, at in batch
+                        ],
+                    )
+                    await session.execute(upsert_rollup(), rollups(batch))
+                    await self._prune(session)
+                    await session.commit()
+                self.written += len(batch)
+                logger.debug(f"Price observations written: {len(batch)}")
+            except Exception as e:
+                # History is best effort, it must not block the alerts
+                self.failed += len(batch)
+                logger.error("Failed to write price observations", exc_info=e)
+
+    async def close(self):
+        """Stop periodic flushes and write what's left in the buffer"""
+        if self._task:
+            self._task.cancel()
+        await self.flush()
+
+    async def _prune(self, session):
+        if not self.retention or time.monotonic() - self._pruned_at < PRUNE_INTERVAL:
+            return
+        self._pruned_at = time.monotonic()
+        res = await session.execute(
+            delete(db.PriceObservation)
+            .where(db.PriceObservation.observed_at < time.time() - self.retention)
+            .execution_options(synchronize_session=False)
+        )
+        self.pruned += res.rowcount
+        logger.debug(f"Price observations pruned: {res.rowcount}")
+
+    def _flushed(self, task: asyncio.Task):
+        self._flush_task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
@@ -0,0 +1,83 @@
+import csv
+import itertools
+import json
+import logging
+import typing as t
+
+from pydantic import ValidationError
+
+from ebay_alerts_service import db
+from ebay_alerts_service.routers.models.alerts import CreateAlert
+
+logger = logging.getLogger(__name__)
+
+
+class ImportStats(t.NamedTuple):
+    created: int
+    conflicts: int
+    invalid: int
+
+
+def read_rows(path: str, invalid: t.List[int]) -> t.Iterator[t.Tuple[int, dict]]:
+    """
+    Read rows one by one from CSV (by extension) or NDJSON file with their line numbers,
+    line numbers of malformed NDJSON lines are put to invalid
+    """
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                logger.warning(f"Line {number} skipped: {e}")
+                invalid.append(number)
+                continue
+            if not isinstance(row, dict):
+                logger.warning(f"Line {number} skipped: it isn't an object")
+                invalid.append(number)
+                continue
+            yield number, row
+
+
+def validate_rows(
+    rows: t.Iterable[t.Tuple[int, dict]], invalid: t.List[int]
+) -> t.Iterator[dict]:
+    """Skip rows which aren't valid alerts, their line numbers are put to invalid"""
+    for number, row in rows:
+        interval = row.get("interval")
+        if isinstance(interval, str) and interval.strip().isdigit():
+            # CSV values are strings
+            row["interval"] = int(interval)
+        try:
+            yield CreateAlert(**row).dict()
+        except (ValidationError, TypeError) as e:
+            logger.warning(f"Line {number} skipped: {e}")
+            invalid.append(number)
+
+
+async def import_alerts(
+    conn: db.DbConnection, path: str, chunk_size: int = 1000
+) -> ImportStats:
+    """
+    Stream alerts from the file into the database.
+    Each chunk is inserted in one transaction, only one chunk is kept in memory.
+    """
+    created = conflicts = 0
+    invalid: t.List[int] = []
+    rows = validate_rows(read_rows(path, invalid), invalid)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        results = await conn.bulk_insert(db.Alert, chunk)
+        chunk_created = sum(1 for status, _ in results if status == "created")
+        created += chunk_created
+        conflicts += len(results) - chunk_created
+        logger.info(f"Imported {created} alerts, {conflicts} conflicts")
+    return ImportStats(created, conflicts, len(invalid))
@@ -4,12 +4,21 @@ import typing as t
 
 from pydantic import BaseModel, EmailStr
 
+from ebay_alerts_service import metrics
+from ebay_alerts_service.ebay import DEFAULT_LIMIT, DEFAULT_SORT
+from ebay_alerts_service.render import ResultKeys
+from ebay_alerts_service.resilience import CircuitOpenError
+
 if t.TYPE_CHECKING:
+    from ebay_alerts_service.cache import SearchCache
     from ebay_alerts_service.config import Config
-    from ebay_alerts_service.scheduler import JobParams
+    from ebay_alerts_service.delta import DeltaTracker
+    from ebay_alerts_service.registry import JobParams
 
 logger = logging.getLogger(__name__)
 
+STALE_SEARCHES = metrics.SEARCHES.labels("stale")
+
 
 class AlertJobResult(BaseModel):
     """
@@ -17,33 +26,101 @@ class AlertJobResult(BaseModel):
     """
 
     email: EmailStr
+    phrase: str
     results: t.List[dict]
+    key: t.Optional[str] = None
+    """Content address of the results shown for the phrase, processors reuse renders by it"""
+    alert_id: t.Optional[int] = None
+    idempotency_key: t.Optional[str] = None
+    """Alert and tick the result was found in, it's set for results from the outbox"""
+
+
+def normalize_phrase(phrase: str) -> str:
+    """
+    Normalize search phrase, so alerts with the same search could share one eBay call
+    """
+    return " ".join(phrase.lower().split())
+
+
+async def get_results(
+    phrase: str,
+    search: t.Callable[[str], t.Awaitable[t.List[dict]]],
+    cache: "SearchCache",
+) -> t.List[dict]:
+    """
+    Cached results or results of the search,
+    stale cached results are used while the eBay circuit breaker is open
+    """
+    results = cache.get(phrase, DEFAULT_SORT, DEFAULT_LIMIT)
+    if results is not None:
+        return results
+    try:
+        results = await search(phrase)
+    except CircuitOpenError:
+        results = cache.get_stale(phrase, DEFAULT_SORT, DEFAULT_LIMIT)
+        if results is None:
+            raise
+        STALE_SEARCHES.inc()
+        return results
+    cache.put(phrase, DEFAULT_SORT, DEFAULT_LIMIT, results)
+    return results
 
 
 async def alert_job(
-    job_params: "JobParams",
+    phrase: str,
+    subscribers: t.List["JobParams"],
+    search: t.Callable[[str], t.Awaitable[t.List[dict]]],
+    cache: "SearchCache",
+    delta: "DeltaTracker",
     on_result: t.Callable[[AlertJobResult], t.Awaitable[None]],
     on_error: t.Callable[["JobParams", Exception], t.Awaitable[None]],
-    sync_lock: asyncio.Lock,
     config: "Config",
 ):
     """
-    Checks the eBay API, get the results list and send it to the result callback
-    :param job_params: contains JobParams instance with details about this job
+    Checks the cache or the eBay API once for the phrase and send new or cheaper
+    items to the result callback for each subscribed alert
+    :param phrase: normalized search phrase shared by all subscribers
+    :param subscribers: list of JobParams for alerts which are due in this tick
+    :param search: function to search items on eBay with given phrase
+    :param cache: cache of search results, checked before the search
+    :param delta: tracker of items already sent to each alert
     :param on_result: callback function to call with results
     :param on_error: callback function to call with any errors
-    :param sync_lock: lock to keep one instance of each cron job at a time
     :param config: instance of application settings
     """
-    if sync_lock.locked():
-        logger.debug(f"Cron job locked for {job_params}. Skipping.")
+    try:
+        results = await get_results(phrase, search, cache)
+    except Exception as e:
+        for job_params in subscribers:
+            await on_error(job_params, e)
+        logger.error(f"Search failed; phrase: {phrase!r}")
         return
 
-    async with sync_lock:
+    keys = ResultKeys(results)
+
+    async def send(job_params: "JobParams"):
+        changed = delta.diff(job_params.id, results)
+        if not changed:
+            delta.remember(job_params.id, results)
+            logger.debug(f"No new items for {job_params}. Skipping.")
+            return
         try:
-            result = AlertJobResult(email=job_params.email, results=[])
-            await on_result(result)
-            logger.info(f"Job finished: {job_params}")
+            # Alerts were validated before they were stored, so results of all
+            # subscribers share the items instead of copying them in the validation
+            await on_result(
+                AlertJobResult.construct(
+                    email=job_params.email,
+                    phrase=job_params.phrase,
+                    results=changed,
+                    key=keys.key(job_params.phrase, changed),
+                    alert_id=job_params.id,
+                )
+            )
+            # Scheduler forgets the items if their delivery fails
+            delta.remember(job_params.id, results)
         except Exception as e:
             await on_error(job_params, e)
             logger.error(f"Job failed; params: {job_params}")
+
+    await asyncio.gather(*(send(job_params) for job_params in subscribers))
+    logger.info(f"Job finished: phrase={phrase!r}, subscribers={len(subscribers)}")
@@ -0,0 +1,280 @@
+import bisect
+import math
+import typing as t
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: t.Sequence[str], values: t.Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{escape_label(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class GaugeValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+
+class HistogramValue:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: t.Tuple[float, ...]):
+        self.bounds = bounds
+        # The last count is for values above all bounds (+Inf bucket)
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Metric:
+    """
+    Base class of metrics. Values of every label combination are kept in children,
+    hot paths should get their child with `labels` once and update it directly.
+    The application runs in a single event loop thread, so values are plain
+    attributes updated without locks.
+    """
+
+    type = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: t.Sequence[str] = (),
+        registry: t.Optional["Registry"] = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children: t.Dict[t.Tuple[str, ...], t.Any] = {}
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values: t.Any):
+        """Child with values of the given labels, it's created on first use"""
+        key = tuple(str(value) for value in values)
+        child = self.children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self.children[key] = self._new_child()
+        return child
+
+    def clear(self):
+        """Remove all children, used for metrics which are collected on scrape"""
+        self.children.clear()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self) -> t.Iterator[t.Tuple[str, str, float]]:
+        """Name suffix, labels and value of every sample"""
+        for key, child in sorted(self.children.items()):
+            yield "", format_labels(self.labelnames, key), child.value
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self) -> CounterValue:
+        return CounterValue()
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def _new_child(self) -> GaugeValue:
+        return GaugeValue()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: t.Sequence[str] = (),
+        buckets: t.Sequence[float] = DEFAULT_BUCKETS,
+        registry: t.Optional["Registry"] = None,
+    ):
+        self.buckets = tuple(sorted(float(bound) for bound in buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> HistogramValue:
+        return HistogramValue(self.buckets)
+
+    def samples(self) -> t.Iterator[t.Tuple[str, str, float]]:
+        for key, child in sorted(self.children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                labels = format_labels(
+                    self.labelnames + ("le",), key + (format_value(bound),)
+                )
+                yield "_bucket", labels, cumulative
+            labels = format_labels(self.labelnames, key)
+            yield "_sum", labels, child.sum
+            yield "_count", labels, cumulative
+
+
+class Registry:
+    """
+    Collection of metrics rendered in the Prometheus text format
+    """
+
+    def __init__(self):
+        self.metrics: t.Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self.metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+SCHEDULE_LAG = Histogram(
+    "scheduler_lag_seconds",
+    "Delay between the planned and the actual time alerts became due",
+    ["interval"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0),
+)
+SCHEDULED_ALERTS = Gauge("scheduler_alerts", "Number of scheduled alerts", ["interval"])
+RUNNING_ALERTS = Gauge(
+    "scheduler_running_alerts", "Number of alerts which jobs are running now"
+)
+SKIPPED_ALERTS = Counter(
+    "scheduler_skipped_total",
+    "Number of due alerts skipped since previous job for them still runs",
+)
+SHED_ALERTS = Counter(
+    "scheduler_shed_total",
+    "Number of due alerts dropped since their job couldn't meet the deadline",
+)
+QUEUED_JOBS = Gauge("scheduler_queued_jobs", "Number of jobs waiting for execution")
+SEARCHES = Counter(
+    "scheduler_searches_total",
+    "Number of searches by source: eBay call, results of a broader phrase "
+    "or stale results while eBay is unavailable",
+    ["source"],
+)
+JOB_DURATION = Histogram(
+    "alert_job_duration_seconds", "Duration of jobs from search to publish"
+)
+EBAY_REQUEST_DURATION = Histogram(
+    "ebay_request_duration_seconds", "Latency of eBay search requests"
+)
+EBAY_REQUESTS = Counter(
+    "ebay_requests_total", "Number of eBay search requests by status", ["status"]
+)
+BREAKER_STATE = Gauge(
+    "circuit_breaker_state",
+    "State of the circuit breaker by endpoint: 0 closed, 1 half-open, 2 open",
+    ["endpoint"],
+)
+BREAKER_REJECTED = Counter(
+    "circuit_breaker_rejected_total",
+    "Number of calls rejected by the open circuit breaker",
+    ["endpoint"],
+)
+RETRIES = Counter("retries_total", "Number of retried calls by endpoint", ["endpoint"])
+HEDGED_REQUESTS = Counter(
+    "hedged_requests_total",
+    "Number of second requests sent since the first one was slow",
+    ["endpoint"],
+)
+PROCESSOR_LOAD_DURATION = Histogram(
+    "processor_load_duration_seconds",
+    "Latency of loading one result by the processor",
+    ["processor"],
+)
+PROCESSOR_ERRORS = Counter(
+    "processor_errors_total", "Number of results failed by the processor", ["processor"]
+)
+RENDERS = Counter(
+    "digest_renders_total",
+    "Number of digest sections by render cache result, misses are actual renders",
+    ["result"],
+)
+QUEUE_DEPTH = Gauge(
+    "processor_queue_depth",
+    "Number of results waiting for the processor",
+    ["processor"],
+)
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Delay of callbacks on the event loop, sampled periodically",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+LOOP_STALLS = Counter(
+    "event_loop_stalls_total", "Number of times the event loop was blocked too long"
+)
+TASKS = Gauge("asyncio_tasks", "Number of pending tasks by coroutine", ["coroutine"])
+API_REQUEST_DURATION = Histogram(
+    "api_request_duration_seconds",
+    "Latency of API requests by route",
+    ["method", "route", "status"],
+)
@@ -0,0 +1,400 @@
+import asyncio
+import json
+import logging
+import time
+import typing as t
+import uuid
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from ebay_alerts_service import db
+from ebay_alerts_service.job import AlertJobResult
+from ebay_alerts_service.render import ResultKeys
+
+if t.TYPE_CHECKING:
+    from ebay_alerts_service.config import Config
+    from ebay_alerts_service.publisher import ProcessorQueue
+
+logger = logging.getLogger(__name__)
+
+Entry = db.OutboxEntry
+Payload = db.OutboxPayload
+
+
+class Outbox:
+    """
+    Durable outbox of results between jobs and processors in the application database.
+    Added results and acks of delivered ones are buffered and written together in one
+    transaction per batch (group commit), items of identical results are stored once.
+    Consumers claim undelivered rows in batches with leases, rows which weren't acked
+    before their lease expired are claimed again, so delivery is at least once.
+    Results are added once per alert and scheduler tick, which is their idempotency key.
+    Rows which failed max_attempts times are dead, they aren't claimed anymore
+    and are pruned after the retention period like delivered ones.
+    """
+
+    def __init__(
+        self,
+        conn: db.DbConnection,
+        processors: t.List[str],
+        batch_size: int,
+        flush_interval: float,
+        lease: float,
+        max_attempts: int,
+        retention: float,
+    ):
+        """
+        :param conn: database connection
+        :param processors: names of processors, every result is added for each of them
+        :param batch_size: number of buffered rows which triggers the flush
+        :param flush_interval: max time rows wait in the buffer (in seconds)
+        :param lease: how long claimed rows aren't claimed by other consumers (in seconds)
+        :param max_attempts: rows which failed this many times aren't claimed anymore
+        :param retention: how long delivered and dead rows are kept (in seconds)
+        """
+        self.conn = conn
+        self.processors = processors
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.added = 0
+        self.claimed = 0
+        self.acked = 0
+        self.failed = 0
+        self.dead_pruned = 0
+        self._rows: t.List[t.Dict[str, t.Any]] = []
+        self._payloads: t.Dict[str, t.List[dict]] = {}
+        self._acks: t.List[int] = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_handle: t.Optional[asyncio.TimerHandle] = None
+        self._flush_task: t.Optional[asyncio.Task] = None
+        self._flushed = asyncio.Event()
+
+    @classmethod
+    def from_config(
+        cls, conn: db.DbConnection, config: "Config", processors: t.List[str]
+    ) -> "Outbox":
+        return cls(
+            conn,
+            processors,
+            config.outbox_batch_size,
+            config.outbox_flush_interval,
+            config.outbox_lease,
+            config.outbox_max_attempts,
+            config.outbox_retention,
+        )
+
+    @property
+    def buffered(self) -> int:
+        """Number of rows and acks waiting for the flush"""
+        return len(self._rows) + len(self._acks)
+
+    def add(self, result: AlertJobResult, idempotency_key: str):
+        """Buffer the result for every processor"""
+        if not self.processors:
+            return
+        key = result.key or ResultKeys(result.results).key(
+            result.phrase, result.results
+        )
+        self._payloads.setdefault(key, result.results)
+        now = time.time()
+        for processor in self.processors:
+            self._rows.append(
+                dict(
+                    processor=processor,
+                    idempotency_key=idempotency_key,
+                    alert_id=result.alert_id,
+                    email=result.email,
+                    phrase=result.phrase,
+                    result_key=key,
+                    created_at=now,
+                )
+            )
+        self._schedule_flush()
+
+    def ack(self, row_id: int):
+        """Buffer the ack of the delivered row"""
+        self._acks.append(row_id)
+        self._schedule_flush()
+
+    async def flush(self):
+        """Write buffered rows and acks in one transaction"""
+        async with self._flush_lock:
+            if self._flush_handle:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            rows, self._rows = self._rows, []
+            payloads, self._payloads = self._payloads, {}
+            acks, self._acks = self._acks, []
+            if not rows and not acks:
+                return
+            now = time.time()
+            try:
+                async with self.conn.session() as session:
+                    if payloads:
+                        await session.execute(
+                            sqlite_insert(Payload).on_conflict_do_nothing(),
+                            [
+                                dict(key=key, items=json.dumps(items), created_at=now)
+                                for key, items in payloads.items()
+                            ],
+                        )
+                    if rows:
+                        await session.execute(
+                            sqlite_insert(Entry).on_conflict_do_nothing(), rows
+                        )
+                    for start in range(0, len(acks), self.batch_size):
+                        await session.execute(
+                            update(Entry)
+                            .where(Entry.id.in_(acks[start:][: self.batch_size]))
+                            .values(delivered_at=now)
+                            .execution_options(synchronize_session=False)
+                        )
+                    await session.commit()
+            except Exception as e:
+                # Everything is written with the next flush
+                self._rows[:0] = rows
+                self._acks[:0] = acks
+                for key, items in payloads.items():
+                    self._payloads.setdefault(key, items)
+                self.failed += 1
+                logger.error("Failed to write the outbox", exc_info=e)
+                self._schedule_flush()
+                return
+            self.added += len(rows)
+            self.acked += len(acks)
+            self._flushed.set()
+            self._flushed.clear()
+
+    async def claim(
+        self, processor: str, limit: int
+    ) -> t.List[t.Tuple[int, AlertJobResult]]:
+        """Lease up to limit undelivered rows of the processor, oldest first"""
+        now = time.time()
+        token = uuid.uuid4().hex
+        async with self.conn.session() as session:
+            ids = (
+                (
+                    await session.execute(
+                        select(Entry.id)
+                        .where(
+                            Entry.processor == processor,
+                            Entry.delivered_at.is_(None),
+                            Entry.lease_until < now,
+                            Entry.attempts < self.max_attempts,
+                        )
+                        .order_by(Entry.id)
+                        .limit(limit)
+                    )
+                )
+                .scalars()
+                .all()
+            )
+            if not ids:
+                return []
+            # Other instances could claim some of the rows since they were selected
+            await session.execute(
+                update(Entry)
+                .where(
+                    Entry.id.in_(ids),
+                    Entry.delivered_at.is_(None),
+                    Entry.lease_until < now,
+                )
+                .values(
+                    lease_until=now + self.lease,
+                    lease_token=token,
+                    attempts=Entry.attempts + 1,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            rows = (
+                await session.execute(
+                    select(Entry, Payload.items)
+                    .join(Payload, Payload.key == Entry.result_key)
+                    .where(Entry.id.in_(ids), Entry.lease_token == token)
+                    .order_by(Entry.id)
+                )
+            ).all()
+            await session.commit()
+        items: t.Dict[str, t.List[dict]] = {}
+        claimed = []
+        for entry, payload in rows:
+            if entry.result_key not in items:
+                items[entry.result_key] = json.loads(payload)
+            result = AlertJobResult.construct(
+                email=entry.email,
+                phrase=entry.phrase,
+                results=items[entry.result_key],
+                key=entry.result_key,
+                alert_id=entry.alert_id,
+                idempotency_key=entry.idempotency_key,
+            )
+            claimed.append((entry.id, result))
+        self.claimed += len(claimed)
+        return claimed
+
+    async def wait_flushed(self, timeout: float):
+        """Wait until new rows are written or the timeout"""
+        try:
+            await asyncio.wait_for(self._flushed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def prune(self) -> int:
+        """
+        Delete rows delivered or dead before the retention period and their orphan items
+        """
+        cutoff = time.time() - self.retention
+        deleted = 0
+        dead = 0
+        async with self.conn.session() as session:
+            for processor in self.processors:
+                res = await session.execute(
+                    delete(Entry)
+                    .where(Entry.processor == processor, Entry.delivered_at < cutoff)
+                    .execution_options(synchronize_session=False)
+                )
+                deleted += res.rowcount
+                # Lease of the last attempt is the time the row became dead
+                res = await session.execute(
+                    delete(Entry)
+                    .where(
+                        Entry.processor == processor,
+                        Entry.delivered_at.is_(None),
+                        Entry.attempts >= self.max_attempts,
+                        Entry.lease_until < cutoff,
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                dead += res.rowcount
+            await session.execute(
+                delete(Payload)
+                .where(
+                    Payload.created_at < cutoff,
+                    Payload.key.not_in(select(Entry.result_key)),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        if dead:
+            logger.warning(
+                f"Outbox rows pruned undelivered after {self.max_attempts} attempts: {dead}"
+            )
+        logger.debug(f"Outbox rows pruned: {deleted}")
+        self.dead_pruned += dead
+        return deleted + dead
+
+    async def backlog(self) -> int:
+        """Number of undelivered rows which are still claimed, including buffered ones"""
+        res = await self.conn.select(
+            select(func.count()).where(
+                Entry.delivered_at.is_(None), Entry.attempts < self.max_attempts
+            )
+        )
+        return res.scalar() + len(self._rows) - len(self._acks)
+
+    async def dead(self) -> int:
+        """Number of rows which failed max_attempts times and aren't pruned yet"""
+        res = await self.conn.select(
+            select(func.count()).where(
+                Entry.delivered_at.is_(None), Entry.attempts >= self.max_attempts
+            )
+        )
+        return res.scalar()
+
+    async def close(self):
+        """Write what's left in the buffer"""
+        await self.flush()
+
+    def stats(self) -> t.Dict[str, int]:
+        return {
+            "buffered": self.buffered,
+            "added": self.added,
+            "claimed": self.claimed,
+            "acked": self.acked,
+            "failed": self.failed,
+            "dead_pruned": self.dead_pruned,
+        }
+
+    def _schedule_flush(self):
+        if self.buffered >= self.batch_size:
+            if self._flush_task is None or self._flush_task.done():
+                self._flush_task = asyncio.get_event_loop().create_task(self.flush())
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_later(
+                self.flush_interval, self._start_flush
+            )
+
+    def _start_flush(self):
+        self._flush_handle = None
+        self._flush_task = asyncio.get_event_loop().create_task(self.flush())
+
+
+class OutboxConsumer:
+    """
+    Claims rows of one processor from the outbox into the processor's queue
+    and acks them once they are loaded. Claimed rows never exceed the queue size,
+    so the queue never overflows and backlog stays in the database.
+    """
+
+    def __init__(
+        self,
+        outbox: Outbox,
+        queue: "ProcessorQueue",
+        batch_size: int,
+        poll_interval: float,
+        prune_interval: float,
+    ):
+        self.outbox = outbox
+        self.queue = queue
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.prune_interval = prune_interval
+        self._inflight: t.Dict[int, int] = {}
+        """Row ids of claimed results by ids of result objects"""
+        self._room = asyncio.Event()
+        self._task: t.Optional[asyncio.Task] = None
+        queue.on_loaded.append(self._loaded)
+
+    def start(self):
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        pruned_at = time.monotonic()
+        while True:
+            limit = min(self.batch_size, self.queue.maxsize - len(self._inflight))
+            if limit <= 0:
+                self._room.clear()
+                await self._room.wait()
+                continue
+            try:
+                claimed = await self.outbox.claim(self.queue.name, limit)
+                if time.monotonic() - pruned_at > self.prune_interval:
+                    pruned_at = time.monotonic()
+                    await self.outbox.prune()
+            except Exception as e:
+                logger.error(f"{self.queue.name}: failed to claim results", exc_info=e)
+                await asyncio.sleep(self.poll_interval)
+                continue
+            if not claimed:
+                await self.outbox.wait_flushed(self.poll_interval)
+                continue
+            for row_id, result in claimed:
+                self._inflight[id(result)] = row_id
+                await self.queue.put(result)
+
+    def _loaded(self, result: AlertJobResult, ok: bool):
+        row_id = self._inflight.pop(id(result), None)
+        if row_id is None:
+            return
+        self._room.set()
+        # Failed rows are claimed again when their lease expires
+        if ok:
+            self.outbox.ack(row_id)
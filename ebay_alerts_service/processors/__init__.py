@@ -1,13 +1,24 @@
 """
 This package contains processors.
 Each processor get incoming results and do something with them,
-e. g. EmailProcessor could take results and send email to somewhere.
+e. g. EmailDigestProcessor takes results and send email to somewhere.
 """
-from typing import List
+
+from typing import TYPE_CHECKING, List, Optional
 
 from ebay_alerts_service.processors.base import AbstractProcessor
+from ebay_alerts_service.processors.digest import EmailDigestProcessor
+
+if TYPE_CHECKING:
+    from ebay_alerts_service.config import Config
+    from ebay_alerts_service.resilience import Resilience
 
 
-def get_processors() -> List[AbstractProcessor]:
+def get_processors(
+    config: "Config", resilience: Optional["Resilience"] = None
+) -> List[AbstractProcessor]:
     """Get processors for the scheduler"""
-    return []
+    processors: List[AbstractProcessor] = []
+    if config.smtp_host:
+        processors.append(EmailDigestProcessor(config, resilience=resilience))
+    return processors
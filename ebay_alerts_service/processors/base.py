@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, Awaitable, Optional
 
 
 class AbstractProcessor(ABC):
@@ -7,10 +7,30 @@ class AbstractProcessor(ABC):
     Interface for all classes which want to works as result processor
     """
 
+    workers: Optional[int] = None
+    """Number of concurrent loads, default is taken from the config"""
+    queue_size: Optional[int] = None
+    """Max number of results waiting for the load, default is taken from the config"""
+    overflow: Optional[str] = None
+    """What to do with new results when queue is full, default is taken from the config"""
+    endpoint: Optional[str] = None
+    """
+    Circuit breaker the processor reports its deliveries to. Loads of such processor
+    aren't retried by the queue, workers only wait while the breaker is open.
+    """
+
     @abstractmethod
-    async def load(self, result: Any):
+    async def load(self, result: Any) -> Optional[Awaitable[None]]:
         """
         Loads result
         :param result: result to process
+        :return: processors which only collect the result and deliver it later
+        return the future which is resolved once it's delivered or failed
+        """
+        pass
+
+    async def close(self):
+        """
+        Process everything collected so far and release resources
         """
         pass
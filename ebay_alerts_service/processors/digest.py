@@ -0,0 +1,193 @@
+import asyncio
+import functools
+import logging
+import typing as t
+from email.charset import QP, Charset
+from email.message import EmailMessage
+from email.policy import SMTP
+
+from ebay_alerts_service.processors.base import AbstractProcessor
+from ebay_alerts_service.render import RenderCache, ResultKeys
+from ebay_alerts_service.smtp import Envelope, SmtpError, SmtpPool, retriable
+
+if t.TYPE_CHECKING:
+    from ebay_alerts_service.config import Config
+    from ebay_alerts_service.job import AlertJobResult
+    from ebay_alerts_service.resilience import Resilience
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_VERSION = 1
+"""Version of the digest template, rendered sections of other versions are never reused"""
+
+Outgoing = t.Tuple[Envelope, asyncio.Future]
+"""Digest and the future resolved once it's sent"""
+
+BODY_CHARSET = Charset("utf-8")
+BODY_CHARSET.body_encoding = QP
+
+
+def format_item(item: dict) -> str:
+    price = item.get("price") or {}
+    return (
+        f"- {item.get('title', '')}: {price.get('value', '?')} {price.get('currency', '')}"
+        f"\n  {item.get('itemWebUrl', '')}"
+    )
+
+
+def render_section(phrase: str, items: t.List[dict]) -> bytes:
+    """Digest section with items for one alert, encoded for the message body"""
+    lines = "\n".join(format_item(item) for item in items)
+    text = f'New items for "{phrase}":\n{lines}'
+    return BODY_CHARSET.body_encode(text).replace("\n", "\r\n").encode("ascii")
+
+
+def build_digest(
+    sender: str,
+    email: str,
+    results: t.List["AlertJobResult"],
+    renders: t.Optional[RenderCache] = None,
+) -> Envelope:
+    """
+    Build one message with results of all alerts for the email.
+    Sections are taken from the render cache by the content address of results,
+    so only headers are built for every recipient.
+    """
+    message = EmailMessage()
+    message["From"] = sender
+    message["To"] = email
+    phrases = ", ".join(sorted({r.phrase for r in results}))
+    message["Subject"] = f"eBay alerts: {phrases}"
+    message["MIME-Version"] = "1.0"
+    message["Content-Type"] = 'text/plain; charset="utf-8"'
+    message["Content-Transfer-Encoding"] = "quoted-printable"
+    sections = []
+    for result in results:
+        if renders is None:
+            sections.append(render_section(result.phrase, result.results))
+            continue
+        key = result.key or ResultKeys(result.results).key(
+            result.phrase, result.results
+        )
+        sections.append(
+            renders.get(
+                TEMPLATE_VERSION,
+                key,
+                lambda: render_section(result.phrase, result.results),
+            )
+        )
+    # Headers of the message without payload end with the empty line
+    headers = message.as_bytes(policy=SMTP)
+    return Envelope(sender, [email], headers + b"\r\n\r\n".join(sections) + b"\r\n")
+
+
+class EmailDigestProcessor(AbstractProcessor):
+    """
+    Collects results for the same email within `digest_window` seconds
+    into one digest message and sends digests in batches
+    over the pool of persistent SMTP connections.
+    Sections of identical result sets are rendered once and shared by all recipients.
+    Load returns the future of the digest the result is collected into, it's resolved
+    once the digest is sent, so results are acknowledged only after the delivery.
+    With resilience, batches are sent through the SMTP circuit breaker with retries,
+    and while it's open, queue workers don't take new results.
+    """
+
+    endpoint = "smtp"
+
+    def __init__(
+        self,
+        config: "Config",
+        pool: t.Optional[SmtpPool] = None,
+        resilience: t.Optional["Resilience"] = None,
+    ):
+        self.config = config
+        self.pool = pool or SmtpPool(config)
+        self.resilience = resilience
+        self.renders = RenderCache(config.render_cache_max_entries)
+        self.sent = 0
+        self.failed = 0
+        self._digests: t.Dict[str, t.List["AlertJobResult"]] = {}
+        self._delivered: t.Dict[str, asyncio.Future] = {}
+        self._handles: t.Dict[str, asyncio.TimerHandle] = {}
+        self._ready: t.List[Outgoing] = []
+        self._sender: t.Optional[asyncio.Task] = None
+
+    async def load(self, result: "AlertJobResult") -> asyncio.Future:
+        digest = self._digests.get(result.email)
+        if digest is not None:
+            digest.append(result)
+            return self._delivered[result.email]
+        loop = asyncio.get_event_loop()
+        self._digests[result.email] = [result]
+        delivered = self._delivered[result.email] = loop.create_future()
+        self._handles[result.email] = loop.call_later(
+            self.config.digest_window, self._flush, result.email
+        )
+        return delivered
+
+    async def close(self):
+        """Send all collected digests and close SMTP connections"""
+        for email in list(self._digests):
+            self._handles[email].cancel()
+            self._flush(email)
+        if self._sender:
+            await self._sender
+        await self.pool.close()
+
+    def _flush(self, email: str):
+        self._handles.pop(email)
+        results = self._digests.pop(email)
+        envelope = build_digest(self.config.smtp_sender, email, results, self.renders)
+        self._ready.append((envelope, self._delivered.pop(email)))
+        if self._sender is None or self._sender.done():
+            self._sender = asyncio.get_event_loop().create_task(self._send_ready())
+
+    async def _send_ready(self):
+        while self._ready:
+            size = self.config.smtp_batch_size
+            ready, self._ready = self._ready, []
+            batches = []
+            while ready:
+                batches.append(ready[:size])
+                ready = ready[size:]
+            await asyncio.gather(*(self._send_batch(batch) for batch in batches))
+
+    async def _send_batch(self, batch: t.List[Outgoing]):
+        pending = list(batch)
+        try:
+            if self.resilience is None:
+                await self._send(pending)
+            else:
+                # Retries continue with digests which aren't sent yet
+                await self.resilience.call(
+                    self.endpoint, functools.partial(self._send, pending), retriable
+                )
+        except Exception as e:
+            logger.error(f"Failed to send {len(pending)} digests", exc_info=e)
+            for outgoing in pending:
+                self._done(outgoing, e)
+
+    async def _send(self, pending: t.List[Outgoing]):
+        """Send digests over one connection, sent ones are removed from pending"""
+        async with self.pool.connection() as conn:
+            while pending:
+                envelope, delivered = pending[0]
+                try:
+                    await conn.send(envelope)
+                except SmtpError as e:
+                    if e.code < 500:
+                        raise
+                    # Rejected recipient doesn't affect other digests of the batch
+                    self._done(pending.pop(0), e)
+                    continue
+                self._done(pending.pop(0))
+
+    def _done(self, outgoing: Outgoing, exc: t.Optional[Exception] = None):
+        envelope, delivered = outgoing
+        if exc is None:
+            self.sent += 1
+            delivered.set_result(None)
+            return
+        self.failed += 1
+        delivered.set_exception(exc)
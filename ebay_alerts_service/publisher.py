@@ -0,0 +1,244 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+import typing as t
+from collections import deque
+
+from ebay_alerts_service import metrics
+from ebay_alerts_service.job import AlertJobResult
+from ebay_alerts_service.processors.base import AbstractProcessor
+from ebay_alerts_service.resilience import CircuitOpenError, Resilience
+
+if t.TYPE_CHECKING:
+    from ebay_alerts_service.config import Config
+
+logger = logging.getLogger(__name__)
+
+OverflowPolicy = t.Literal["block", "drop_oldest", "spill"]
+
+
+class ProcessorQueue:
+    """
+    Bounded queue with the pool of workers in front of one processor.
+    When the queue is full, new result either waits for the free place (block),
+    replaces the oldest queued result (drop_oldest) or is written to the spill file
+    and loaded back when the queue is drained (spill).
+    With resilience, failed loads are retried and while the processor's circuit breaker
+    is open, workers don't take results, so they wait in the queue instead of failing.
+    Results of processors which deliver later are reported once their delivery is done.
+    """
+
+    def __init__(
+        self,
+        processor: AbstractProcessor,
+        workers: int,
+        maxsize: int,
+        overflow: OverflowPolicy,
+        spill_path: t.Optional[str] = None,
+        resilience: t.Optional[Resilience] = None,
+    ):
+        self.processor = processor
+        self.name = type(processor).__name__
+        self.workers = workers
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self.resilience = resilience
+        self.endpoint = processor.endpoint or f"processor:{self.name}"
+        self.on_loaded: t.List[t.Callable[[AlertJobResult, bool], None]] = []
+        """Called with the result and whether it was delivered, after every load"""
+        self.processed = 0
+        self.errors = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self._items: t.Deque[t.Tuple[float, AlertJobResult]] = deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._in_spill = 0
+        self._spill_offset = 0
+        self._busy = 0
+        self._tasks: t.List[asyncio.Task] = []
+        self._load_duration = metrics.PROCESSOR_LOAD_DURATION.labels(self.name)
+        self._errors = metrics.PROCESSOR_ERRORS.labels(self.name)
+
+    @classmethod
+    def from_config(
+        cls,
+        processor: AbstractProcessor,
+        config: "Config",
+        resilience: t.Optional[Resilience] = None,
+    ) -> "ProcessorQueue":
+        """Create queue with processor's own settings or defaults from the config"""
+        name = type(processor).__name__
+        return cls(
+            processor,
+            workers=processor.workers or config.publish_workers,
+            maxsize=processor.queue_size or config.publish_queue_size,
+            overflow=processor.overflow or config.publish_overflow,
+            spill_path=os.path.join(config.publish_spill_dir, f"{name}.jsonl"),
+            resilience=resilience,
+        )
+
+    @property
+    def depth(self) -> int:
+        """Number of results waiting for processing, including spilled ones"""
+        return len(self._items) + self._in_spill
+
+    @property
+    def idle(self) -> bool:
+        """No results are waiting or being loaded"""
+        return not self.depth and not self._busy
+
+    def start(self):
+        """Start workers, results spilled before the restart are processed as well"""
+        if self.spill_path and os.path.exists(self.spill_path):
+            with open(self.spill_path) as f:
+                self._in_spill = sum(1 for _ in f)
+        loop = asyncio.get_event_loop()
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    async def put(self, result: AlertJobResult):
+        """Put result to the queue according to the overflow policy"""
+        if self._in_spill:
+            # Spilled results are older, e.g. left from the previous run with any
+            # policy, new ones are spilled after them until the spill is drained
+            self._spill(result)
+            return
+        if len(self._items) >= self.maxsize:
+            if self.overflow == "block":
+                while len(self._items) >= self.maxsize:
+                    self._not_full.clear()
+                    await self._not_full.wait()
+            elif self.overflow == "drop_oldest":
+                self._items.popleft()
+                self.dropped += 1
+            else:
+                self._spill(result)
+                return
+        self._items.append((time.time(), result))
+        self._not_empty.set()
+
+    async def close(self, timeout: float):
+        """Wait up to timeout for queued results, stop workers and close the processor"""
+        deadline = time.time() + timeout
+        while (self.depth or self._busy) and time.time() < deadline:
+            await asyncio.sleep(0.05)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.depth:
+            logger.warning(f"{self.name}: {self.depth} results left unprocessed")
+        await self.processor.close()
+
+    def stats(self) -> t.Dict[str, t.Any]:
+        """Queue counters"""
+        return {
+            "processor": self.name,
+            "workers": self.workers,
+            "depth": self.depth,
+            "processed": self.processed,
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "wait_time_avg": (
+                self.wait_time_total / self.processed if self.processed else 0.0
+            ),
+            "wait_time_max": self.wait_time_max,
+        }
+
+    async def _get(self) -> t.Tuple[float, AlertJobResult]:
+        while not self._items:
+            if self._in_spill:
+                self._unspill()
+                continue
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        item = self._items.popleft()
+        self._not_full.set()
+        return item
+
+    async def _load(self, result: AlertJobResult) -> t.Optional[t.Awaitable[None]]:
+        if self.resilience is None or self.processor.endpoint:
+            return await self.processor.load(result)
+        return await self.resilience.call(
+            self.endpoint, functools.partial(self.processor.load, result)
+        )
+
+    async def _work(self):
+        breaker = self.resilience and self.resilience.breaker(self.endpoint)
+        while True:
+            if breaker:
+                await breaker.wait_ready()
+            enqueued_at, result = await self._get()
+            wait_time = time.time() - enqueued_at
+            self._busy += 1
+            started = time.monotonic()
+            delivery = None
+            try:
+                delivery = await self._load(result)
+                if delivery is None:
+                    self._loaded(result)
+                else:
+                    asyncio.ensure_future(delivery).add_done_callback(
+                        functools.partial(self._delivered, result)
+                    )
+            except CircuitOpenError:
+                # Another worker probes the processor, the result goes back to the queue
+                self._items.appendleft((enqueued_at, result))
+                self._not_empty.set()
+                continue
+            except Exception as e:
+                self._failed(result, e)
+            finally:
+                self._busy -= 1
+            self.processed += 1
+            self._load_duration.observe(time.monotonic() - started)
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def _loaded(self, result: AlertJobResult):
+        for callback in self.on_loaded:
+            callback(result, True)
+
+    def _failed(self, result: AlertJobResult, exc: BaseException, log: bool = True):
+        self.errors += 1
+        self._errors.inc()
+        if log:
+            logger.error(f"{self.name} failed to load result", exc_info=exc)
+        for callback in self.on_loaded:
+            callback(result, False)
+
+    def _delivered(self, result: AlertJobResult, delivery: asyncio.Future):
+        # Processor logs failed deliveries once for all results delivered together
+        if delivery.cancelled():
+            self._failed(result, asyncio.CancelledError(), log=False)
+        elif delivery.exception() is not None:
+            self._failed(result, delivery.exception(), log=False)
+        else:
+            self._loaded(result)
+
+    def _spill(self, result: AlertJobResult):
+        os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+        with open(self.spill_path, "a") as f:
+            f.write(f"{time.time()} {result.json()}\n")
+        self._in_spill += 1
+        self.spilled += 1
+
+    def _unspill(self):
+        """Load next spilled results up to the queue size"""
+        with open(self.spill_path) as f:
+            f.seek(self._spill_offset)
+            while self._in_spill and len(self._items) < self.maxsize:
+                line = f.readline()
+                enqueued_at, data = line.split(" ", 1)
+                self._items.append((float(enqueued_at), AlertJobResult.parse_raw(data)))
+                self._in_spill -= 1
+            self._spill_offset = f.tell()
+        if not self._in_spill:
+            os.remove(self.spill_path)
+            self._spill_offset = 0
@@ -0,0 +1,190 @@
+import typing as t
+from array import array
+
+
+class JobParams(t.NamedTuple):
+    """
+    Alert data needed by its job, built from the registry on demand
+    """
+
+    id: int
+    email: str
+    phrase: str
+
+
+class IdArray:
+    """
+    Typed array of numbers indexed by alert id, it grows up to the largest id.
+    Zero means no value.
+    """
+
+    def __init__(self, typecode: str = "I"):
+        self.values = array(typecode)
+
+    def __getitem__(self, alert_id: int) -> int:
+        return self.values[alert_id] if alert_id < len(self.values) else 0
+
+    def __setitem__(self, alert_id: int, value: int):
+        if alert_id >= len(self.values):
+            size = max(alert_id + 1, 2 * len(self.values))
+            self.values.extend(
+                array(self.values.typecode, [0]) * (size - len(self.values))
+            )
+        self.values[alert_id] = value
+
+    def get(self, alert_id: int) -> t.Optional[int]:
+        return self[alert_id] or None
+
+    def pop(self, alert_id: int, default: t.Optional[int] = None) -> t.Optional[int]:
+        value = self[alert_id]
+        if not value:
+            return default
+        self.values[alert_id] = 0
+        return value
+
+
+class Bitset:
+    """
+    Set of alert ids kept as one bit per id
+    """
+
+    def __init__(self):
+        self.bits = bytearray()
+        self._count = 0
+
+    def __contains__(self, alert_id: int) -> bool:
+        byte = alert_id >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (alert_id & 7)))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, alert_id: int):
+        byte, bit = alert_id >> 3, 1 << (alert_id & 7)
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(max(byte + 1, 2 * len(self.bits)) - len(self.bits)))
+        if not self.bits[byte] & bit:
+            self.bits[byte] |= bit
+            self._count += 1
+
+    def discard(self, alert_id: int):
+        if alert_id in self:
+            self.bits[alert_id >> 3] &= ~(1 << (alert_id & 7))
+            self._count -= 1
+
+    def update(self, alert_ids: t.Iterable[int]):
+        for alert_id in alert_ids:
+            self.add(alert_id)
+
+    def difference_update(self, alert_ids: t.Iterable[int]):
+        for alert_id in alert_ids:
+            self.discard(alert_id)
+
+
+class StringTable:
+    """
+    Interned strings addressed by number. Every string is kept once
+    and freed when the last alert which refers to it is gone.
+    """
+
+    def __init__(self):
+        # Number 0 is reserved for "no string"
+        self._strings: t.List[t.Optional[str]] = [None]
+        self._numbers: t.Dict[str, int] = {}
+        self._refs = array("I", [0])
+        self._free: t.List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._numbers)
+
+    def __getitem__(self, number: int) -> str:
+        return self._strings[number]
+
+    def acquire(self, value: str) -> int:
+        """Number of the string, the string is added if it's new"""
+        number = self._numbers.get(value)
+        if number is None:
+            if self._free:
+                number = self._free.pop()
+                self._strings[number] = value
+            else:
+                number = len(self._strings)
+                self._strings.append(value)
+                self._refs.append(0)
+            self._numbers[value] = number
+        self._refs[number] += 1
+        return number
+
+    def release(self, number: int):
+        """Drop one reference to the string and free it when it's unused"""
+        self._refs[number] -= 1
+        if not self._refs[number]:
+            del self._numbers[self._strings[number]]
+            self._strings[number] = None
+            self._free.append(number)
+
+
+class AlertRegistry:
+    """
+    Compact storage of scheduled alerts. Emails and phrases are interned
+    and alerts keep only their numbers in arrays indexed by alert id,
+    so one alert costs a few bytes instead of a model object per alert.
+    It's read like a mapping of alert id to JobParams.
+    """
+
+    def __init__(self):
+        self.emails = StringTable()
+        self.phrases = StringTable()
+        self._email = IdArray()
+        self._phrase = IdArray()
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, alert_id: int) -> bool:
+        return bool(self._phrase[alert_id])
+
+    def __iter__(self) -> t.Iterator[int]:
+        return (
+            alert_id for alert_id, number in enumerate(self._phrase.values) if number
+        )
+
+    def __getitem__(self, alert_id: int) -> JobParams:
+        job_params = self.get(alert_id)
+        if job_params is None:
+            raise KeyError(alert_id)
+        return job_params
+
+    def get(self, alert_id: int) -> t.Optional[JobParams]:
+        phrase = self._phrase[alert_id]
+        if not phrase:
+            return None
+        return JobParams(
+            alert_id, self.emails[self._email[alert_id]], self.phrases[phrase]
+        )
+
+    def put(self, alert_id: int, email: str, phrase: str):
+        """Insert or update the alert"""
+        # New strings are acquired first, so unchanged ones are not freed in between
+        email_number = self.emails.acquire(email)
+        phrase_number = self.phrases.acquire(phrase)
+        if alert_id in self:
+            self.emails.release(self._email[alert_id])
+            self.phrases.release(self._phrase[alert_id])
+        else:
+            self._count += 1
+        self._email[alert_id] = email_number
+        self._phrase[alert_id] = phrase_number
+
+    def pop(
+        self, alert_id: int, default: t.Optional[JobParams] = None
+    ) -> t.Optional[JobParams]:
+        """Remove the alert and return its params"""
+        job_params = self.get(alert_id)
+        if job_params is None:
+            return default
+        self.emails.release(self._email.pop(alert_id))
+        self.phrases.release(self._phrase.pop(alert_id))
+        self._count -= 1
+        return job_params
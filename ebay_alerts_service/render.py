@@ -0,0 +1,67 @@
+import hashlib
+import json
+import typing as t
+from collections import OrderedDict
+
+from ebay_alerts_service import metrics
+
+KEY_SIZE = 16
+"""Size of content addresses (in bytes)"""
+
+
+def item_hash(item: dict) -> bytes:
+    """Content address of one item"""
+    data = json.dumps(item, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.blake2b(data, digest_size=KEY_SIZE).digest()
+
+
+class ResultKeys:
+    """
+    Content addresses of result sets made of items of one search.
+    Every item is serialized and hashed once, so the key of every recipient's
+    subset is a hash of item hashes and costs nothing close to rendering.
+    """
+
+    def __init__(self, items: t.List[dict]):
+        self._hashes = {id(item): item_hash(item) for item in items}
+
+    def key(self, phrase: str, items: t.List[dict]) -> str:
+        """Key of items shown for the phrase"""
+        digest = hashlib.blake2b(phrase.encode(), digest_size=KEY_SIZE)
+        for item in items:
+            digest.update(self._hashes.get(id(item)) or item_hash(item))
+        return digest.hexdigest()
+
+
+class RenderCache:
+    """
+    Bounded LRU of rendered result sets keyed by their content address
+    and the version of the template they were rendered with
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[t.Tuple[int, str], bytes]" = OrderedDict()
+        self._hits = metrics.RENDERS.labels("hit")
+        self._misses = metrics.RENDERS.labels("miss")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, version: int, key: str, render: t.Callable[[], bytes]) -> bytes:
+        """Rendered result set, it's rendered on the miss"""
+        cache_key = (version, key)
+        rendered = self._entries.get(cache_key)
+        if rendered is not None:
+            self._entries.move_to_end(cache_key)
+            self.hits += 1
+            self._hits.inc()
+            return rendered
+        rendered = self._entries[cache_key] = render()
+        self.misses += 1
+        self._misses.inc()
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return rendered
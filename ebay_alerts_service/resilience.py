@@ -0,0 +1,313 @@
+import asyncio
+import logging
+import random
+import time
+import typing as t
+from collections import deque
+
+from ebay_alerts_service import metrics
+
+if t.TYPE_CHECKING:
+    from ebay_alerts_service.config import Config
+
+logger = logging.getLogger(__name__)
+
+T = t.TypeVar("T")
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+"""Values of breaker states in the metrics"""
+
+LATENCY_WINDOW = 1000
+"""Number of recent latencies the hedging delay is computed from"""
+LATENCY_MIN_SAMPLES = 20
+"""Requests are not hedged until the endpoint has this many latencies"""
+PROBE_WAIT = 0.1
+"""How often the call waits for the result of the probe call (in seconds)"""
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of the call when the circuit breaker of its endpoint is open"""
+
+    def __init__(self, endpoint: str, retry_after: float):
+        super().__init__(f"Circuit breaker of {endpoint} is open")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one endpoint. After `failure_threshold` consecutive failures
+    the breaker opens and rejects calls for `reset_timeout` seconds, then one probe call
+    is let through (half-open): its success closes the breaker and its failure opens it again.
+    """
+
+    def __init__(self, endpoint: str, failure_threshold: int, reset_timeout: float):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._state_gauge = metrics.BREAKER_STATE.labels(endpoint)
+        self._rejected = metrics.BREAKER_REJECTED.labels(endpoint)
+        self._state_gauge.set(STATE_VALUES[CLOSED])
+
+    @property
+    def retry_after(self) -> float:
+        """Seconds until the open breaker lets the probe call through"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    @property
+    def ready(self) -> bool:
+        """Whether the next call would be let through"""
+        if self.state == OPEN:
+            return not self.retry_after
+        return not self._probing
+
+    def allow(self):
+        """Let the call through or raise CircuitOpenError"""
+        if self.state == OPEN and not self.retry_after:
+            self._set_state(HALF_OPEN)
+        if self.state == OPEN or self._probing:
+            self.rejected += 1
+            self._rejected.inc()
+            raise CircuitOpenError(self.endpoint, self.retry_after)
+        if self.state == HALF_OPEN:
+            self._probing = True
+
+    async def wait_ready(self):
+        """Wait until the next call would be let through"""
+        while not self.ready:
+            await asyncio.sleep(self.retry_after or PROBE_WAIT)
+
+    def record_success(self):
+        self.failures = 0
+        self._probing = False
+        if self.state != CLOSED:
+            self._set_state(CLOSED)
+            logger.info(f"Circuit breaker of {self.endpoint} is closed")
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            if self.state != OPEN:
+                self._set_state(OPEN)
+                logger.warning(
+                    f"Circuit breaker of {self.endpoint} is open "
+                    f"after {self.failures} failures"
+                )
+
+    def release(self):
+        """Call was cancelled, it says nothing about the endpoint"""
+        self._probing = False
+
+    def stats(self) -> t.Dict[str, t.Any]:
+        return {
+            "endpoint": self.endpoint,
+            "state": self.state,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "retry_after": self.retry_after,
+        }
+
+    def _set_state(self, state: str):
+        self.state = state
+        self._state_gauge.set(STATE_VALUES[state])
+
+
+class LatencyTracker:
+    """
+    Recent latencies of the endpoint, the percentile is recomputed
+    once per `LATENCY_WINDOW / 10` new latencies
+    """
+
+    def __init__(self, percentile: float):
+        self.percentile = percentile
+        self._latencies: t.Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._value: t.Optional[float] = None
+        self._stale = 0
+
+    def observe(self, latency: float):
+        self._latencies.append(latency)
+        self._stale += 1
+
+    @property
+    def value(self) -> t.Optional[float]:
+        """Latency percentile, None until there are enough latencies"""
+        if len(self._latencies) < LATENCY_MIN_SAMPLES:
+            return None
+        if self._value is None or self._stale >= LATENCY_WINDOW // 10:
+            latencies = sorted(self._latencies)
+            index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))
+            self._value = latencies[index]
+            self._stale = 0
+        return self._value
+
+
+def backoff(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Capped exponential backoff with full jitter"""
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+class Resilience:
+    """
+    Circuit breakers, retries and hedging shared by calls to eBay and processors.
+    Every endpoint gets its own breaker. Failed calls are retried with capped
+    exponential backoff and jitter, so retries of many jobs don't hit the endpoint
+    at once. Hedged requests send the second request when the first one takes longer
+    than the latency percentile of the endpoint and use whichever finishes first.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        reset_timeout: float,
+        retries: int,
+        base_delay: float,
+        max_delay: float,
+        hedge_percentile: t.Optional[float] = None,
+    ):
+        """
+        :param failure_threshold: number of consecutive failures which opens a breaker
+        :param reset_timeout: how long an open breaker rejects calls (in seconds)
+        :param retries: number of retries of failed calls
+        :param base_delay: backoff before the first retry (in seconds)
+        :param max_delay: max backoff between retries (in seconds)
+        :param hedge_percentile: latency percentile after which hedged calls
+            send the second request, hedging is disabled if it isn't set
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_percentile = hedge_percentile
+        self.breakers: t.Dict[str, CircuitBreaker] = {}
+        self.latencies: t.Dict[str, LatencyTracker] = {}
+        self._retries: t.Dict[str, metrics.CounterValue] = {}
+        self._hedged: t.Dict[str, metrics.CounterValue] = {}
+
+    @classmethod
+    def from_config(cls, config: "Config") -> "Resilience":
+        return cls(
+            config.breaker_failure_threshold,
+            config.breaker_reset_timeout,
+            config.retries,
+            config.retry_base_delay,
+            config.retry_max_delay,
+            config.ebay_hedge_percentile,
+        )
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        """Breaker of the endpoint, it's created on first use"""
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker(
+                endpoint, self.failure_threshold, self.reset_timeout
+            )
+        return breaker
+
+    async def call(
+        self,
+        endpoint: str,
+        func: t.Callable[[], t.Awaitable[T]],
+        retriable: t.Callable[[Exception], bool] = lambda e: True,
+    ) -> T:
+        """
+        Call the endpoint through its breaker with retries
+        :param endpoint: name of the endpoint
+        :param func: the call, it's made again for every retry
+        :param retriable: whether the error is worth retrying, other errors mean
+            the endpoint works and don't count as failures
+        """
+        breaker = self.breaker(endpoint)
+        retried = self._retries.get(endpoint)
+        if retried is None:
+            retried = self._retries[endpoint] = metrics.RETRIES.labels(endpoint)
+        attempt = 0
+        while True:
+            breaker.allow()
+            try:
+                result = await func()
+            except asyncio.CancelledError:
+                breaker.release()
+                raise
+            except Exception as e:
+                if not retriable(e):
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                if attempt >= self.retries or breaker.state == OPEN:
+                    raise
+                retried.inc()
+                await asyncio.sleep(backoff(attempt, self.base_delay, self.max_delay))
+                attempt += 1
+                continue
+            breaker.record_success()
+            return result
+
+    def stats(self) -> t.List[t.Dict[str, t.Any]]:
+        """Counters of all breakers"""
+        return [breaker.stats() for _, breaker in sorted(self.breakers.items())]
+
+    async def hedged(
+        self,
+        endpoint: str,
+        func: t.Callable[[], t.Awaitable[T]],
+        may_hedge: t.Callable[[], bool] = lambda: True,
+        hedge: t.Optional[t.Callable[[], t.Awaitable[T]]] = None,
+    ) -> T:
+        """
+        Send the request and hedge it if it's slow. Latency of the request itself
+        is tracked, so rate limits and other local waits belong outside of func.
+        :param endpoint: name of the endpoint
+        :param func: the request
+        :param may_hedge: called before the hedged request, it's skipped if this is false,
+            e.g. when rate limit tokens aren't available right away
+        :param hedge: the hedged request, func is sent again if it isn't set
+        """
+        if not self.hedge_percentile:
+            return await func()
+        latencies = self.latencies.get(endpoint)
+        if latencies is None:
+            latencies = self.latencies[endpoint] = LatencyTracker(self.hedge_percentile)
+            self._hedged[endpoint] = metrics.HEDGED_REQUESTS.labels(endpoint)
+        hedged = self._hedged[endpoint]
+        loop = asyncio.get_event_loop()
+
+        async def timed(request: t.Callable[[], t.Awaitable[T]]) -> T:
+            started = time.monotonic()
+            result = await request()
+            latencies.observe(time.monotonic() - started)
+            return result
+
+        delay = latencies.value
+        tasks = {loop.create_task(timed(func))}
+        try:
+            done, tasks = await asyncio.wait(tasks, timeout=delay)
+            if not done and may_hedge():
+                hedged.inc()
+                tasks.add(loop.create_task(timed(hedge or func)))
+            error: t.Optional[BaseException] = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not tasks:
+                    raise error
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,75 @@
+import hashlib
+import typing as t
+from collections import OrderedDict
+
+import orjson
+
+CacheKey = t.Tuple[t.Any, ...]
+"""Route and its parameters"""
+
+
+def dumps(data: t.Any) -> bytes:
+    """Compact JSON encoding with orjson, it's several times faster than json"""
+    return orjson.dumps(data)
+
+
+def make_etag(key: CacheKey, version: int) -> str:
+    """Strong ETag of the response, it changes with the version of the table"""
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=8).hexdigest()
+    return f'"{version}-{digest}"'
+
+
+def etag_matches(
+    if_none_match: t.Optional[str], etag: str, wildcard: bool = True
+) -> bool:
+    """
+    Whether If-None-Match header matches the ETag, weak comparison is used.
+    "*" matches any ETag of an existing resource, it's ignored without wildcard.
+    """
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if (wildcard and tag == "*") or tag == etag:
+            return True
+    return False
+
+
+class CachedResponse(t.NamedTuple):
+    body: bytes
+    headers: t.Dict[str, str]
+
+
+class ResponseCache:
+    """
+    LRU of serialized response bodies keyed by the route, its parameters
+    and the version of the table. Entries of old versions are never read again
+    and are evicted as the least recently used.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[t.Tuple[CacheKey, int], CachedResponse]" = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: CacheKey, version: int) -> t.Optional[CachedResponse]:
+        entry = self._entries.get((key, version))
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end((key, version))
+        self.hits += 1
+        return entry
+
+    def put(self, key: CacheKey, version: int, response: CachedResponse):
+        self._entries[key, version] = response
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
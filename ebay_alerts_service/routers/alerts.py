@@ -1,10 +1,22 @@
-from typing import List
+import json
+from datetime import datetime, timezone
+from typing import AsyncIterator, Awaitable, Callable, List, Literal, Optional, Tuple
 
-from fastapi import APIRouter, HTTPException, Request, status
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError, NoResultFound
+from sqlalchemy.sql import Select
 
 from ebay_alerts_service import db
+from ebay_alerts_service.job import normalize_phrase
+from ebay_alerts_service.responses import (
+    CachedResponse,
+    CacheKey,
+    dumps,
+    etag_matches,
+    make_etag,
+)
 
 from .models import alerts
 
@@ -14,17 +26,112 @@ router = APIRouter(
 )
 
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_BULK_SIZE = 10000
+
+
+def alerts_query(
+    after_id: int, limit: Optional[int], email: Optional[str], phrase: Optional[str]
+) -> Select:
+    """Keyset paginated query of alerts columns ordered by id"""
+    stmt = (
+        select(db.Alert.id, db.Alert.email, db.Alert.phrase, db.Alert.interval)
+        .where(db.Alert.id > after_id)
+        .order_by(db.Alert.id)
+    )
+    if email is not None:
+        stmt = stmt.where(db.Alert.email == email)
+    if phrase is not None:
+        stmt = stmt.where(db.Alert.phrase == phrase)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+async def stream_alerts(conn: db.DbConnection, stmt: Select) -> AsyncIterator[str]:
+    """Write alerts as NDJSON while they are fetched with server-side cursor"""
+    async for rows in conn.stream(stmt):
+        yield "".join(json.dumps(dict(row._mapping)) + "\n" for row in rows)
+
+
+async def conditional_json(
+    request: Request, key: CacheKey, build: Callable[[], Awaitable[CachedResponse]]
+) -> Response:
+    """
+    JSON response with ETag of the alerts table version. Requests with matching
+    If-None-Match get 304, others get the body cached for the version,
+    so unchanged alerts are read and serialized once.
+    """
+    state = request.app.state
+    conn = state.conn
+    version = await conn.table_version(db.Alert, state.config.etag_refresh_interval)
+    etag = make_etag(key, version)
+    if_none_match = request.headers.get("if-none-match")
+    not_modified = Response(
+        status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+    )
+    # "*" matches any existing resource, so it's checked once build found the resource
+    if etag_matches(if_none_match, etag, wildcard=False):
+        return not_modified
+    cached = state.response_cache.get(key, version)
+    if cached is None:
+        cached = await build()
+        if conn.versions.get(db.Alert.__tablename__, 0) != version:
+            # Alerts changed while they were read, the body may be of either version
+            return Response(
+                cached.body, headers=cached.headers, media_type="application/json"
+            )
+        state.response_cache.put(key, version, cached)
+    if etag_matches(if_none_match, etag):
+        return not_modified
+    return Response(
+        cached.body,
+        headers=dict(cached.headers, ETag=etag, **{"Cache-Control": "no-cache"}),
+        media_type="application/json",
+    )
+
+
 @router.get(
-    "/", description="Get all alerts", response_model=List[alerts.AlertResponse]
+    "/",
+    description=(
+        "Get alerts ordered by id, page by page. "
+        "Use X-Next-After-Id response header as after_id to get the next page. "
+        f"With Accept: {NDJSON_MEDIA_TYPE} header all alerts after after_id "
+        "are streamed as NDJSON, limit is optional in this case. "
+        "Pages have ETag, with If-None-Match header unchanged pages get 304."
+    ),
+    response_model=List[alerts.AlertResponse],
+    responses={200: {"content": {NDJSON_MEDIA_TYPE: {}}}},
 )
-async def get_alerts(request: Request):
-    app = request.app
-    stmt = select(db.Alert)
-    data = [
-        alerts.AlertResponse.from_orm(obj.Alert)
-        for obj in await app.state.conn.select(stmt)
-    ]
-    return data
+async def get_alerts(
+    request: Request,
+    after_id: int = Query(0, ge=0, description="Return alerts with greater id"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    email: Optional[str] = None,
+    phrase: Optional[str] = None,
+):
+    conn = request.app.state.conn
+    if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        stmt = alerts_query(after_id, limit, email, phrase)
+        return StreamingResponse(
+            stream_alerts(conn, stmt), media_type=NDJSON_MEDIA_TYPE
+        )
+
+    limit = limit or DEFAULT_PAGE_SIZE
+
+    async def build() -> CachedResponse:
+        stmt = alerts_query(after_id, limit, email, phrase)
+        data = [dict(row._mapping) for row in await conn.select(stmt)]
+        headers = {}
+        if len(data) == limit:
+            headers["X-Next-After-Id"] = str(data[-1]["id"])
+        return CachedResponse(dumps(data), headers)
+
+    return await conditional_json(
+        request, ("alerts", after_id, limit, email, phrase), build
+    )
 
 
 @router.post(
@@ -51,20 +158,128 @@ async def create_alert(request: Request, alert_input: alerts.CreateAlert):
     return {"id": alert.id}
 
 
+def bulk_results(results: List[Tuple[db.BulkStatus, Optional[int]]]) -> List[dict]:
+    return [
+        {"index": index, "id": obj_id, "status": status}
+        for index, (status, obj_id) in enumerate(results)
+    ]
+
+
+def check_bulk_size(rows: list):
+    if len(rows) > MAX_BULK_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {MAX_BULK_SIZE} alerts are allowed in one request",
+        )
+
+
+@router.post(
+    "/bulk",
+    description="Create alerts in one transaction, alerts which already exist are skipped",
+    response_model=List[alerts.BulkResult],
+    responses={413: {"detail": "Too many alerts"}},
+)
+async def bulk_create_alerts(request: Request, alerts_input: List[alerts.CreateAlert]):
+    check_bulk_size(alerts_input)
+    results = await request.app.state.conn.bulk_insert(
+        db.Alert, [a.dict() for a in alerts_input]
+    )
+    return bulk_results(results)
+
+
+@router.patch(
+    "/bulk",
+    description="Update alerts by id in one transaction",
+    response_model=List[alerts.BulkResult],
+    responses={413: {"detail": "Too many alerts"}},
+)
+async def bulk_update_alerts(
+    request: Request, alerts_data: List[alerts.BulkUpdateAlert]
+):
+    check_bulk_size(alerts_data)
+    results = await request.app.state.conn.bulk_update(
+        db.Alert, [dict(a.get_updated(), id=a.id) for a in alerts_data]
+    )
+    return bulk_results(results)
+
+
+@router.delete(
+    "/bulk",
+    description="Delete alerts by ids in one transaction",
+    response_model=List[alerts.BulkResult],
+    responses={413: {"detail": "Too many alerts"}},
+)
+async def bulk_delete_alerts(request: Request, alerts_ids: alerts.BulkDeleteAlerts):
+    check_bulk_size(alerts_ids.ids)
+    results = await request.app.state.conn.bulk_delete(db.Alert, alerts_ids.ids)
+    return bulk_results(results)
+
+
 @router.get(
     "/{alert_id}",
-    description="Get alert by id",
+    description="Get alert by id. With If-None-Match header unchanged alert gets 304.",
     response_model=alerts.AlertResponse,
     responses={404: {"detail": "Not found"}},
 )
 async def get_alert(request: Request, alert_id: int):
-    stmt = select(db.Alert).where(db.Alert.id == alert_id)
+    async def build() -> CachedResponse:
+        stmt = select(
+            db.Alert.id, db.Alert.email, db.Alert.phrase, db.Alert.interval
+        ).where(db.Alert.id == alert_id)
+        try:
+            row = (await request.app.state.conn.select(stmt)).one()
+        except NoResultFound:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Not found"
+            )
+        return CachedResponse(dumps(dict(row._mapping)), {})
+
+    return await conditional_json(request, ("alert", alert_id), build)
+
+
+@router.get(
+    "/{alert_id}/insights",
+    description=(
+        "Get min, average and max prices of items found for the alert's phrase "
+        "in the most recent time buckets. Answered from precomputed rollups."
+    ),
+    response_model=alerts.AlertInsights,
+    responses={404: {"detail": "Not found"}},
+)
+async def get_alert_insights(
+    request: Request,
+    alert_id: int,
+    period: Literal["minute", "hour", "day"] = "hour",
+    limit: int = Query(24, ge=1, le=MAX_PAGE_SIZE),
+):
+    conn = request.app.state.conn
+    stmt = select(db.Alert.phrase).where(db.Alert.id == alert_id)
     try:
-        data = (await request.app.state.conn.select(stmt)).scalar_one()
+        phrase = normalize_phrase((await conn.select(stmt)).scalar_one())
     except NoResultFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
-    alert = alerts.AlertResponse.from_orm(data)
-    return alert
+    stmt = (
+        select(db.PriceRollup)
+        .where(db.PriceRollup.phrase == phrase, db.PriceRollup.period == period)
+        .order_by(db.PriceRollup.bucket.desc())
+        .limit(limit)
+    )
+    rollups = (await conn.select(stmt)).scalars().all()
+    return alerts.AlertInsights(
+        alert_id=alert_id,
+        phrase=phrase,
+        period=period,
+        buckets=[
+            alerts.PriceBucket(
+                start=datetime.fromtimestamp(r.bucket, timezone.utc),
+                count=r.count,
+                min=r.min,
+                avg=r.total / r.count,
+                max=r.max,
+            )
+            for r in reversed(rollups)
+        ],
+    )
 
 
 @router.patch(
@@ -0,0 +1,59 @@
+from typing import Dict
+
+from fastapi import APIRouter, HTTPException, Query, Request, status
+
+from ebay_alerts_service.diagnostics import task_counts
+
+from .models import diagnostics
+
+router = APIRouter(
+    prefix="/diagnostics",
+    tags=["diagnostics"],
+)
+
+
+@router.get(
+    "/loop",
+    description="Get event loop lag and recent stalls with stacks of blocking calls",
+    response_model=diagnostics.LoopStats,
+)
+async def get_loop_stats(request: Request):
+    monitor = request.app.state.loop_monitor
+    if monitor is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Loop monitor is disabled"
+        )
+    return monitor.stats()
+
+
+@router.get(
+    "/tasks",
+    description="Get number of pending tasks by coroutine",
+    response_model=Dict[str, int],
+)
+async def get_tasks():
+    return task_counts()
+
+
+@router.post(
+    "/profile",
+    description=(
+        "Record sampling profile of the event loop for duration seconds, "
+        "the profile is written to the file in the collapsed stack format"
+    ),
+    response_model=diagnostics.Profile,
+    responses={409: {"detail": "Profile is already being recorded"}},
+)
+async def record_profile(
+    request: Request,
+    duration: float = Query(
+        10, gt=0, description="Duration of the profile (in seconds)"
+    ),
+):
+    profiler = request.app.state.profiler
+    if profiler.running:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Profile is already being recorded",
+        )
+    return await profiler.profile(duration)
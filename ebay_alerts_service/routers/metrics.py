@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+
+from ebay_alerts_service import metrics
+from ebay_alerts_service.diagnostics import task_counts
+
+router = APIRouter(tags=["metrics"])
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def collect_gauges(state):
+    """Set gauges which are read from the application state on scrape"""
+    scheduler = state.scheduler
+    metrics.SCHEDULED_ALERTS.clear()
+    for interval, histogram in scheduler.wheel.occupancy().items():
+        metrics.SCHEDULED_ALERTS.labels(interval).set(sum(histogram))
+    metrics.RUNNING_ALERTS.labels().set(len(scheduler.running))
+    metrics.QUEUED_JOBS.labels().set(len(scheduler.executor))
+    for queue in scheduler.queues:
+        metrics.QUEUE_DEPTH.labels(queue.name).set(queue.depth)
+    metrics.TASKS.clear()
+    for coroutine, count in task_counts().items():
+        metrics.TASKS.labels(coroutine).set(count)
+
+
+@router.get(
+    "/metrics",
+    description="Get metrics in the Prometheus text format",
+    response_class=PlainTextResponse,
+)
+async def get_metrics(request: Request):
+    collect_gauges(request.app.state)
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=CONTENT_TYPE)
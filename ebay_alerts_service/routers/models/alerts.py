@@ -1,4 +1,5 @@
-from typing import Dict, Literal, Optional, Union
+from datetime import datetime
+from typing import Dict, List, Literal, Optional, Union
 
 from pydantic import BaseModel, EmailStr
 
@@ -40,3 +41,38 @@ class AlertResponse(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class BulkUpdateAlert(UpdateAlert):
+    id: int
+
+
+class BulkDeleteAlerts(BaseModel):
+    ids: List[int]
+
+
+class BulkResult(BaseModel):
+    index: int
+    """Position of the row in the request"""
+    id: Optional[int]
+    """Id of the alert, it's empty if alert wasn't created"""
+    status: Literal["created", "updated", "deleted", "not_found", "conflict"]
+
+
+class PriceBucket(BaseModel):
+    start: datetime
+    """Start of the time bucket (UTC)"""
+    count: int
+    """Number of observed item prices"""
+    min: float
+    avg: float
+    max: float
+
+
+class AlertInsights(BaseModel):
+    alert_id: int
+    phrase: str
+    """Normalized search phrase which prices are observed for"""
+    period: Literal["minute", "hour", "day"]
+    buckets: List[PriceBucket]
+    """Most recent buckets in chronological order"""
@@ -0,0 +1,31 @@
+from typing import List
+
+from pydantic import BaseModel
+
+
+class Stall(BaseModel):
+    started_at: float
+    """Unix time when the event loop stopped running callbacks"""
+    duration: float
+    """How long the event loop was blocked (in seconds)"""
+    stack: List[str]
+    """Stack of the blocking call"""
+
+
+class LoopStats(BaseModel):
+    lag: float
+    """Last sampled event loop lag (in seconds)"""
+    max_lag: float
+    """Max sampled event loop lag since startup (in seconds)"""
+    stalls: int
+    """Number of times the event loop was blocked longer than the threshold"""
+    recent_stalls: List[Stall]
+
+
+class Profile(BaseModel):
+    path: str
+    """Path of the profile in the collapsed stack format"""
+    duration: float
+    samples: int
+    stacks: int
+    """Number of distinct stacks"""
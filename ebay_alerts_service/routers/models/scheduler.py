@@ -0,0 +1,105 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class SlotsOccupancy(BaseModel):
+    interval: int
+    """Alerts interval (in minutes)"""
+    alerts: int
+    """Total number of alerts with this interval"""
+    min: int
+    """Smallest number of alerts in one slot"""
+    max: int
+    """Largest number of alerts in one slot"""
+    histogram: List[int]
+    """Number of alerts in each slot"""
+
+
+class CacheStats(BaseModel):
+    entries: int
+    bytes: int
+    hits: int
+    misses: int
+    stale_hits: int
+    """Number of expired results served while eBay was unavailable"""
+    evictions: int
+    expirations: int
+
+
+class SubsumptionStats(BaseModel):
+    entries: int
+    """Number of complete result sets which serve narrower phrases"""
+    inflight: int
+    """Number of searches in flight which narrower phrases could wait for"""
+    hits: int
+    """Number of eBay calls avoided"""
+    waits: int
+    """Number of times narrower phrases waited for broader searches"""
+
+
+class ExecutorStats(BaseModel):
+    limit: int
+    running: int
+    queued: int
+    started: int
+    shed: int
+    """Number of jobs dropped since they couldn't meet the deadline"""
+    avg_duration: float
+    """Moving average of job durations (in seconds)"""
+
+
+class BreakerStats(BaseModel):
+    endpoint: str
+    state: str
+    """closed, half_open or open"""
+    failures: int
+    """Number of consecutive failures"""
+    rejected: int
+    """Number of calls rejected while the breaker was open"""
+    retry_after: float
+    """Seconds until the open breaker lets the probe call through"""
+
+
+class OutboxStats(BaseModel):
+    buffered: int
+    """Number of rows and acks waiting to be written"""
+    added: int
+    """Number of rows written, duplicates of already added results are skipped by the database"""
+    claimed: int
+    acked: int
+    failed: int
+    """Number of failed writes"""
+    dead_pruned: int
+    """Number of results pruned after they failed max attempts"""
+    backlog: int
+    """Number of results not delivered yet"""
+    dead: int
+    """Number of results which failed max attempts, they are kept for the retention period"""
+
+
+class QueueStats(BaseModel):
+    processor: str
+    workers: int
+    depth: int
+    processed: int
+    errors: int
+    dropped: int
+    spilled: int
+    wait_time_avg: float
+    """Average time results wait in the queue (in seconds)"""
+    wait_time_max: float
+    """Max time results wait in the queue (in seconds)"""
+
+
+class SchedulerStatus(BaseModel):
+    ready: bool
+    """Whether all owned alerts are loaded"""
+    ready_in: Optional[float]
+    """Seconds from startup until all owned alerts were loaded"""
+    jobs: int
+    """Number of scheduled alerts"""
+    member_id: str
+    """Id of this instance in the cluster"""
+    members: int
+    """Number of live instances in the cluster"""
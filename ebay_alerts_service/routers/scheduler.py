@@ -0,0 +1,104 @@
+from typing import List
+
+from fastapi import APIRouter, HTTPException, Request
+
+from .models import scheduler
+
+router = APIRouter(
+    prefix="/scheduler",
+    tags=["scheduler"],
+)
+
+
+@router.get(
+    "/status",
+    description="Get loading status of the scheduler and its cluster membership",
+    response_model=scheduler.SchedulerStatus,
+)
+async def get_status(request: Request):
+    state = request.app.state
+    return scheduler.SchedulerStatus(
+        ready=state.scheduler.ready_in is not None,
+        ready_in=state.scheduler.ready_in,
+        jobs=len(state.scheduler.jobs),
+        member_id=state.cluster.member_id,
+        members=len(state.cluster.ring.members),
+    )
+
+
+@router.get(
+    "/slots",
+    description="Get occupancy of scheduler slots for each interval",
+    response_model=List[scheduler.SlotsOccupancy],
+)
+async def get_slots(request: Request):
+    occupancy = request.app.state.scheduler.wheel.occupancy()
+    return [
+        scheduler.SlotsOccupancy(
+            interval=interval,
+            alerts=sum(histogram),
+            min=min(histogram),
+            max=max(histogram),
+            histogram=histogram,
+        )
+        for interval, histogram in sorted(occupancy.items())
+    ]
+
+
+@router.get(
+    "/cache",
+    description="Get counters of the search results cache",
+    response_model=scheduler.CacheStats,
+)
+async def get_cache_stats(request: Request):
+    return request.app.state.scheduler.cache.stats()
+
+
+@router.get(
+    "/subsumption",
+    description="Get counters of searches answered from results of broader phrases",
+    response_model=scheduler.SubsumptionStats,
+)
+async def get_subsumption_stats(request: Request):
+    return request.app.state.scheduler.subsumption.stats()
+
+
+@router.get(
+    "/executor",
+    description="Get counters of the job executor",
+    response_model=scheduler.ExecutorStats,
+)
+async def get_executor_stats(request: Request):
+    return request.app.state.scheduler.executor.stats()
+
+
+@router.get(
+    "/breakers",
+    description="Get states of circuit breakers of eBay API and processors",
+    response_model=List[scheduler.BreakerStats],
+)
+async def get_breakers(request: Request):
+    return request.app.state.scheduler.resilience.stats()
+
+
+@router.get(
+    "/outbox",
+    description="Get counters of the outbox of results, including dead ones",
+    response_model=scheduler.OutboxStats,
+)
+async def get_outbox_stats(request: Request):
+    outbox = request.app.state.scheduler.outbox
+    if outbox is None:
+        raise HTTPException(status_code=404, detail="Outbox is disabled")
+    return dict(
+        outbox.stats(), backlog=await outbox.backlog(), dead=await outbox.dead()
+    )
+
+
+@router.get(
+    "/queues",
+    description="Get counters of processors queues",
+    response_model=List[scheduler.QueueStats],
+)
+async def get_queues_stats(request: Request):
+    return [queue.stats() for queue in request.app.state.scheduler.queues]
@@ -1,14 +1,26 @@
 import asyncio
+import functools
 import logging
+import time
 import typing as t
+import uuid
+from collections import defaultdict
 
-from aiocron import Cron
-from pydantic import BaseModel, EmailStr
-
-from ebay_alerts_service import db
+from ebay_alerts_service import db, metrics
+from ebay_alerts_service.cache import SearchCache
 from ebay_alerts_service.config import Config
-from ebay_alerts_service.job import alert_job
+from ebay_alerts_service.delta import DeltaTracker
+from ebay_alerts_service.ebay import DEFAULT_LIMIT, EbayClient
+from ebay_alerts_service.executor import JobExecutor
+from ebay_alerts_service.history import PriceRecorder
+from ebay_alerts_service.job import alert_job, normalize_phrase
+from ebay_alerts_service.outbox import Outbox, OutboxConsumer
 from ebay_alerts_service.processors.base import AbstractProcessor
+from ebay_alerts_service.publisher import ProcessorQueue
+from ebay_alerts_service.registry import AlertRegistry, Bitset, JobParams
+from ebay_alerts_service.resilience import CircuitOpenError
+from ebay_alerts_service.subsumption import SubsumptionIndex, tokenize
+from ebay_alerts_service.wheel import TimerWheel
 
 if t.TYPE_CHECKING:
     from ebay_alerts_service.job import AlertJobResult
@@ -16,22 +28,31 @@ if t.TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 
-class JobParams(BaseModel):
+class TickStats(t.NamedTuple):
     """
-    Simple model to keep alert data job details
+    Summary of one scheduler tick
     """
 
-    id: int
-    email: EmailStr
-    phrase: str
+    alerts: int
+    """Number of due alerts which were sent to the jobs"""
+    searches: int
+    """Number of distinct search phrases among due alerts"""
+    skipped: int
+    """Number of due alerts skipped since previous job for them still runs"""
 
-    class Config:
-        orm_mode = True
+    @property
+    def fan_out(self) -> float:
+        """Alerts per distinct phrase"""
+        return self.alerts / self.searches if self.searches else 0.0
 
 
 class AlertsScheduler:
     """
-    This is a scheduler class for all alerts created in the system
+    This is a scheduler class for all alerts created in the system.
+    Alerts are kept in the timer wheel buckets by their interval
+    and spread across the interval by their id.
+    Due alerts are collected into ticks, and alerts with the same
+    normalized phrase share one search per tick.
     """
 
     def __init__(
@@ -39,90 +60,288 @@ class AlertsScheduler:
         config: Config,
         processors: t.List[AbstractProcessor],
         alerts: t.List[db.Alert],
+        client: t.Optional[EbayClient] = None,
+        history: t.Optional[PriceRecorder] = None,
+        outbox: t.Optional[Outbox] = None,
     ):
         self.config = config
         self.processors = processors
-        self.jobs: t.Dict[int, Cron] = self._create_jobs(alerts)
+        self.client = client or EbayClient(config)
+        self.resilience = self.client.resilience
+        self.queues = [
+            ProcessorQueue.from_config(p, config, self.resilience) for p in processors
+        ]
+        self.history = history
+        self.outbox = outbox
+        self.consumers = [
+            OutboxConsumer(
+                outbox,
+                queue,
+                config.outbox_batch_size,
+                config.outbox_poll_interval,
+                config.outbox_prune_interval,
+            )
+            for queue in (self.queues if outbox else [])
+        ]
+        self.cache = SearchCache(
+            config.search_cache_ttl,
+            config.search_cache_max_entries,
+            config.search_cache_max_bytes,
+            config.search_cache_max_stale,
+        )
+        self.delta = DeltaTracker(config.delta_max_items)
+        for queue in self.queues:
+            queue.on_loaded.append(self._on_loaded)
+        self.subsumption = SubsumptionIndex(config.subsumption_ttl, DEFAULT_LIMIT)
+        self.jobs = AlertRegistry()
+        self.wheel = TimerWheel(self._on_due, resolution=config.schedule_resolution)
+        self.running = Bitset()
+        self.pending: t.Set[int] = set()
+        self.last_tick: t.Optional[TickStats] = None
+        self.ready_in: t.Optional[float] = None
+        """Seconds from startup until all owned alerts were loaded"""
+        self._tick_handle: t.Optional[asyncio.TimerHandle] = None
+        self._last_run = 0
+        self.executor = JobExecutor(config.job_concurrency)
+        self._skipped = metrics.SKIPPED_ALERTS.labels()
+        self._job_duration = metrics.JOB_DURATION.labels()
+        self._ebay_searches = metrics.SEARCHES.labels("ebay")
+        self._subsumed_searches = metrics.SEARCHES.labels("subsumed")
+        self._shed = metrics.SHED_ALERTS.labels()
+        self._create_jobs(alerts)
 
     def start(self):
         """
         Starts all scheduled jobs
         """
-
-        for j in self.jobs.values():
-            j.start()
-            logger.debug(f"Job started: {j}")
+        for queue in self.queues:
+            queue.start()
+        for consumer in self.consumers:
+            consumer.start()
+        self.wheel.start()
         logger.info("Jobs are scheduled")
 
     def shutdown(self):
         """
         Stops all cron jobs and processors and do any other required tasks for shutdown
         """
-        for job in self.jobs.values():
-            job.stop()
-            logger.debug(f"Job stopped: {job}")
+        self.wheel.stop()
+        if self._tick_handle:
+            self._tick_handle.cancel()
+            self._tick_handle = None
+        self.executor.stop()
         logger.info("Shutdown completed")
 
-    async def publish(self, result: "AlertJobResult"):
+    async def search(self, phrase: str) -> t.List[dict]:
         """
-        Method used by alert's jobs to publish their results
+        Method used by alert's jobs to search items on eBay.
+        Phrase is answered from complete results of a broader phrase when possible.
         """
-        loads = [loader.load(result) for loader in self.processors]
-        await asyncio.gather(*loads)
+        index = self.subsumption
+        items = index.lookup(phrase)
+        if items is None:
+            items = await index.wait_broader(phrase)
+        if items is not None:
+            self._subsumed_searches.inc()
+            return items
+        index.begin(phrase)
+        try:
+            items, total = await self.client.search_page(
+                phrase, max(DEFAULT_LIMIT, self.config.subsumption_fetch_limit)
+            )
+        except BaseException:
+            # Cancelled searches are ended too, narrower phrases wait for them
+            index.fail(phrase)
+            raise
+        index.finish(phrase, items, total)
+        self._ebay_searches.inc()
+        if self.history:
+            self.history.record(phrase, items)
+        return items[:DEFAULT_LIMIT]
+
+    async def publish(self, result: "AlertJobResult", run: t.Optional[int] = None):
+        """
+        Method used by alert's jobs to publish their results.
+        Results are added to the outbox, from where they are claimed into
+        the queue of each processor and loaded by its workers.
+        Without the outbox results are put to the queues at once.
+        """
+        if self.outbox:
+            if result.alert_id is not None and run is not None:
+                idempotency_key = f"{result.alert_id}:{run}"
+            else:
+                idempotency_key = uuid.uuid4().hex
+            self.outbox.add(result, idempotency_key)
+            return
+        for queue in self.queues:
+            await queue.put(result)
+
+    async def close(self):
+        """
+        Process queued results, close processors and write the outbox
+        """
+        for consumer in self.consumers:
+            consumer.stop()
+        await asyncio.gather(
+            *(queue.close(self.config.publish_drain_timeout) for queue in self.queues)
+        )
+        if self.outbox:
+            await self.outbox.close()
+
+    def _on_loaded(self, result: "AlertJobResult", delivered: bool):
+        """
+        Items are remembered once results are published, so next ticks don't send them
+        while they are being delivered, and they are forgotten if the delivery fails.
+        """
+        if not delivered and result.alert_id is not None:
+            self.delta.forget(result.alert_id, result.results)
 
     async def on_error_callback(self, job_params: JobParams, exc: Exception):
         """
         Method to post any exceptions during alert processing
         """
+        if isinstance(exc, CircuitOpenError):
+            # One warning is logged when the breaker opens, not one per alert
+            logger.debug(f"Job for alert {job_params.id} failed fast: {exc}")
+            return
         logger.error(
             f"Exception during job for alert with id {job_params.id}", exc_info=exc
         )
 
     def upsert_job(self, alert: db.Alert):
-        """Insert or update cron job for given alert"""
-        exist = self.jobs.pop(alert.id, None)
+        """Insert or update job for given alert"""
+        exist = self.jobs.get(alert.id)
+        if exist and normalize_phrase(exist.phrase) != normalize_phrase(alert.phrase):
+            # Items sent for the old phrase are irrelevant for the new one
+            self.delta.reset(alert.id)
+        self._add_job(alert)
         if exist:
-            exist.stop()
-            logger.debug(f"Cron job stopped for alert {alert.id}")
-        cron = self._create_cron_from_alert(alert)
-        self.jobs[alert.id] = cron
-        cron.start()
-        if exist:
-            logger.debug(f"Cron job updated for alert {alert.id}")
+            logger.debug(f"Job updated for alert {alert.id}")
         else:
-            logger.debug(f"Cron job created for alert {alert.id}")
+            logger.debug(f"Job created for alert {alert.id}")
+
+    def upsert_jobs(self, alerts: t.Iterable[db.Alert]):
+        """Insert or update jobs for the batch of alerts"""
+        count = 0
+        for alert in alerts:
+            self.upsert_job(alert)
+            count += 1
+        logger.debug(f"Jobs upserted for {count} alerts")
+
+    def delete_jobs(self, alert_ids: t.Iterable[int]):
+        """Remove jobs for the batch of alerts"""
+        for alert_id in alert_ids:
+            self.delete_job(alert_id)
 
     def delete_job(self, alert_id: int):
-        """Stops the cron job and remove it from the jobs"""
-        cron = self.jobs.pop(alert_id, None)
-        if cron:
-            cron.stop()
-            logger.debug(f"Cron job deleted for alert {alert_id}")
-
-    def _create_cron_from_alert(self, alert: db.Alert) -> Cron:
-        schedule = f"*/{alert.interval} * * * *"
-        job_params = JobParams.from_orm(alert)
-        cron = Cron(
-            schedule,
-            func=alert_job,
-            args=(
-                job_params,
-                self.publish,
+        """Remove the job from the timer wheel and the jobs"""
+        self.wheel.remove(alert_id)
+        self.pending.discard(alert_id)
+        self.delta.reset(alert_id)
+        if self.jobs.pop(alert_id, None):
+            logger.debug(f"Job deleted for alert {alert_id}")
+
+    def schedule(self, alert_ids: t.Iterable[int]):
+        """
+        Mark alerts as due. All alerts marked during the tick window
+        are processed together in the next tick.
+        """
+        self.pending.update(alert_ids)
+        if self._tick_handle is None:
+            loop = asyncio.get_event_loop()
+            self._tick_handle = loop.call_later(self.config.tick_window, self._tick)
+
+    def _tick(self):
+        """
+        Group due alerts by normalized phrase and run one job per phrase
+        """
+        self._tick_handle = None
+        due, self.pending = self.pending, set()
+        groups: t.Dict[str, t.List[JobParams]] = defaultdict(list)
+        skipped = 0
+        for alert_id in due:
+            job_params = self.jobs.get(alert_id)
+            if job_params is None:
+                continue
+            if alert_id in self.running:
+                logger.debug(f"Cron job locked for {job_params}. Skipping.")
+                skipped += 1
+                continue
+            groups[normalize_phrase(job_params.phrase)].append(job_params)
+
+        now = time.monotonic()
+        run = self._next_run()
+        for phrase, subscribers in groups.items():
+            self.running.update(p.id for p in subscribers)
+            # Result is useless when the alert is due again, so the shortest interval wins
+            interval = min(self.wheel.intervals[p.id] for p in subscribers)
+            self.executor.submit(
+                [p.email for p in subscribers],
+                now + interval * self.wheel.unit,
+                functools.partial(self._run_job, phrase, subscribers, run),
+                functools.partial(self._shed_job, phrase, subscribers),
+                # Broader phrases go first, so narrower ones could wait for their results
+                priority=len(tokenize(phrase)),
+            )
+
+        stats = TickStats(
+            alerts=sum(len(s) for s in groups.values()),
+            searches=len(groups),
+            skipped=skipped,
+        )
+        self.last_tick = stats
+        self._skipped.inc(skipped)
+        logger.info(
+            f"Tick: {stats.alerts} alerts, {stats.searches} searches, "
+            f"fan-out {stats.fan_out:.2f}, skipped {stats.skipped}"
+        )
+
+    def _next_run(self) -> int:
+        """
+        Sequence number of the tick, an alert runs at most once in every tick.
+        It's the wall clock in milliseconds unless ticks come faster, so numbers
+        don't repeat after restart and results of every run get their own outbox rows.
+        """
+        self._last_run = max(self._last_run + 1, time.time_ns() // 1_000_000)
+        return self._last_run
+
+    async def _run_job(self, phrase: str, subscribers: t.List[JobParams], run: int):
+        started = time.monotonic()
+        try:
+            await alert_job(
+                phrase,
+                subscribers,
+                self.search,
+                self.cache,
+                self.delta,
+                functools.partial(self.publish, run=run),
                 self.on_error_callback,
-                asyncio.Lock(),
                 self.config,
-            ),
+            )
+        finally:
+            self.running.difference_update(p.id for p in subscribers)
+            self._job_duration.observe(time.monotonic() - started)
+
+    def _shed_job(self, phrase: str, subscribers: t.List[JobParams]):
+        self.running.difference_update(p.id for p in subscribers)
+        self._shed.inc(len(subscribers))
+        logger.warning(
+            f"Job shed, it can't finish before the deadline: phrase={phrase!r}, "
+            f"subscribers={len(subscribers)}"
         )
-        return cron
 
-    def _create_jobs(self, alerts: t.List[db.Alert]) -> t.Dict[int, Cron]:
+    def _on_due(self, interval: int, alert_ids: t.Collection[int]):
+        self.schedule(alert_ids)
+
+    def _add_job(self, alert: db.Alert):
+        # Alerts come from the database only and were validated before they were stored
+        self.jobs.put(alert.id, alert.email, alert.phrase)
+        self.wheel.add(alert.id, alert.interval)
+
+    def _create_jobs(self, alerts: t.List[db.Alert]):
         """
-        Create cron job for each alert in the list of alerts
-        :return: dict with prepared Cron jobs for each entry
+        Put each alert from the list of alerts into the timer wheel
         """
-        jobs = {}
         logger.info(f"Create jobs for {len(alerts)} alerts")
         for alert in alerts:
-            cron = self._create_cron_from_alert(alert)
-            jobs[alert.id] = cron
-        return jobs
+            self._add_job(alert)
@@ -0,0 +1,262 @@
+import asyncio
+import base64
+import logging
+import socket
+import ssl
+import typing as t
+from contextlib import asynccontextmanager
+
+if t.TYPE_CHECKING:
+    from ebay_alerts_service.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class SmtpError(Exception):
+    """Raised when SMTP server responds with an unexpected code"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"SMTP error {code}: {message}")
+        self.code = code
+
+
+def retriable(exc: Exception) -> bool:
+    """Transient SMTP replies, timeouts and connection errors are worth retrying"""
+    if isinstance(exc, SmtpError):
+        return exc.code < 500
+    return isinstance(exc, (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError))
+
+
+class Envelope(t.NamedTuple):
+    sender: str
+    recipients: t.List[str]
+    data: bytes
+
+
+class SmtpConnection:
+    """
+    Minimal asynchronous SMTP client connection.
+    When server supports PIPELINING extension, envelope commands of each message
+    are sent in one write and their replies are read afterwards.
+    Connection is encrypted either from the start (tls) or upgraded with STARTTLS,
+    credentials are never sent over unencrypted connection unless insecure_auth is set.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        timeout: float,
+        tls: bool = False,
+        starttls: bool = False,
+        insecure_auth: bool = False,
+        ssl_context: t.Optional[ssl.SSLContext] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.tls = tls
+        self.starttls = starttls
+        self.insecure_auth = insecure_auth
+        self.ssl_context = ssl_context
+        self.encrypted = False
+        self.extensions: t.Set[str] = set()
+        self._reader: t.Optional[asyncio.StreamReader] = None
+        self._writer: t.Optional[asyncio.StreamWriter] = None
+
+    @property
+    def pipelining(self) -> bool:
+        return "PIPELINING" in self.extensions
+
+    async def connect(
+        self, user: t.Optional[str] = None, password: t.Optional[str] = None
+    ):
+        """Open connection, greet the server and authenticate if credentials are given"""
+        context = self.ssl_context or ssl.create_default_context()
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                self.host, self.port, ssl=context if self.tls else None
+            ),
+            self.timeout,
+        )
+        self.encrypted = self.tls
+        await self._expect((220,))
+        await self._ehlo()
+        if self.starttls and not self.encrypted:
+            if "STARTTLS" not in self.extensions:
+                raise SmtpError(530, "Server doesn't support STARTTLS")
+            self._write("STARTTLS")
+            await self._expect((220,))
+            await asyncio.wait_for(self._start_tls(context), self.timeout)
+            self.encrypted = True
+            # Extensions announced before TLS must be discarded
+            await self._ehlo()
+        if user:
+            if not self.encrypted and not self.insecure_auth:
+                raise SmtpError(
+                    530, "Credentials aren't sent over unencrypted connection"
+                )
+            token = base64.b64encode(f"\0{user}\0{password or ''}".encode()).decode()
+            self._write(f"AUTH PLAIN {token}")
+            await self._expect((235,))
+
+    async def send(self, envelope: Envelope):
+        """Send one message"""
+        commands = [f"MAIL FROM:<{envelope.sender}>"]
+        commands.extend(f"RCPT TO:<{r}>" for r in envelope.recipients)
+        commands.append("DATA")
+        expected = [(250,)] + [(250, 251)] * len(envelope.recipients) + [(354,)]
+        if self.pipelining:
+            for command in commands:
+                self._write(command)
+            replies = [await self._read_reply() for _ in commands]
+        else:
+            replies = []
+            for command in commands:
+                self._write(command)
+                replies.append(await self._read_reply())
+                if replies[-1][0] >= 400:
+                    break
+        for (code, lines), codes in zip(replies, expected):
+            if code not in codes:
+                if replies[-1][0] == 354:
+                    # Server already waits for the data, so send the empty message
+                    self._writer.write(b".\r\n")
+                    await self._read_reply()
+                await self.reset()
+                raise SmtpError(code, " ".join(lines))
+        self._writer.write(self._dot_stuff(envelope.data))
+        await self._expect((250,))
+
+    async def reset(self):
+        """Reset current mail transaction"""
+        self._write("RSET")
+        await self._read_reply()
+
+    async def close(self):
+        """Quit and close the connection"""
+        if self._writer is None:
+            return
+        try:
+            self._write("QUIT")
+            await self._read_reply()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        self.abort()
+
+    def abort(self):
+        """Close the connection without quit"""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _ehlo(self):
+        self._write(f"EHLO {socket.getfqdn()}")
+        _, lines = await self._expect((250,))
+        self.extensions = {line.split(" ")[0].upper() for line in lines[1:]}
+
+    async def _start_tls(self, context: ssl.SSLContext):
+        if hasattr(self._writer, "start_tls"):
+            await self._writer.start_tls(context, server_hostname=self.host)
+            return
+        # Streams before Python 3.11 can't upgrade their transport themselves
+        transport = self._writer.transport
+        protocol = transport.get_protocol()
+        tls_transport = await asyncio.get_event_loop().start_tls(
+            transport, protocol, context, server_hostname=self.host
+        )
+        protocol._transport = tls_transport
+        self._writer._transport = tls_transport
+
+    def _write(self, command: str):
+        self._writer.write(f"{command}\r\n".encode())
+
+    async def _read_reply(self) -> t.Tuple[int, t.List[str]]:
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self._reader.readline(), self.timeout)
+            if not line:
+                raise ConnectionError("SMTP connection closed")
+            text = line.decode().rstrip("\r\n")
+            lines.append(text[4:])
+            if text[3:4] != "-":
+                return int(text[:3]), lines
+
+    async def _expect(self, codes: t.Tuple[int, ...]) -> t.Tuple[int, t.List[str]]:
+        code, lines = await self._read_reply()
+        if code not in codes:
+            raise SmtpError(code, " ".join(lines))
+        return code, lines
+
+    @staticmethod
+    def _dot_stuff(data: bytes) -> bytes:
+        lines = data.replace(b"\r\n", b"\n").split(b"\n")
+        if lines and lines[-1] == b"":
+            lines.pop()
+        stuffed = [b"." + line if line.startswith(b".") else line for line in lines]
+        return b"\r\n".join(stuffed) + b"\r\n.\r\n"
+
+
+class SmtpPool:
+    """
+    Pool of persistent SMTP connections.
+    At most `smtp_pool_size` connections are in use at the same time,
+    idle connections are reused by the next batch of messages.
+    """
+
+    def __init__(self, config: "Config"):
+        self.config = config
+        self._semaphore = asyncio.Semaphore(config.smtp_pool_size)
+        self._idle: t.List[SmtpConnection] = []
+
+    async def send_many(self, envelopes: t.List[Envelope]):
+        """Send batch of messages over one connection"""
+        async with self.connection() as conn:
+            for envelope in envelopes:
+                await conn.send(envelope)
+
+    @asynccontextmanager
+    async def connection(self) -> t.AsyncIterator[SmtpConnection]:
+        """Take idle connection from the pool or open a new one"""
+        async with self._semaphore:
+            conn = await self._acquire()
+            try:
+                yield conn
+            except SmtpError:
+                self._idle.append(conn)
+                raise
+            except BaseException:
+                conn.abort()
+                raise
+            else:
+                self._idle.append(conn)
+
+    async def close(self):
+        """Close all idle connections"""
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(conn.close() for conn in idle))
+
+    async def _acquire(self) -> SmtpConnection:
+        while self._idle:
+            conn = self._idle.pop()
+            try:
+                # Idle connection could be closed by the server meanwhile
+                await conn.reset()
+                return conn
+            except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                conn.abort()
+        conn = SmtpConnection(
+            self.config.smtp_host,
+            self.config.smtp_port,
+            self.config.request_timeout,
+            tls=self.config.smtp_tls,
+            starttls=self.config.smtp_starttls,
+            insecure_auth=self.config.smtp_insecure_auth,
+        )
+        try:
+            await conn.connect(self.config.smtp_user, self.config.smtp_password)
+        except BaseException:
+            conn.abort()
+            raise
+        logger.debug(f"SMTP connection opened to {self.config.smtp_host}")
+        return conn
@@ -0,0 +1,192 @@
+import asyncio
+import re
+import time
+import typing as t
+from collections import deque
+
+TOKEN_RE = re.compile(r"\w+")
+OPERATORS_RE = re.compile(r"[-\"(),*]")
+"""eBay query syntax (exclusions, exact phrases, OR groups, wildcards)"""
+
+
+def tokenize(text: str) -> t.FrozenSet[str]:
+    """Lowercase word tokens of the phrase or item title"""
+    return frozenset(TOKEN_RE.findall(text.lower()))
+
+
+def subsumable(phrase: str) -> bool:
+    """
+    Only plain keyword phrases match items with all of their tokens,
+    phrases with eBay operators are never served from other results
+    """
+    return not OPERATORS_RE.search(phrase) and bool(TOKEN_RE.search(phrase))
+
+
+class IndexEntry(t.NamedTuple):
+    tokens: t.FrozenSet[str]
+    items: t.List[t.Tuple[t.FrozenSet[str], dict]]
+    """Items with tokens of their titles, in the order of the search (by price)"""
+    expires_at: float
+
+
+class SubsumptionIndex:
+    """
+    Inverted index of search phrases by token over recently fetched complete results.
+    Results are complete when eBay reports no more matching items than were fetched,
+    so every item which matches a narrower phrase (superset of tokens) is among them
+    and the narrower phrase is answered by filtering items by title tokens locally.
+    Searches in flight are indexed as well, so a narrower phrase of the same tick
+    waits for the broader search instead of calling eBay.
+    """
+
+    def __init__(self, ttl: float, limit: int):
+        """
+        :param ttl: how long complete results are used (in seconds)
+        :param limit: max number of items returned for a phrase
+        """
+        self.ttl = ttl
+        self.limit = limit
+        self.hits = 0
+        self.waits = 0
+        self._entries: t.Dict[str, IndexEntry] = {}
+        self._postings: t.Dict[str, t.Set[str]] = {}
+        self._inflight: t.Dict[str, asyncio.Future] = {}
+        self._inflight_postings: t.Dict[str, t.Set[str]] = {}
+        # Entries live for the same ttl, so they expire in the order they were added
+        self._expiry: t.Deque[t.Tuple[float, str]] = deque()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, phrase: str) -> t.Optional[t.List[dict]]:
+        """Items for the phrase from complete results of a broader phrase"""
+        if not subsumable(phrase):
+            return None
+        tokens = tokenize(phrase)
+        now = time.monotonic()
+        for broader in self._broader(tokens, self._postings, self._tokens_of_entry):
+            entry = self._entries[broader]
+            if entry.expires_at < now:
+                self._remove(broader)
+                continue
+            # Results of the phrase itself are the business of the search cache
+            if broader != phrase:
+                return self._match(tokens, entry)
+        return None
+
+    async def wait_broader(self, phrase: str) -> t.Optional[t.List[dict]]:
+        """
+        Wait for a broader search in flight and return items for the phrase
+        from its results, if they are complete
+        """
+        if not subsumable(phrase):
+            return None
+        tokens = tokenize(phrase)
+        for broader in self._broader(
+            tokens, self._inflight_postings, self._tokens_of_inflight
+        ):
+            if broader == phrase:
+                continue
+            self.waits += 1
+            entry = await asyncio.shield(self._inflight[broader])
+            return self._match(tokens, entry) if entry else None
+        return None
+
+    def begin(self, phrase: str):
+        """Register search of the phrase which is in flight"""
+        if not subsumable(phrase) or phrase in self._inflight:
+            return
+        self._inflight[phrase] = asyncio.get_event_loop().create_future()
+        for token in tokenize(phrase):
+            self._inflight_postings.setdefault(token, set()).add(phrase)
+
+    def finish(self, phrase: str, items: t.List[dict], total: t.Optional[int]):
+        """Index results of the search, if they are complete"""
+        now = time.monotonic()
+        self._expire(now)
+        if total is None or total > len(items) or not subsumable(phrase):
+            self._end(phrase)
+            return
+        entry = IndexEntry(
+            tokenize(phrase),
+            [(tokenize(item.get("title", "")), item) for item in items],
+            now + self.ttl,
+        )
+        # Searches waiting for this one get results even if they expire at once
+        self._end(phrase, entry)
+        self._remove(phrase)
+        self._entries[phrase] = entry
+        self._expiry.append((entry.expires_at, phrase))
+        for token in entry.tokens:
+            self._postings.setdefault(token, set()).add(phrase)
+
+    def fail(self, phrase: str):
+        """Unregister search which failed"""
+        self._end(phrase)
+
+    def stats(self) -> t.Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "waits": self.waits,
+        }
+
+    def _tokens_of_entry(self, phrase: str) -> t.FrozenSet[str]:
+        return self._entries[phrase].tokens
+
+    def _tokens_of_inflight(self, phrase: str) -> t.FrozenSet[str]:
+        return tokenize(phrase)
+
+    @staticmethod
+    def _broader(
+        tokens: t.FrozenSet[str],
+        postings: t.Dict[str, t.Set[str]],
+        tokens_of: t.Callable[[str], t.FrozenSet[str]],
+    ) -> t.List[str]:
+        """Phrases which tokens are a subset of the tokens, narrowest first"""
+        counts: t.Dict[str, int] = {}
+        for token in tokens:
+            for phrase in postings.get(token, ()):
+                counts[phrase] = counts.get(phrase, 0) + 1
+        broader = [
+            phrase
+            for phrase, count in counts.items()
+            if count == len(tokens_of(phrase))
+        ]
+        return sorted(broader, key=lambda phrase: -counts[phrase])
+
+    def _expire(self, now: float):
+        while self._expiry and self._expiry[0][0] < now:
+            expires_at, phrase = self._expiry.popleft()
+            entry = self._entries.get(phrase)
+            if entry is not None and entry.expires_at == expires_at:
+                self._remove(phrase)
+
+    def _match(self, tokens: t.FrozenSet[str], entry: IndexEntry) -> t.List[dict]:
+        self.hits += 1
+        matched = [item for title, item in entry.items if tokens <= title]
+        return matched[: self.limit]
+
+    def _end(self, phrase: str, entry: t.Optional[IndexEntry] = None):
+        future = self._inflight.pop(phrase, None)
+        if future is None:
+            return
+        future.set_result(entry)
+        for token in tokenize(phrase):
+            self._discard(self._inflight_postings, token, phrase)
+
+    def _remove(self, phrase: str):
+        entry = self._entries.pop(phrase, None)
+        if entry is None:
+            return
+        for token in entry.tokens:
+            self._discard(self._postings, token, phrase)
+
+    @staticmethod
+    def _discard(postings: t.Dict[str, t.Set[str]], token: str, phrase: str):
+        phrases = postings.get(token)
+        if phrases is not None:
+            phrases.discard(phrase)
+            if not phrases:
+                del postings[token]
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+import typing as t
+from array import array
+
+from ebay_alerts_service import metrics
+from ebay_alerts_service.registry import IdArray
+
+logger = logging.getLogger(__name__)
+
+DUE_CALLBACK_TYPE = t.Callable[[int, t.Collection[int]], None]
+
+
+def slot_for(alert_id: int, slots: int) -> int:
+    """
+    Stable slot of the alert inside its interval.
+    Multiplicative (Knuth) hash of the id spreads sequential ids evenly
+    and doesn't depend on anything except the id and number of slots.
+    """
+    return ((alert_id * 2654435761) & 0xFFFFFFFF) % slots
+
+
+class TimerWheel:
+    """
+    Timer wheel with one bucket of alert ids per interval.
+    Every bucket is split into slots of `resolution` seconds and each alert
+    lives in the slot chosen by its id hash, so alerts of the same interval
+    are spread across the whole interval instead of firing at once.
+    Each bucket has a single driver which wakes up on every slot boundary
+    and dispatches all alert ids of the current slot as one batch.
+    """
+
+    def __init__(
+        self, on_due: DUE_CALLBACK_TYPE, unit: float = 60.0, resolution: float = 1.0
+    ):
+        """
+        :param on_due: callback called with interval and batch of due alert ids
+        :param unit: length of one interval unit (in seconds)
+        :param resolution: length of one slot (in seconds)
+        """
+        self.on_due = on_due
+        self.unit = unit
+        self.resolution = resolution
+        # Slots are arrays, removal swaps the alert with the last one of the slot
+        self.buckets: t.Dict[int, t.List[array]] = {}
+        self.intervals = IdArray("H")
+        self.positions = IdArray("I")
+        """Index of the alert in its slot"""
+        self._count = 0
+        self._handles: t.Dict[int, asyncio.TimerHandle] = {}
+        self._next_slot: t.Dict[int, int] = {}
+        self._lag: t.Dict[int, metrics.HistogramValue] = {}
+        self._started = False
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, alert_id: int, interval: int):
+        """Put alert into the bucket for its interval or move it between buckets"""
+        current = self.intervals.get(alert_id)
+        if current == interval:
+            return
+        if current is not None:
+            self._discard(current, alert_id)
+        else:
+            self._count += 1
+        if interval not in self.buckets:
+            slots = max(1, round(interval * self.unit / self.resolution))
+            self.buckets[interval] = [array("I") for _ in range(slots)]
+            if self._started:
+                self._start_driver(interval)
+        slot = self._slot(interval, alert_id)
+        self.positions[alert_id] = len(slot)
+        slot.append(alert_id)
+        self.intervals[alert_id] = interval
+
+    def remove(self, alert_id: int):
+        """Remove alert from its bucket"""
+        interval = self.intervals.pop(alert_id, None)
+        if interval is not None:
+            self._discard(interval, alert_id)
+            self._count -= 1
+
+    def occupancy(self) -> t.Dict[int, t.List[int]]:
+        """Number of alerts in each slot for every interval"""
+        return {
+            interval: [len(slot) for slot in slots]
+            for interval, slots in self.buckets.items()
+        }
+
+    def start(self):
+        """Start drivers for all buckets"""
+        self._started = True
+        for interval in self.buckets:
+            self._start_driver(interval)
+
+    def stop(self):
+        """Stop all drivers"""
+        self._started = False
+        for handle in self._handles.values():
+            handle.cancel()
+        self._handles.clear()
+
+    def _slot(self, interval: int, alert_id: int) -> array:
+        slots = self.buckets[interval]
+        return slots[slot_for(alert_id, len(slots))]
+
+    def _discard(self, interval: int, alert_id: int):
+        slot = self._slot(interval, alert_id)
+        last = slot.pop()
+        if last != alert_id:
+            index = self.positions[alert_id]
+            slot[index] = last
+            self.positions[last] = index
+
+    def _start_driver(self, interval: int):
+        self._lag[interval] = metrics.SCHEDULE_LAG.labels(interval)
+        self._next_slot[interval] = int(time.time() // self.resolution) + 1
+        self._schedule(interval)
+
+    def _schedule(self, interval: int):
+        loop = asyncio.get_event_loop()
+        delay = self._next_slot[interval] * self.resolution - time.time()
+        self._handles[interval] = loop.call_at(
+            loop.time() + delay, self._fire, interval
+        )
+
+    def _fire(self, interval: int):
+        slots = self.buckets[interval]
+        now = time.time()
+        current = int(now // self.resolution)
+        # The loop could be late, so dispatch every missed slot, but at most one round
+        first = max(self._next_slot[interval], current - len(slots) + 1)
+        self._lag[interval].observe(now - self._next_slot[interval] * self.resolution)
+        self._next_slot[interval] = current + 1
+        self._schedule(interval)
+        for slot_number in range(first, current + 1):
+            slot = slots[slot_number % len(slots)]
+            if slot:
+                logger.debug(f"Interval {interval}: {len(slot)} alerts are due")
+                self.on_due(interval, tuple(slot))
@@ -2,11 +2,14 @@ import asyncio
 import os
 from typing import Optional
 
+import aiohttp
 import typer
 import uvicorn
 
+from ebay_alerts_service import importer
 from ebay_alerts_service.config import Config
 from ebay_alerts_service.db import DbConnection
+from ebay_alerts_service.utils import setup_logging
 
 cli = typer.Typer(name="CLI for Metrics Search API")
 
@@ -21,12 +24,64 @@ def init_db():
         if decision != "y":
             return
         os.remove(config.db_path)
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(config.db_path + suffix):
+                os.remove(config.db_path + suffix)
 
     loop = asyncio.get_event_loop()
     conn = DbConnection(config.db_path, echo=True)
     loop.run_until_complete(conn.init_schema())
 
 
+@cli.command("import_alerts")
+def import_alerts(
+    path: str = typer.Argument(
+        ..., help="NDJSON or CSV file with email, phrase, interval"
+    ),
+    chunk_size: int = typer.Option(1000, help="Number of alerts in one transaction"),
+):
+    """Import alerts from NDJSON or CSV file, existing alerts are skipped"""
+    config = Config()
+    setup_logging(config)
+    conn = DbConnection(config.db_path)
+    loop = asyncio.get_event_loop()
+    try:
+        stats = loop.run_until_complete(importer.import_alerts(conn, path, chunk_size))
+    finally:
+        loop.run_until_complete(conn.close())
+    print(
+        f"Created: {stats.created}, conflicts: {stats.conflicts}, invalid: {stats.invalid}"
+    )
+    print(
+        "Running application schedules imported alerts within "
+        f"{config.cluster_reconcile_interval}s (APP_CLUSTER_RECONCILE_INTERVAL)."
+    )
+
+
+@cli.command("profile")
+def profile(
+    duration: float = typer.Option(10, help="Duration of the profile (in seconds)"),
+    url: str = typer.Option(
+        "http://localhost:8000", help="Base URL of the running application"
+    ),
+):
+    """Record sampling profile of the running application to APP_PROFILE_DIR"""
+
+    async def record() -> dict:
+        timeout = aiohttp.ClientTimeout(total=duration + 30)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.post(
+                f"{url}/diagnostics/profile", params={"duration": duration}
+            ) as response:
+                return await response.json()
+
+    data = asyncio.get_event_loop().run_until_complete(record())
+    if "path" not in data:
+        print(f"Failed to record profile: {data.get('detail')}")
+        raise typer.Exit(1)
+    print(f"Recorded {data['samples']} samples in {data['duration']}s: {data['path']}")
+
+
 @cli.command("run")
 def run(
     host: Optional[str] = typer.Option("0.0.0.0", envvar="APP_HOST"),
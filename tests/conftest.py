@@ -1,5 +1,4 @@
 import os
-from unittest.mock import AsyncMock
 
 import pytest
 from httpx import AsyncClient
@@ -14,18 +13,23 @@ os.environ["APP_EBAY_API_KEY"] = "123"
 os.environ["APP_EBAY_API_URL"] = "https://test.ebay.local"
 
 
+def remove_test_db():
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(TEST_DB_PATH + suffix)
+        except FileNotFoundError:
+            pass
+
+
 @pytest.fixture(autouse=True)
 async def routine():
-    try:
-        os.remove(TEST_DB_PATH)
-    except FileNotFoundError:
-        pass
-
+    remove_test_db()
     config = Config()
     connection = DbConnection(config.db_path)
     await connection.init_schema()
+    await connection.close()
     yield
-    os.remove(TEST_DB_PATH)
+    remove_test_db()
 
 
 @pytest.fixture(autouse=False)
@@ -38,14 +42,6 @@ async def test_client():
     await api.router.shutdown()
 
 
-@pytest.fixture(autouse=False)
-def mock_callbacks():
-    api.state.conn.on_create = AsyncMock()
-    api.state.conn.on_update = AsyncMock()
-    api.state.conn.on_delete = AsyncMock()
-    yield
-
-
 @pytest.fixture(autouse=False)
 async def db_connection():
     config = Config()
@@ -0,0 +1,85 @@
+import asyncio
+import typing as t
+
+
+class FakeSmtpServer:
+    """
+    Local stand-in for SMTP server which supports PIPELINING (but not STARTTLS)
+    and keeps all received messages and credentials
+    """
+
+    def __init__(self):
+        self.messages: t.List[dict] = []
+        self.connections = 0
+        self.reject_recipients: t.Set[str] = set()
+        self.credentials: t.List[str] = []
+        self._server: t.Optional[asyncio.AbstractServer] = None
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self):
+        self._server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        writer.write(b"220 fake ESMTP\r\n")
+        message: dict = {}
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode().strip()
+            verb = command.split(" ")[0].upper()
+            if verb == "DATA":
+                await self.data(reader, writer, message)
+            elif verb == "QUIT":
+                writer.write(b"221 Bye\r\n")
+                await writer.drain()
+                break
+            else:
+                writer.write(self.reply(verb, command, message))
+            await writer.drain()
+        writer.close()
+
+    def reply(self, verb: str, command: str, message: dict) -> bytes:
+        if verb == "EHLO":
+            return b"250-fake\r\n250-PIPELINING\r\n250 8BITMIME\r\n"
+        if verb == "MAIL":
+            message.clear()
+            message.update(sender=command[10:].strip("<>"), recipients=[])
+            return b"250 OK\r\n"
+        if verb == "RCPT":
+            recipient = command[8:].strip("<>")
+            if recipient in self.reject_recipients:
+                return b"550 No such user\r\n"
+            message["recipients"].append(recipient)
+            return b"250 OK\r\n"
+        if verb == "AUTH":
+            self.credentials.append(command[11:])
+            return b"235 Authenticated\r\n"
+        if verb in ("RSET", "NOOP"):
+            return b"250 OK\r\n"
+        return b"502 Not implemented\r\n"
+
+    async def data(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, message: dict
+    ):
+        if not message.get("recipients"):
+            writer.write(b"554 No valid recipients\r\n")
+            return
+        writer.write(b"354 Go ahead\r\n")
+        await writer.drain()
+        data = []
+        while True:
+            line = await reader.readline()
+            if line == b".\r\n":
+                break
+            data.append(line)
+        self.messages.append(dict(message, data=b"".join(data).decode()))
+        writer.write(b"250 Queued\r\n")
@@ -1,3 +1,5 @@
+import json
+
 import pytest
 from httpx import AsyncClient
 
@@ -25,13 +27,14 @@ async def test_get_alerts(test_client: AsyncClient, db_connection: DbConnection)
 
 
 @pytest.mark.asyncio
-async def test_create_alert(test_client: AsyncClient, mock_callbacks):
+async def test_create_alert(test_client: AsyncClient):
     url = "/alerts"
     payload = {"email": "first@test.local", "phrase": "first", "interval": 10}
     res = await test_client.post(url, json=payload)
     assert res.status_code == 201
     assert res.json()["id"] == 1
-    api.state.conn.on_create.assert_called()
+    await api.state.conn.feed.join()
+    assert api.state.scheduler.jobs[1].phrase == "first"
 
 
 @pytest.mark.asyncio
@@ -50,7 +53,8 @@ async def test_get_alert(test_client: AsyncClient, db_connection: DbConnection):
 
 @pytest.mark.asyncio
 async def test_update_alert(
-    test_client: AsyncClient, db_connection: DbConnection, mock_callbacks
+    test_client: AsyncClient,
+    db_connection: DbConnection,
 ):
     await db_connection.bulk_create([Alert(**a) for a in ALERTS])
     url = "/alerts/2"
@@ -58,12 +62,14 @@ async def test_update_alert(
     res = await test_client.patch(url, json=payload)
     assert res.status_code == 200
     assert res.json()["phrase"] == "changed"
-    api.state.conn.on_update.assert_called()
+    await api.state.conn.feed.join()
+    assert api.state.scheduler.jobs[2].phrase == "changed"
 
 
 @pytest.mark.asyncio
 async def test_delete_alert(
-    test_client: AsyncClient, db_connection: DbConnection, mock_callbacks
+    test_client: AsyncClient,
+    db_connection: DbConnection,
 ):
     await db_connection.bulk_create([Alert(**a) for a in ALERTS])
     url = "/alerts/2"
@@ -83,4 +89,212 @@ async def test_delete_alert(
     assert data == [
         {"id": 1, "email": "email1@test.local", "phrase": "first", "interval": 2}
     ]
-    api.state.conn.on_delete.assert_called()
+    await api.state.conn.feed.join()
+    assert 2 not in api.state.scheduler.jobs
+
+
+@pytest.mark.asyncio
+async def test_get_scheduler_slots(test_client: AsyncClient):
+    api.state.scheduler.upsert_job(Alert(id=1, **ALERTS[0]))
+    api.state.scheduler.upsert_job(Alert(id=2, **ALERTS[1]))
+    res = await test_client.get("/scheduler/slots")
+    assert res.status_code == 200
+    data = res.json()
+    assert len(data) == 1
+    assert data[0]["interval"] == 2
+    assert data[0]["alerts"] == 2
+    assert len(data[0]["histogram"]) == 120
+
+
+@pytest.mark.asyncio
+async def test_scheduler_loads_alerts_in_background(db_connection: DbConnection):
+    await db_connection.bulk_create([Alert(**a) for a in ALERTS])
+    await api.router.startup()
+    try:
+        async with AsyncClient(app=api, base_url="http://test.local") as client:
+            await api.state.loading_task
+            res = await client.get("/scheduler/status")
+    finally:
+        await api.router.shutdown()
+    assert res.status_code == 200
+    data = res.json()
+    assert data["ready"] is True
+    assert data["ready_in"] > 0
+    assert data["jobs"] == 2
+    assert data["members"] == 1
+    assert api.state.scheduler.jobs[2].email == "email2@test.local"
+
+
+@pytest.mark.asyncio
+async def test_get_subsumption_stats(test_client: AsyncClient):
+    res = await test_client.get("/scheduler/subsumption")
+    assert res.status_code == 200
+    assert res.json() == {"entries": 0, "inflight": 0, "hits": 0, "waits": 0}
+
+
+@pytest.mark.asyncio
+async def test_get_outbox_stats(test_client: AsyncClient):
+    res = await test_client.get("/scheduler/outbox")
+    assert res.status_code == 200
+    assert res.json()["backlog"] == 0
+    assert res.json()["dead"] == 0
+
+
+@pytest.mark.asyncio
+async def test_get_alerts_pages(test_client: AsyncClient, db_connection: DbConnection):
+    await db_connection.bulk_create(
+        [
+            Alert(email="a@test.local", phrase=f"phrase {i}", interval=2)
+            for i in range(5)
+        ]
+    )
+    res = await test_client.get("/alerts", params={"limit": 2})
+    assert [a["id"] for a in res.json()] == [1, 2]
+    assert res.headers["X-Next-After-Id"] == "2"
+    res = await test_client.get("/alerts", params={"limit": 2, "after_id": 4})
+    assert [a["id"] for a in res.json()] == [5]
+    assert "X-Next-After-Id" not in res.headers
+
+
+@pytest.mark.asyncio
+async def test_get_alerts_filters(
+    test_client: AsyncClient, db_connection: DbConnection
+):
+    await db_connection.bulk_create([Alert(**a) for a in ALERTS])
+    res = await test_client.get("/alerts", params={"email": "email2@test.local"})
+    assert [a["id"] for a in res.json()] == [2]
+    res = await test_client.get("/alerts", params={"phrase": "first"})
+    assert [a["id"] for a in res.json()] == [1]
+
+
+@pytest.mark.asyncio
+async def test_stream_alerts(test_client: AsyncClient, db_connection: DbConnection):
+    await db_connection.bulk_create([Alert(**a) for a in ALERTS])
+    res = await test_client.get("/alerts", headers={"Accept": "application/x-ndjson"})
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    assert lines == [{"id": i + 1, **a} for i, a in enumerate(ALERTS)]
+
+
+@pytest.mark.asyncio
+async def test_bulk_create_alerts(
+    test_client: AsyncClient,
+    db_connection: DbConnection,
+):
+    await db_connection.bulk_create([Alert(**ALERTS[0])])
+    payload = ALERTS + [dict(email="email3@test.local", phrase="third", interval=10)]
+    res = await test_client.post("/alerts/bulk", json=payload)
+    assert res.status_code == 200
+    assert res.json() == [
+        {"index": 0, "id": None, "status": "conflict"},
+        {"index": 1, "id": 2, "status": "created"},
+        {"index": 2, "id": 3, "status": "created"},
+    ]
+    await api.state.conn.feed.join()
+    assert set(api.state.scheduler.jobs) == {2, 3}
+
+
+@pytest.mark.asyncio
+async def test_bulk_update_alerts(
+    test_client: AsyncClient,
+    db_connection: DbConnection,
+):
+    await db_connection.bulk_create([Alert(**a) for a in ALERTS])
+    payload = [
+        {"id": 1, "interval": 30},
+        {"id": 2, "phrase": "first", "email": "email1@test.local"},
+        {"id": 3, "interval": 10},
+    ]
+    res = await test_client.patch("/alerts/bulk", json=payload)
+    assert [r["status"] for r in res.json()] == ["updated", "conflict", "not_found"]
+    res = await test_client.get("/alerts/1")
+    assert res.json()["interval"] == 30
+    await api.state.conn.feed.join()
+    assert api.state.scheduler.jobs[1].phrase == "first"
+    assert api.state.scheduler.wheel.intervals[1] == 30
+
+
+@pytest.mark.asyncio
+async def test_bulk_delete_alerts(
+    test_client: AsyncClient,
+    db_connection: DbConnection,
+):
+    await db_connection.bulk_create([Alert(**a) for a in ALERTS])
+    res = await test_client.request("DELETE", "/alerts/bulk", json={"ids": [2, 5]})
+    assert [r["status"] for r in res.json()] == ["deleted", "not_found"]
+    res = await test_client.get("/alerts")
+    assert [a["id"] for a in res.json()] == [1]
+    await api.state.conn.feed.join()
+    assert set(api.state.scheduler.jobs) == set()
+
+
+@pytest.mark.asyncio
+async def test_unchanged_alerts_get_304(
+    test_client: AsyncClient, db_connection: DbConnection, monkeypatch
+):
+    await db_connection.bulk_create([Alert(**a) for a in ALERTS])
+    res = await test_client.get("/alerts")
+    etag = res.headers["etag"]
+    selects = []
+    select = api.state.conn.select
+
+    async def counted_select(stmt):
+        selects.append(stmt)
+        return await select(stmt)
+
+    monkeypatch.setattr(api.state.conn, "select", counted_select)
+    res = await test_client.get("/alerts", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.headers["etag"] == etag
+    # the body is served from the cache
+    res = await test_client.get("/alerts")
+    assert res.json() == [dict(a, id=i) for i, a in enumerate(ALERTS, 1)]
+    assert selects == []
+
+    res = await test_client.patch("/alerts/1", json={"phrase": "changed"})
+    assert res.status_code == 200
+    res = await test_client.get("/alerts", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.headers["etag"] != etag
+    assert res.json()[0]["phrase"] == "changed"
+
+
+@pytest.mark.asyncio
+async def test_alert_etag_changes_with_other_connections(
+    test_client: AsyncClient, db_connection: DbConnection
+):
+    await db_connection.bulk_create([Alert(**a) for a in ALERTS])
+    res = await test_client.get("/alerts/1")
+    etag = res.headers["etag"]
+    assert (await test_client.get("/alerts/3")).status_code == 404
+    # "*" matches only existing alerts
+    res = await test_client.get("/alerts/3", headers={"If-None-Match": "*"})
+    assert res.status_code == 404
+    res = await test_client.get("/alerts/1", headers={"If-None-Match": "*"})
+    assert res.status_code == 304
+    await db_connection.bulk_delete(Alert, [1])
+    # versions written by other connections are read once they're older than max_age
+    assert await api.state.conn.table_version(Alert, max_age=0) == 2
+    res = await test_client.get("/alerts/1", headers={"If-None-Match": etag})
+    assert res.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_failed_changes_are_reloaded(test_client: AsyncClient, monkeypatch):
+    await api.state.loading_task
+    scheduler = api.state.scheduler
+    upsert_jobs = scheduler.upsert_jobs
+    failures = [RuntimeError("failed to apply")]
+
+    def failing_upsert_jobs(rows):
+        if failures:
+            raise failures.pop()
+        upsert_jobs(rows)
+
+    monkeypatch.setattr(scheduler, "upsert_jobs", failing_upsert_jobs)
+    res = await test_client.post("/alerts", json=ALERTS[0])
+    assert res.status_code == 201
+    await api.state.conn.feed.join()
+    assert not failures
+    assert scheduler.jobs[res.json()["id"]].phrase == "first"
@@ -0,0 +1,28 @@
+from benchmarks.compare import compare, flatten
+from benchmarks.service import alert_rows
+
+
+def test_alert_rows_share_phrases():
+    rows = alert_rows(1000, 100, 3, seed=1)
+    assert rows == alert_rows(1000, 100, 3, seed=1)
+    assert len({(r["email"], r["phrase"]) for r in rows}) == 1000
+    phrases = {" ".join(r["phrase"].lower().split()) for r in rows}
+    assert len(phrases) <= 100
+
+
+def test_compare_finds_regressions():
+    baseline = flatten(
+        {"ticks_per_sec": 10, "delivery_latency_p95": 1.0, "api_rps": {"GET": 100}}
+    )
+    current = flatten(
+        {"ticks_per_sec": 8, "delivery_latency_p95": 1.05, "api_rps": {"GET": 200}}
+    )
+    regressions = {
+        name: regression
+        for name, _, _, _, regression in compare(baseline, current, tolerance=0.1)
+    }
+    assert regressions == {
+        "ticks_per_sec": True,
+        "delivery_latency_p95": False,
+        "api_rps.GET": False,
+    }
@@ -0,0 +1,46 @@
+import time
+
+from ebay_alerts_service.cache import SearchCache
+
+ITEMS = [{"itemId": "1", "title": "item", "price": {"value": "10.00"}}]
+
+
+def test_cache_hit_and_miss():
+    cache = SearchCache(ttl=60, max_entries=10, max_bytes=1024)
+    assert cache.get("phone", "price", 20) is None
+    cache.put("phone", "price", 20, ITEMS)
+    assert cache.get("phone", "price", 20) == ITEMS
+    assert cache.get("phone", "-price", 20) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_cache_expiration():
+    cache = SearchCache(ttl=0.01, max_entries=10, max_bytes=1024)
+    cache.put("phone", "price", 20, ITEMS)
+    time.sleep(0.02)
+    assert cache.get("phone", "price", 20) is None
+    assert cache.expirations == 1
+    assert len(cache) == 0
+    assert cache.size == 0
+
+
+def test_cache_lru_eviction():
+    cache = SearchCache(ttl=60, max_entries=2, max_bytes=1024)
+    cache.put("first", "price", 20, ITEMS)
+    cache.put("second", "price", 20, ITEMS)
+    cache.get("first", "price", 20)
+    cache.put("third", "price", 20, ITEMS)
+    assert cache.get("second", "price", 20) is None
+    assert cache.get("first", "price", 20) == ITEMS
+    assert cache.evictions == 1
+
+
+def test_cache_byte_budget():
+    cache = SearchCache(ttl=60, max_entries=10, max_bytes=len(str(ITEMS)) * 2)
+    for phrase in ("first", "second", "third"):
+        cache.put(phrase, "price", 20, ITEMS)
+    assert len(cache) == 2
+    assert cache.size <= cache.max_bytes
+    cache.put("huge", "price", 20, ITEMS * 10)
+    assert cache.get("huge", "price", 20) is None
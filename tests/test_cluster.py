@@ -0,0 +1,58 @@
+import asyncio
+import typing as t
+
+import pytest
+
+from ebay_alerts_service.cluster import Cluster, HashRing, SqliteMembershipStore
+from ebay_alerts_service.db import DbConnection
+
+
+def owners(ring: HashRing, ids: t.Iterable[int]) -> t.Dict[int, str]:
+    return {alert_id: ring.owner(alert_id) for alert_id in ids}
+
+
+def test_ring_moves_only_share_of_left_member():
+    ids = range(10000)
+    before = owners(HashRing(["a", "b", "c", "d"]), ids)
+    after = owners(HashRing(["a", "b", "c"]), ids)
+    moved = [alert_id for alert_id in ids if before[alert_id] != after[alert_id]]
+    assert all(before[alert_id] == "d" for alert_id in moved)
+    assert len(moved) == list(before.values()).count("d")
+    # virtual nodes keep the shares close to each other
+    counts = [list(after.values()).count(member) for member in "abc"]
+    assert min(counts) > len(ids) / 3 * 0.7
+
+
+@pytest.mark.asyncio
+async def test_members_split_alerts_and_rebalance(db_connection: DbConnection):
+    store = SqliteMembershipStore(db_connection)
+    rebalanced = asyncio.Event()
+
+    async def on_rebalance():
+        rebalanced.set()
+
+    def member(member_id: str) -> Cluster:
+        return Cluster(store, on_rebalance, 0.05, 10, 60, member_id=member_id)
+
+    first, second = member("first"), member("second")
+    await first.join()
+    await second.join()
+    assert first.ring.members == {"first"}
+    assert second.ring.members == {"first", "second"}
+
+    # the first member finds out about the second one with the next heartbeat
+    first.start()
+    await asyncio.wait_for(rebalanced.wait(), 1)
+    assert first.ring.members == {"first", "second"}
+    ids = range(1000)
+    owned = [alert_id for alert_id in ids if first.owns(alert_id)]
+    assert 0 < len(owned) < len(ids)
+    assert not any(second.owns(alert_id) for alert_id in owned)
+    assert all(second.owns(alert_id) for alert_id in ids if alert_id not in owned)
+
+    rebalanced.clear()
+    await second.leave()
+    await asyncio.wait_for(rebalanced.wait(), 1)
+    assert all(first.owns(alert_id) for alert_id in ids)
+    await first.leave()
+    assert await store.live_members(0) == set()
@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import pytest
+from sqlalchemy import select, text
+
+from ebay_alerts_service.changes import ChangeFeed
+from ebay_alerts_service.config import Config
+from ebay_alerts_service.db import Alert, DbConnection
+
+
+@pytest.mark.asyncio
+async def test_wal_mode(db_connection: DbConnection):
+    mode = (await db_connection.select(text("PRAGMA journal_mode"))).scalar()
+    assert mode == "wal"
+
+
+@pytest.mark.asyncio
+async def test_reads_do_not_wait_for_writer(db_connection: DbConnection):
+    await db_connection.bulk_create(
+        [Alert(email="a@test.local", phrase="a", interval=2)]
+    )
+    write_time = 0.3
+
+    async def slow_write():
+        async with db_connection.session() as session:
+            session.add(Alert(email="b@test.local", phrase="b", interval=2))
+            await session.flush()
+            await asyncio.sleep(write_time)
+            await session.commit()
+
+    async def read():
+        started = time.monotonic()
+        rows = (await db_connection.select(select(Alert))).scalars().all()
+        return time.monotonic() - started, len(rows)
+
+    writer = asyncio.get_event_loop().create_task(slow_write())
+    await asyncio.sleep(0.05)
+    reads = await asyncio.gather(*(read() for _ in range(20)))
+    await writer
+    # readers see the last committed state and never wait for the open write transaction
+    assert all(count == 1 for _, count in reads)
+    assert max(duration for duration, _ in reads) < write_time
+    assert len((await db_connection.select(select(Alert))).scalars().all()) == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_are_isolated(db_connection: DbConnection):
+    alerts = [Alert(email=f"{i}@test.local", phrase="p", interval=2) for i in range(20)]
+    await asyncio.gather(*(db_connection.create(a) for a in alerts))
+    await asyncio.gather(*(db_connection.update(a, interval=10) for a in alerts))
+    rows = (await db_connection.select(select(Alert))).scalars().all()
+    assert len(rows) == 20
+    assert {row.interval for row in rows} == {10}
+
+
+@pytest.mark.asyncio
+async def test_changes_are_published_in_commit_order():
+    db_connection = DbConnection(Config().db_path, ChangeFeed())
+    alerts = [Alert(email=f"{i}@test.local", phrase="p", interval=2) for i in range(3)]
+    await asyncio.gather(*(db_connection.create(a) for a in alerts))
+    await db_connection.update(alerts[0], phrase="changed")
+    await db_connection.delete(alerts[1])
+    events = await db_connection.feed.next_batch(max_size=10)
+    # bursts are merged, only the last change of each row is kept
+    assert [(e.kind, e.id) for e in events] == [
+        ("insert", 3),
+        ("update", 1),
+        ("delete", 2),
+    ]
+    assert [e.version for e in events] == [3, 4, 5]
+    assert events[1].values == {
+        "id": 1,
+        "email": "0@test.local",
+        "phrase": "changed",
+        "interval": 2,
+    }
+    db_connection.feed.mark_applied(events[-1].version)
+    await db_connection.feed.join()
+    await db_connection.close()
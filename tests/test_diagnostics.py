@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+import pytest
+from httpx import AsyncClient
+
+from ebay_alerts_service.diagnostics import LoopMonitor, Profiler, task_counts
+
+
+def blocking_call():
+    time.sleep(0.15)
+
+
+@pytest.mark.asyncio
+async def test_blocked_loop_is_reported_with_stack():
+    monitor = LoopMonitor(interval=0.01, slow_threshold=0.05, max_stalls=5)
+    monitor.start()
+    await asyncio.sleep(0.03)
+    blocking_call()
+    await asyncio.sleep(0.03)
+    monitor.stop()
+    assert monitor.max_lag >= 0.1
+    [stall] = monitor.stalls
+    assert stall.duration >= 0.05
+    assert any("blocking_call" in line for line in stall.stack)
+    assert monitor.stats()["stalls"] == 1
+
+
+@pytest.mark.asyncio
+async def test_task_counts():
+    async def waiter(event: asyncio.Event):
+        await event.wait()
+
+    event = asyncio.Event()
+    tasks = [asyncio.get_event_loop().create_task(waiter(event)) for _ in range(3)]
+    await asyncio.sleep(0)
+    counts = task_counts()
+    assert counts["test_task_counts.<locals>.waiter"] == 3
+    event.set()
+    await asyncio.gather(*tasks)
+
+
+@pytest.mark.asyncio
+async def test_profile_is_written(tmp_path):
+    profiler = Profiler(str(tmp_path), interval=0.001, max_duration=0.2)
+
+    async def busy():
+        while True:
+            blocking_call()
+            await asyncio.sleep(0)
+
+    task = asyncio.get_event_loop().create_task(busy())
+    profile = await profiler.profile(duration=10)
+    task.cancel()
+    assert profile["duration"] == 0.2
+    assert profile["samples"] > 0
+    with open(profile["path"]) as f:
+        lines = f.read().splitlines()
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == profile["samples"]
+    assert any("blocking_call" in line for line in lines)
+    assert not profiler.running
+
+
+@pytest.mark.asyncio
+async def test_get_diagnostics(test_client: AsyncClient):
+    res = await test_client.get("/diagnostics/loop")
+    assert res.status_code == 200
+    assert set(res.json()) == {"lag", "max_lag", "stalls", "recent_stalls"}
+    res = await test_client.get("/diagnostics/tasks")
+    assert res.status_code == 200
+    assert all(count > 0 for count in res.json().values())
@@ -0,0 +1,167 @@
+import asyncio
+import email
+from email.policy import default
+
+import pytest
+
+from ebay_alerts_service.config import Config
+from ebay_alerts_service.job import AlertJobResult
+from ebay_alerts_service.processors.digest import EmailDigestProcessor, build_digest
+from ebay_alerts_service.publisher import ProcessorQueue
+from ebay_alerts_service.render import RenderCache, ResultKeys
+from ebay_alerts_service.resilience import Resilience
+from ebay_alerts_service.smtp import Envelope, SmtpError, SmtpPool
+from tests.fake_smtp import FakeSmtpServer
+
+ITEM = {
+    "itemId": "1",
+    "title": "iPhone 15",
+    "price": {"value": "100.00", "currency": "USD"},
+    "itemWebUrl": "https://www.ebay.com/itm/1",
+}
+
+
+@pytest.fixture
+async def smtp_server():
+    server = FakeSmtpServer()
+    await server.start()
+    yield server
+    await server.close()
+
+
+def make_config(smtp_server: FakeSmtpServer, **kwargs) -> Config:
+    return Config(smtp_host="127.0.0.1", smtp_port=smtp_server.port, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_digest_groups_results_by_email(smtp_server: FakeSmtpServer):
+    config = make_config(smtp_server, digest_window=0.05)
+    processor = EmailDigestProcessor(config)
+    await processor.load(
+        AlertJobResult(email="a@test.local", phrase="iphone", results=[ITEM])
+    )
+    await processor.load(
+        AlertJobResult(email="a@test.local", phrase="pixel", results=[ITEM])
+    )
+    await processor.load(
+        AlertJobResult(email="b@test.local", phrase="iphone", results=[ITEM])
+    )
+    await asyncio.sleep(0.2)
+    await processor.close()
+    assert processor.sent == 2
+    by_recipient = {m["recipients"][0]: m["data"] for m in smtp_server.messages}
+    assert set(by_recipient) == {"a@test.local", "b@test.local"}
+    assert 'New items for "iphone"' in by_recipient["a@test.local"]
+    assert 'New items for "pixel"' in by_recipient["a@test.local"]
+    assert smtp_server.connections == 1
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_connections(smtp_server: FakeSmtpServer):
+    pool = SmtpPool(make_config(smtp_server, smtp_pool_size=2))
+    envelope = Envelope(
+        "alerts@localhost", ["a@test.local"], b".leading dot\r\nbody\r\n"
+    )
+    for _ in range(3):
+        await asyncio.gather(pool.send_many([envelope] * 2), pool.send_many([envelope]))
+    await pool.close()
+    assert len(smtp_server.messages) == 9
+    assert smtp_server.connections == 2
+    assert smtp_server.messages[0]["data"] == "..leading dot\r\nbody\r\n"
+
+
+@pytest.mark.asyncio
+async def test_rejected_recipient_keeps_connection(smtp_server: FakeSmtpServer):
+    smtp_server.reject_recipients = {"bad@test.local"}
+    pool = SmtpPool(make_config(smtp_server))
+    with pytest.raises(SmtpError):
+        await pool.send_many(
+            [Envelope("alerts@localhost", ["bad@test.local"], b"body")]
+        )
+    await pool.send_many([Envelope("alerts@localhost", ["a@test.local"], b"body")])
+    await pool.close()
+    assert len(smtp_server.messages) == 1
+    assert smtp_server.connections == 1
+
+
+@pytest.mark.asyncio
+async def test_credentials_need_encrypted_connection(smtp_server: FakeSmtpServer):
+    envelope = Envelope("alerts@localhost", ["a@test.local"], b"body")
+    pool = SmtpPool(make_config(smtp_server, smtp_user="user", smtp_password="pass"))
+    with pytest.raises(SmtpError) as exc_info:
+        await pool.send_many([envelope])
+    assert exc_info.value.code == 530
+    await pool.close()
+    # the fake server doesn't support STARTTLS, so it can't be used either
+    pool = SmtpPool(make_config(smtp_server, smtp_user="user", smtp_starttls=True))
+    with pytest.raises(SmtpError) as exc_info:
+        await pool.send_many([envelope])
+    assert exc_info.value.code == 530
+    await pool.close()
+    assert smtp_server.credentials == []
+    pool = SmtpPool(
+        make_config(
+            smtp_server,
+            smtp_user="user",
+            smtp_password="pass",
+            smtp_insecure_auth=True,
+        )
+    )
+    await pool.send_many([envelope])
+    await pool.close()
+    assert smtp_server.credentials == ["AHVzZXIAcGFzcw=="]
+    assert len(smtp_server.messages) == 1
+
+
+def test_identical_results_are_rendered_once():
+    items = [ITEM, dict(ITEM, itemId="2", title="iPhone 15 – Pro")]
+    keys = ResultKeys(items)
+    renders = RenderCache(max_entries=10)
+    results = [
+        AlertJobResult(
+            email=f"{i}@test.local",
+            phrase="iphone",
+            results=items,
+            key=keys.key("iphone", items),
+        )
+        for i in range(3)
+    ]
+    envelopes = [
+        build_digest("alerts@localhost", r.email, [r], renders) for r in results
+    ]
+    assert (renders.misses, renders.hits) == (1, 2)
+    assert keys.key("iphone", items[:1]) != keys.key("iphone", items)
+    assert keys.key("iphone", items) == ResultKeys(items).key("iphone", items)
+
+    message = email.message_from_bytes(envelopes[2].data, policy=default)
+    assert message["To"] == "2@test.local"
+    assert message.get_content().replace("\r\n", "\n") == (
+        'New items for "iphone":\n'
+        "- iPhone 15: 100.00 USD\n  https://www.ebay.com/itm/1\n"
+        "- iPhone 15 – Pro: 100.00 USD\n  https://www.ebay.com/itm/1\n"
+    )
+
+
+@pytest.mark.asyncio
+async def test_smtp_outage_opens_breaker():
+    smtp_server = FakeSmtpServer()
+    await smtp_server.start()
+    config = make_config(smtp_server, digest_window=0.01)
+    # nothing listens on the port anymore
+    await smtp_server.close()
+    resilience = Resilience(
+        failure_threshold=2, reset_timeout=30, retries=1, base_delay=0, max_delay=0
+    )
+    processor = EmailDigestProcessor(config, resilience=resilience)
+    queue = ProcessorQueue(
+        processor, workers=1, maxsize=10, overflow="block", resilience=resilience
+    )
+    delivered = await processor.load(
+        AlertJobResult(email="a@test.local", phrase="iphone", results=[ITEM])
+    )
+    with pytest.raises(OSError):
+        await delivered
+    # the attempt was retried and both failures opened the breaker
+    assert queue.endpoint == "smtp"
+    assert resilience.breaker("smtp").state == "open"
+    assert processor.failed == 1
@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+import pytest
+
+from benchmarks.fake_ebay import FakeBrowseApi
+from ebay_alerts_service.config import Config
+from ebay_alerts_service.ebay import EbayClient, EbayError, TokenBucket
+from ebay_alerts_service.resilience import LATENCY_MIN_SAMPLES
+
+
+@pytest.fixture
+async def fake_ebay():
+    server = FakeBrowseApi()
+    await server.start()
+    yield server
+    await server.close()
+
+
+def make_config(fake_ebay: FakeBrowseApi, **kwargs) -> Config:
+    return Config(
+        ebay_api_url=fake_ebay.api_url,
+        ebay_oauth_url=fake_ebay.oauth_url,
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio
+async def test_search(fake_ebay: FakeBrowseApi):
+    client = EbayClient(make_config(fake_ebay))
+    items = await client.search("iphone 15")
+    await client.close()
+    assert len(items) == 20
+    assert fake_ebay.search_requests == [
+        {"q": "iphone 15", "authorization": "Bearer 123"}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_search_error(fake_ebay: FakeBrowseApi):
+    client = EbayClient(make_config(fake_ebay, retries=1, retry_base_delay=0.01))
+    fake_ebay.fail_next = [500, 503]
+    with pytest.raises(EbayError):
+        await client.search("iphone 15")
+    await client.close()
+    assert len(fake_ebay.search_requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_search_is_retried(fake_ebay: FakeBrowseApi):
+    client = EbayClient(make_config(fake_ebay, retry_base_delay=0.01))
+    fake_ebay.fail_next = [503, 429]
+    items = await client.search("iphone 15")
+    assert len(items) == 20
+    # client errors mean the request is wrong, it isn't retried
+    fake_ebay.fail_next = [400]
+    with pytest.raises(EbayError):
+        await client.search("iphone 15")
+    await client.close()
+    assert len(fake_ebay.search_requests) == 4
+    assert client.resilience.breaker("ebay_search").failures == 0
+
+
+@pytest.mark.asyncio
+async def test_oauth_token_is_cached_and_refreshed(fake_ebay: FakeBrowseApi):
+    fake_ebay.expires_in = 1
+    client = EbayClient(
+        make_config(fake_ebay, ebay_client_secret="secret", ebay_token_refresh_margin=0)
+    )
+    await asyncio.gather(*(client.search("phone") for _ in range(3)))
+    assert fake_ebay.token_requests == 1
+    await asyncio.sleep(1.1)
+    # token was refreshed proactively, before the next search
+    assert fake_ebay.token_requests == 2
+    await client.search("phone")
+    await client.close()
+    assert fake_ebay.search_requests[-1]["authorization"] == "Bearer token-2"
+
+
+@pytest.mark.asyncio
+async def test_concurrency_is_bounded(fake_ebay: FakeBrowseApi):
+    fake_ebay.latency = 0.05
+    client = EbayClient(
+        make_config(fake_ebay, ebay_max_concurrency=2, ebay_rate_per_second=100)
+    )
+    await asyncio.gather(*(client.search(f"phrase {i}") for i in range(6)))
+    await client.close()
+    assert fake_ebay.max_concurrent == 2
+
+
+@pytest.mark.asyncio
+async def test_hedged_requests_are_bounded(fake_ebay: FakeBrowseApi):
+    fake_ebay.latency = 0.05
+    client = EbayClient(
+        make_config(
+            fake_ebay,
+            ebay_max_concurrency=2,
+            ebay_rate_per_second=100,
+            ebay_hedge_percentile=50,
+        )
+    )
+    # every request is slower than the percentile, so all of them are hedged
+    await client.search("warmup")
+    latencies = client.resilience.latencies["ebay_search"]
+    for _ in range(LATENCY_MIN_SAMPLES):
+        latencies.observe(0.001)
+    first = asyncio.ensure_future(client.search("first"))
+    await asyncio.sleep(0.02)
+    # the hedge of the first search holds the second slot
+    await asyncio.gather(first, client.search("second"))
+    await client.close()
+    assert fake_ebay.max_concurrent == 2
+
+
+@pytest.mark.asyncio
+async def test_token_bucket():
+    bucket = TokenBucket(rate=20, capacity=2)
+    started = time.monotonic()
+    for _ in range(4):
+        await bucket.acquire()
+    # two tokens are available at once, two more need 1/20 second each
+    assert time.monotonic() - started >= 0.09
+
+
+def test_hedge_waits_for_no_tokens():
+    client = EbayClient(
+        Config(ebay_api_url="http://ebay.local", ebay_rate_per_second=1)
+    )
+    assert client._may_hedge()
+    # the per second token is spent, so the daily one is given back
+    daily = client.daily_limit.tokens
+    assert not client._may_hedge()
+    assert client.daily_limit.tokens == pytest.approx(daily, abs=0.01)
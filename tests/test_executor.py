@@ -0,0 +1,47 @@
+import asyncio
+import time
+
+import pytest
+
+from ebay_alerts_service.executor import JobExecutor
+
+
+def job(order, name, duration=0.0):
+    async def run():
+        order.append(name)
+        await asyncio.sleep(duration)
+
+    return run
+
+
+@pytest.mark.asyncio
+async def test_keys_take_turns():
+    executor = JobExecutor(limit=1)
+    order = []
+    deadline = time.monotonic() + 60
+    for i in range(3):
+        executor.submit(["busy"], deadline, job(order, f"busy{i}"), lambda: None)
+    executor.submit(["a"], deadline + 1, job(order, "a"), lambda: None)
+    executor.submit(["b"], deadline - 1, job(order, "b"), lambda: None)
+    while executor.running or len(executor):
+        await asyncio.sleep(0.001)
+    # earlier deadline goes first within the round
+    assert order == ["b", "busy0", "a", "busy1", "busy2"]
+
+
+@pytest.mark.asyncio
+async def test_late_jobs_are_shed():
+    executor = JobExecutor(limit=1)
+    order, shed = [], []
+    now = time.monotonic()
+    executor.submit(["a"], now + 60, job(order, "slow", 0.05), lambda: None)
+    await asyncio.sleep(0.001)
+    assert executor.running == 1
+    executor.submit(["b"], now + 0.01, job(order, "late"), lambda: shed.append("late"))
+    executor.submit(["c"], now + 60, job(order, "fine"), lambda: None)
+    while executor.running or len(executor):
+        await asyncio.sleep(0.001)
+    assert order == ["slow", "fine"]
+    assert shed == ["late"]
+    assert executor.stats()["shed"] == 1
+    assert executor.stats()["started"] == 2
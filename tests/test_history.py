@@ -0,0 +1,102 @@
+import time
+import typing as t
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import func, select
+
+from ebay_alerts_service.app import api
+from ebay_alerts_service.db import DbConnection, PriceObservation, PriceRollup
+from ebay_alerts_service.history import PriceRecorder
+
+
+def items(*prices):
+    return [
+        {"itemId": str(i), "price": {"value": str(p), "currency": "USD"}}
+        for i, p in enumerate(prices)
+    ]
+
+
+async def rollup(conn: DbConnection, period: str) -> t.List[PriceRollup]:
+    stmt = select(PriceRollup).where(PriceRollup.period == period)
+    return (await conn.select(stmt)).scalars().all()
+
+
+@pytest.mark.asyncio
+async def test_batches_add_up_in_rollups(db_connection: DbConnection):
+    recorder = PriceRecorder(db_connection, batch_size=100, flush_interval=60)
+    hour = 1700000000 // 3600 * 3600
+    recorder.record("phone", items(10, 30, None), observed_at=hour + 1)
+    await recorder.flush()
+    recorder.record("phone", items(5, 25), observed_at=hour + 90)
+    await recorder.flush()
+
+    stmt = select(func.count()).select_from(PriceObservation)
+    assert (await db_connection.select(stmt)).scalar() == 4
+    minutes = await rollup(db_connection, "minute")
+    assert [(r.bucket, r.count, r.min, r.max) for r in minutes] == [
+        (hour, 2, 10, 30),
+        (hour + 60, 2, 5, 25),
+    ]
+    [hourly] = await rollup(db_connection, "hour")
+    assert (hourly.bucket, hourly.count, hourly.total) == (hour, 4, 70)
+    assert (hourly.min, hourly.max) == (5, 30)
+
+
+@pytest.mark.asyncio
+async def test_full_buffer_is_flushed(db_connection: DbConnection):
+    recorder = PriceRecorder(db_connection, batch_size=2, flush_interval=60)
+    recorder.record("phone", items(10, 20))
+    await recorder._flush_task
+    assert recorder.written == 2
+
+
+@pytest.mark.asyncio
+async def test_get_alert_insights(test_client: AsyncClient):
+    res = await test_client.post(
+        "/alerts", json=dict(email="a@test.local", phrase=" Phone  ", interval=2)
+    )
+    alert_id = res.json()["id"]
+    day = 1700000000 // 86400 * 86400
+    api.state.history.record("phone", items(10, 20), observed_at=day + 10)
+    api.state.history.record("phone", items(40), observed_at=day + 3600)
+    api.state.history.record("other", items(1), observed_at=day + 10)
+    await api.state.history.flush()
+
+    res = await test_client.get(f"/alerts/{alert_id}/insights?period=hour&limit=1")
+    assert res.status_code == 200
+    assert res.json() == {
+        "alert_id": alert_id,
+        "phrase": "phone",
+        "period": "hour",
+        "buckets": [
+            {
+                "start": "2023-11-14T01:00:00+00:00",
+                "count": 1,
+                "min": 40.0,
+                "avg": 40.0,
+                "max": 40.0,
+            }
+        ],
+    }
+    res = await test_client.get(f"/alerts/{alert_id}/insights?period=day")
+    [bucket] = res.json()["buckets"]
+    assert (bucket["count"], bucket["min"], bucket["avg"]) == (3, 10, 70 / 3)
+    res = await test_client.get("/alerts/100/insights")
+    assert res.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_old_observations_are_pruned(db_connection: DbConnection):
+    recorder = PriceRecorder(
+        db_connection, batch_size=100, flush_interval=60, retention=3600
+    )
+    recorder.record("phone", items(10), observed_at=time.time() - 7200)
+    recorder.record("phone", items(20), observed_at=time.time())
+    await recorder.flush()
+    stmt = select(PriceObservation.price)
+    assert (await db_connection.select(stmt)).scalars().all() == [20]
+    assert recorder.pruned == 1
+    # rollups of pruned observations are kept
+    [hourly] = [r for r in await rollup(db_connection, "hour") if r.min == 10]
+    assert hourly.count == 1
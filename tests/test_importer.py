@@ -0,0 +1,69 @@
+import json
+import tracemalloc
+import typing as t
+
+import pytest
+from sqlalchemy import select
+
+from ebay_alerts_service.db import Alert, DbConnection
+from ebay_alerts_service.importer import import_alerts, read_rows, validate_rows
+
+
+@pytest.mark.asyncio
+async def test_import_ndjson(tmp_path, db_connection: DbConnection):
+    path = tmp_path / "alerts.ndjson"
+    rows = [dict(email=f"{i}@test.local", phrase="phone", interval=2) for i in range(5)]
+    rows += [rows[0], dict(email="not an email", phrase="phone", interval=2)]
+    path.write_text("\n".join(json.dumps(row) for row in rows))
+    stats = await import_alerts(db_connection, str(path), chunk_size=2)
+    assert stats == (5, 1, 1)
+    alerts = (await db_connection.select(select(Alert))).scalars().all()
+    assert len(alerts) == 5
+
+
+@pytest.mark.asyncio
+async def test_malformed_lines_are_skipped(tmp_path, db_connection: DbConnection):
+    path = tmp_path / "alerts.ndjson"
+    path.write_text(
+        '{"email": "a@test.local", "phrase": "phone", "interval": 2}\n'
+        "\n"
+        '{"email": "b@test.local", "phrase": \n'
+        '{"email": "not an email", "phrase": "phone", "interval": 2}\n'
+        "[1, 2]\n"
+        '{"email": "c@test.local", "phrase": "phone", "interval": 2}\n'
+    )
+    invalid: t.List[int] = []
+    rows = list(validate_rows(read_rows(str(path), invalid), invalid))
+    assert [row["email"] for row in rows] == ["a@test.local", "c@test.local"]
+    assert invalid == [3, 4, 5]
+    stats = await import_alerts(db_connection, str(path), chunk_size=1)
+    assert stats == (2, 0, 3)
+
+
+@pytest.mark.asyncio
+async def test_import_csv(tmp_path, db_connection: DbConnection):
+    path = tmp_path / "alerts.csv"
+    path.write_text(
+        "email,phrase,interval\na@test.local,phone,10\nb@test.local,tv,30\n"
+    )
+    stats = await import_alerts(db_connection, str(path))
+    assert stats == (2, 0, 0)
+
+
+@pytest.mark.asyncio
+async def test_import_keeps_constant_memory(tmp_path, db_connection: DbConnection):
+    path = tmp_path / "alerts.ndjson"
+    with open(path, "w") as f:
+        for i in range(3000):
+            f.write(json.dumps(dict(email=f"{i}@test.local", phrase="tv", interval=2)))
+            f.write("\n")
+    tracemalloc.start()
+    try:
+        stats = await import_alerts(db_connection, str(path), chunk_size=500)
+        retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert stats == (3000, 0, 0)
+    # imported rows aren't kept after their chunk is written, e.g. in the change feed
+    assert db_connection.feed is None
+    assert retained < 1024 * 1024
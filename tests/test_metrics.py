@@ -0,0 +1,56 @@
+import pytest
+from httpx import AsyncClient
+
+from ebay_alerts_service.metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_render_metrics():
+    registry = Registry()
+    requests = Counter("requests_total", "Requests", ["status"], registry=registry)
+    depth = Gauge("depth", "Depth", registry=registry)
+    latency = Histogram(
+        "latency_seconds", "Latency", buckets=(0.1, 1), registry=registry
+    )
+    requests.labels(200).inc()
+    requests.labels(200).inc()
+    requests.labels('a"b').inc()
+    depth.labels().set(3)
+    child = latency.labels()
+    for value in (0.05, 0.1, 0.5, 3):
+        child.observe(value)
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{status="200"} 2',
+        'requests_total{status="a\\"b"} 1',
+        "# HELP depth Depth",
+        "# TYPE depth gauge",
+        "depth 3",
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1.0"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 3.65",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_labels_are_checked():
+    counter = Counter("checked_total", "Checked", ["status"], registry=Registry())
+    with pytest.raises(ValueError):
+        counter.labels()
+
+
+@pytest.mark.asyncio
+async def test_get_metrics(test_client: AsyncClient):
+    await test_client.get("/alerts/1")
+    res = await test_client.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert (
+        'api_request_duration_seconds_count{method="GET",route="/alerts/{alert_id}",status="404"}'
+        in res.text
+    )
+    assert "# TYPE scheduler_lag_seconds histogram" in res.text
+    assert "scheduler_running_alerts 0" in res.text
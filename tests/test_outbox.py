@@ -0,0 +1,171 @@
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+
+from ebay_alerts_service.config import Config
+from ebay_alerts_service.db import DbConnection, OutboxEntry, OutboxPayload
+from ebay_alerts_service.job import AlertJobResult
+from ebay_alerts_service.outbox import Outbox, OutboxConsumer
+from ebay_alerts_service.processors.base import AbstractProcessor
+from ebay_alerts_service.processors.digest import EmailDigestProcessor
+from ebay_alerts_service.publisher import ProcessorQueue
+from tests.fake_smtp import FakeSmtpServer
+
+ITEMS = [{"itemId": "1", "title": "phone", "price": {"value": "10.00"}}]
+
+
+def make_outbox(conn: DbConnection, **kwargs) -> Outbox:
+    params = dict(
+        processors=["Mail", "Hook"],
+        batch_size=100,
+        flush_interval=60,
+        lease=60,
+        max_attempts=2,
+        retention=60,
+    )
+    params.update(kwargs)
+    return Outbox(conn, **params)
+
+
+def make_result(email: str, alert_id: int = 1) -> AlertJobResult:
+    return AlertJobResult(
+        email=email, phrase="phone", results=ITEMS, key="k1", alert_id=alert_id
+    )
+
+
+async def count(conn: DbConnection, model) -> int:
+    return (await conn.select(select(func.count()).select_from(model))).scalar()
+
+
+@pytest.mark.asyncio
+async def test_results_are_claimed_and_acked(db_connection: DbConnection):
+    outbox = make_outbox(db_connection)
+    outbox.add(make_result("a@test.local", 1), "1:100")
+    outbox.add(make_result("b@test.local", 2), "2:100")
+    # the same alert and tick is added only once
+    outbox.add(make_result("a@test.local", 1), "1:100")
+    await outbox.flush()
+    assert await count(db_connection, OutboxEntry) == 4
+    assert await count(db_connection, OutboxPayload) == 1
+
+    claimed = await outbox.claim("Mail", 10)
+    assert [r.email for _, r in claimed] == ["a@test.local", "b@test.local"]
+    assert claimed[0][1].results == ITEMS
+    assert claimed[0][1].idempotency_key == "1:100"
+    # leased rows aren't claimed again
+    assert await outbox.claim("Mail", 10) == []
+    for row_id, _ in claimed:
+        outbox.ack(row_id)
+    await outbox.flush()
+    assert await outbox.backlog() == 2
+    assert len(await outbox.claim("Hook", 10)) == 2
+    assert outbox.stats() == dict(
+        buffered=0, added=6, claimed=4, acked=2, failed=0, dead_pruned=0
+    )
+
+
+@pytest.mark.asyncio
+async def test_expired_leases_are_claimed_again(db_connection: DbConnection):
+    outbox = make_outbox(db_connection, processors=["Mail"], lease=0.01)
+    outbox.add(make_result("a@test.local"), "1:100")
+    await outbox.flush()
+    assert len(await outbox.claim("Mail", 10)) == 1
+    await asyncio.sleep(0.02)
+    [(_, result)] = await outbox.claim("Mail", 10)
+    assert result.email == "a@test.local"
+    await asyncio.sleep(0.02)
+    # the row failed max_attempts times
+    assert await outbox.claim("Mail", 10) == []
+    assert (await outbox.backlog(), await outbox.dead()) == (0, 1)
+    outbox.retention = 0
+    assert await outbox.prune() == 1
+    assert outbox.dead_pruned == 1
+    assert await count(db_connection, OutboxPayload) == 0
+
+
+@pytest.mark.asyncio
+async def test_delivered_rows_are_pruned(db_connection: DbConnection):
+    outbox = make_outbox(db_connection, processors=["Mail"], retention=0)
+    outbox.add(make_result("a@test.local", 1), "1:100")
+    outbox.add(make_result("b@test.local", 2), "2:100")
+    await outbox.flush()
+    [(row_id, _), _] = await outbox.claim("Mail", 10)
+    outbox.ack(row_id)
+    await outbox.flush()
+    assert await outbox.prune() == 1
+    assert await count(db_connection, OutboxEntry) == 1
+    # items are still referenced by the undelivered row
+    assert await count(db_connection, OutboxPayload) == 1
+
+
+class Mail(AbstractProcessor):
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.loaded = asyncio.Queue()
+
+    async def load(self, result):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("mail server is down")
+        self.loaded.put_nowait(result.email)
+
+
+@pytest.mark.asyncio
+async def test_consumer_delivers_at_least_once(db_connection: DbConnection):
+    outbox = make_outbox(db_connection, processors=["Mail"], lease=0.05)
+    processor = Mail(failures=1)
+    queue = ProcessorQueue(processor, workers=1, maxsize=10, overflow="block")
+    consumer = OutboxConsumer(
+        outbox, queue, batch_size=10, poll_interval=0.01, prune_interval=60
+    )
+    queue.start()
+    consumer.start()
+    outbox.add(make_result("a@test.local"), "1:100")
+    await outbox.flush()
+    # the first load fails and the row is delivered once its lease expires
+    assert await asyncio.wait_for(processor.loaded.get(), 1) == "a@test.local"
+    await asyncio.sleep(0.01)
+    consumer.stop()
+    await queue.close(timeout=1)
+    await outbox.close()
+    assert outbox.acked == 1
+    assert await outbox.backlog() == 0
+
+
+@pytest.mark.asyncio
+async def test_digest_is_acked_only_once_sent(db_connection: DbConnection):
+    smtp_server = FakeSmtpServer()
+    await smtp_server.start()
+    smtp_server.reject_recipients = {"a@test.local"}
+    config = Config(
+        smtp_host="127.0.0.1", smtp_port=smtp_server.port, digest_window=0.01
+    )
+    processor = EmailDigestProcessor(config)
+    outbox = make_outbox(db_connection, processors=["EmailDigestProcessor"], lease=0.2)
+    queue = ProcessorQueue(processor, workers=1, maxsize=10, overflow="block")
+    consumer = OutboxConsumer(
+        outbox, queue, batch_size=10, poll_interval=0.01, prune_interval=60
+    )
+    queue.start()
+    consumer.start()
+    outbox.add(make_result("a@test.local"), "1:100")
+    await outbox.flush()
+    # the digest is rejected, so the result isn't acked
+    while not processor.failed:
+        await asyncio.sleep(0.01)
+    await outbox.flush()
+    assert outbox.acked == 0
+    assert await outbox.backlog() == 1
+
+    # the result is claimed again once its lease expires
+    smtp_server.reject_recipients = set()
+    while not processor.sent:
+        await asyncio.sleep(0.01)
+    consumer.stop()
+    await queue.close(timeout=1)
+    await outbox.close()
+    await smtp_server.close()
+    assert outbox.acked == 1
+    assert await outbox.backlog() == 0
+    assert [m["recipients"] for m in smtp_server.messages] == [["a@test.local"]]
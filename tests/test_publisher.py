@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from ebay_alerts_service.job import AlertJobResult
+from ebay_alerts_service.processors.base import AbstractProcessor
+from ebay_alerts_service.publisher import ProcessorQueue
+from ebay_alerts_service.resilience import Resilience
+
+
+class SlowProcessor(AbstractProcessor):
+    def __init__(self):
+        self.loaded = []
+        self.release = asyncio.Event()
+
+    async def load(self, result):
+        await self.release.wait()
+        self.loaded.append(result.phrase)
+
+
+def make_result(phrase: str) -> AlertJobResult:
+    return AlertJobResult(email="a@test.local", phrase=phrase, results=[])
+
+
+@pytest.mark.asyncio
+async def test_block_policy_waits_for_free_place():
+    processor = SlowProcessor()
+    queue = ProcessorQueue(processor, workers=1, maxsize=1, overflow="block")
+    queue.start()
+    await queue.put(make_result("first"))
+    await asyncio.sleep(0)
+    await queue.put(make_result("second"))
+    blocked = asyncio.get_event_loop().create_task(queue.put(make_result("third")))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+    processor.release.set()
+    await blocked
+    await queue.close(timeout=1)
+    assert processor.loaded == ["first", "second", "third"]
+    assert queue.stats()["wait_time_max"] > 0
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_policy():
+    processor = SlowProcessor()
+    queue = ProcessorQueue(processor, workers=1, maxsize=2, overflow="drop_oldest")
+    queue.start()
+    await queue.put(make_result("first"))
+    await asyncio.sleep(0)
+    for phrase in ("second", "third", "fourth"):
+        await queue.put(make_result(phrase))
+    processor.release.set()
+    await queue.close(timeout=1)
+    assert processor.loaded == ["first", "third", "fourth"]
+    assert queue.dropped == 1
+
+
+@pytest.mark.asyncio
+async def test_spill_policy(tmp_path):
+    processor = SlowProcessor()
+    spill_path = str(tmp_path / "spill" / "SlowProcessor.jsonl")
+    queue = ProcessorQueue(
+        processor, 1, maxsize=1, overflow="spill", spill_path=spill_path
+    )
+    queue.start()
+    await queue.put(make_result("first"))
+    await asyncio.sleep(0)
+    for phrase in ("second", "third", "fourth"):
+        await queue.put(make_result(phrase))
+    assert queue.spilled == 2
+    assert queue.depth == 3
+    processor.release.set()
+    await queue.close(timeout=1)
+    assert processor.loaded == ["first", "second", "third", "fourth"]
+    assert not (tmp_path / "spill" / "SlowProcessor.jsonl").exists()
+
+
+@pytest.mark.asyncio
+async def test_spill_left_from_previous_run_goes_first(tmp_path):
+    spill_path = str(tmp_path / "spill" / "SlowProcessor.jsonl")
+    for overflow in ("block", "drop_oldest"):
+        previous = ProcessorQueue(
+            SlowProcessor(), 1, maxsize=1, overflow="spill", spill_path=spill_path
+        )
+        # the queue of the previous run was full, so results after it were spilled
+        for phrase in ("queued", "first", "second"):
+            await previous.put(make_result(phrase))
+        processor = SlowProcessor()
+        queue = ProcessorQueue(
+            processor, 1, maxsize=1, overflow=overflow, spill_path=spill_path
+        )
+        queue.start()
+        await queue.put(make_result("third"))
+        processor.release.set()
+        await queue.close(timeout=1)
+        assert processor.loaded == ["first", "second", "third"]
+        assert queue.dropped == 0
+
+
+class FlakyProcessor(AbstractProcessor):
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.loaded = []
+
+    async def load(self, result):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("processor is down")
+        self.loaded.append(result.phrase)
+
+
+@pytest.mark.asyncio
+async def test_results_wait_while_breaker_is_open():
+    processor = FlakyProcessor(failures=2)
+    resilience = Resilience(
+        failure_threshold=2, reset_timeout=0.05, retries=1, base_delay=0, max_delay=0
+    )
+    queue = ProcessorQueue(
+        processor, workers=2, maxsize=10, overflow="block", resilience=resilience
+    )
+    queue.start()
+    await queue.put(make_result("first"))
+    await asyncio.sleep(0.01)
+    # the failed load was retried once and opened the breaker
+    assert queue.errors == 1
+    assert resilience.breaker(queue.endpoint).state == "open"
+    await queue.put(make_result("second"))
+    await queue.put(make_result("third"))
+    await asyncio.sleep(0.01)
+    assert queue.depth == 2
+    await queue.close(timeout=1)
+    assert processor.loaded == ["second", "third"]
@@ -0,0 +1,43 @@
+from ebay_alerts_service.registry import AlertRegistry, Bitset, JobParams
+
+
+def test_registry_interns_strings():
+    registry = AlertRegistry()
+    registry.put(1, "a@test.local", "phrase")
+    registry.put(5, "a@test.local", "phrase")
+    registry.put(7, "b@test.local", "phrase")
+    assert len(registry) == 3
+    assert list(registry) == [1, 5, 7]
+    assert registry[5] == JobParams(5, "a@test.local", "phrase")
+    assert registry.get(2) is None
+    assert 2 not in registry
+    assert len(registry.emails) == 2
+    assert len(registry.phrases) == 1
+
+
+def test_registry_frees_unused_strings():
+    registry = AlertRegistry()
+    registry.put(1, "a@test.local", "first")
+    registry.put(2, "a@test.local", "first")
+    registry.put(1, "a@test.local", "second")
+    assert registry[1].phrase == "second"
+    assert len(registry.phrases) == 2
+    assert registry.pop(2) == JobParams(2, "a@test.local", "first")
+    assert registry.pop(2) is None
+    assert len(registry.phrases) == 1
+    assert len(registry.emails) == 1
+    # freed numbers are reused
+    registry.put(3, "c@test.local", "third")
+    assert registry[3] == JobParams(3, "c@test.local", "third")
+    assert registry[1] == JobParams(1, "a@test.local", "second")
+
+
+def test_bitset():
+    running = Bitset()
+    running.update([1, 9, 1000])
+    assert 9 in running and 1000 in running
+    assert 8 not in running and 100000 not in running
+    assert len(running) == 3
+    running.difference_update([9, 10])
+    assert 9 not in running
+    assert len(running) == 2
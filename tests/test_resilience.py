@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+import pytest
+
+from ebay_alerts_service.cache import SearchCache
+from ebay_alerts_service.config import Config
+from ebay_alerts_service.delta import DeltaTracker
+from ebay_alerts_service.ebay import DEFAULT_LIMIT, DEFAULT_SORT
+from ebay_alerts_service.job import alert_job
+from ebay_alerts_service.registry import JobParams
+from ebay_alerts_service.resilience import CircuitOpenError, Resilience, backoff
+
+
+class Endpoint:
+    def __init__(self, failures: int = 0, latencies=()):
+        """
+        :param failures: number of calls which fail before calls succeed
+        :param latencies: latencies of the first calls
+        """
+        self.failures = failures
+        self.latencies = list(latencies)
+        self.calls = 0
+
+    async def __call__(self) -> int:
+        self.calls += 1
+        if self.latencies:
+            await asyncio.sleep(self.latencies.pop(0))
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("failed")
+        return self.calls
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_and_probes():
+    resilience = Resilience(
+        failure_threshold=2, reset_timeout=0.05, retries=0, base_delay=0, max_delay=0
+    )
+    endpoint = Endpoint(failures=3)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await resilience.call("test", endpoint)
+    breaker = resilience.breaker("test")
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        await resilience.call("test", endpoint)
+    assert endpoint.calls == 2
+    assert breaker.rejected == 1
+
+    await asyncio.sleep(0.06)
+    # the probe fails, so the breaker opens again at once
+    with pytest.raises(RuntimeError):
+        await resilience.call("test", endpoint)
+    assert breaker.state == "open"
+    await breaker.wait_ready()
+    assert await resilience.call("test", endpoint) == 4
+    assert resilience.stats() == [
+        {
+            "endpoint": "test",
+            "state": "closed",
+            "failures": 0,
+            "rejected": 1,
+            "retry_after": 0.0,
+        }
+    ]
+
+
+@pytest.mark.asyncio
+async def test_retries():
+    resilience = Resilience(
+        failure_threshold=5, reset_timeout=1, retries=2, base_delay=0.01, max_delay=0.01
+    )
+    endpoint = Endpoint(failures=2)
+    assert await resilience.call("test", endpoint) == 3
+    # errors which aren't retriable are raised at once and don't open the breaker
+    endpoint = Endpoint(failures=1)
+    with pytest.raises(RuntimeError):
+        await resilience.call("test", endpoint, retriable=lambda e: False)
+    assert endpoint.calls == 1
+    assert resilience.breaker("test").failures == 0
+
+
+def test_backoff_is_capped_and_jittered():
+    delays = [backoff(attempt, 0.1, 1) for attempt in range(10) for _ in range(10)]
+    assert all(0 <= delay <= 1 for delay in delays)
+    assert len(set(delays)) == len(delays)
+    assert max(backoff(0, 0.1, 1) for _ in range(100)) <= 0.1
+
+
+@pytest.mark.asyncio
+async def test_slow_call_is_hedged():
+    resilience = Resilience(
+        failure_threshold=5,
+        reset_timeout=1,
+        retries=0,
+        base_delay=0,
+        max_delay=0,
+        hedge_percentile=90,
+    )
+    endpoint = Endpoint(latencies=[0.001] * 20)
+    for _ in range(20):
+        await resilience.hedged("test", endpoint)
+    endpoint.latencies = [10, 10]
+    # without tokens for the hedged request the slow one is awaited
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(resilience.hedged("test", endpoint, lambda: False), 0.1)
+    started = time.monotonic()
+    # the first request hangs, the hedged one answers
+    assert await resilience.hedged("test", endpoint, lambda: True) == 23
+    assert time.monotonic() - started < 1
+
+
+@pytest.mark.asyncio
+async def test_job_serves_stale_results_while_breaker_is_open():
+    items = [{"itemId": "1", "title": "phone", "price": {"value": "10.00"}}]
+    cache = SearchCache(ttl=0.01, max_entries=10, max_bytes=10000, max_stale=60)
+    cache.put("phone", DEFAULT_SORT, DEFAULT_LIMIT, items)
+    await asyncio.sleep(0.02)
+    results, errors = [], []
+
+    async def search(phrase: str):
+        raise CircuitOpenError("ebay_search", 10)
+
+    async def on_result(result):
+        results.append(result)
+
+    async def on_error(job_params, exc):
+        errors.append(exc)
+
+    subscribers = [JobParams(1, "a@test.local", "phone")]
+    config = Config(ebay_api_key="key", ebay_api_url="http://ebay.local")
+    args = (DeltaTracker(10), on_result, on_error, config)
+    await alert_job("phone", subscribers, search, cache, *args)
+    assert [r.results for r in results] == [items]
+    assert cache.stale_hits == 1
+    # without stale results the job fails fast
+    await alert_job("tablet", subscribers, search, cache, *args)
+    assert len(errors) == 1
@@ -1,35 +1,294 @@
 import asyncio
 
 import pytest
-from aiocron import Cron
 
 from ebay_alerts_service import db
 from ebay_alerts_service.config import Config
+from ebay_alerts_service.delta import DeltaTracker
+from ebay_alerts_service.outbox import Outbox
+from ebay_alerts_service.processors.base import AbstractProcessor
+from ebay_alerts_service.resilience import Resilience
 from ebay_alerts_service.scheduler import AlertsScheduler
+from ebay_alerts_service.subsumption import SubsumptionIndex
+from ebay_alerts_service.wheel import TimerWheel, slot_for
 
 
-async def process_job(alert: db.Alert, output_queue: asyncio.Queue, lock: asyncio.Lock):
-    if lock.locked():
-        return
+@pytest.mark.asyncio
+async def test_timer_wheel_dispatches_buckets():
+    fired = asyncio.Queue()
+    wheel = TimerWheel(
+        lambda interval, ids: fired.put_nowait((interval, set(ids))),
+        unit=0.05,
+        resolution=0.05,
+    )
+    wheel.add(1, 1)
+    wheel.add(2, 1)
+    wheel.add(3, 2)
+    wheel.add(3, 1)
+    wheel.remove(2)
+    wheel.start()
+    interval, ids = await fired.get()
+    wheel.stop()
+    assert interval == 1
+    assert ids == {1, 3}
+    assert wheel.occupancy()[2] == [0, 0]
+
+
+class FakeClient:
+    def __init__(self, catalog=None):
+        """
+        :param catalog: titles of all items, when it's set search returns
+        matching items with their total, otherwise one item with unknown total
+        """
+        self.catalog = catalog
+        self.searches = []
+        self.resilience = Resilience(5, 30, 0, 0, 0)
+
+    async def search_page(self, phrase: str, limit: int):
+        self.searches.append(phrase)
+        if self.catalog is None:
+            return [{"itemId": "1", "title": phrase}], None
+        items = [
+            {"itemId": str(i), "title": title}
+            for i, title in enumerate(self.catalog)
+            if set(phrase.split()) <= set(title.lower().split())
+        ]
+        return items[:limit], len(items)
+
+
+class CollectProcessor(AbstractProcessor):
+    def __init__(self):
+        self.results = asyncio.Queue()
+
+    async def load(self, result):
+        await self.results.put(result)
+
+
+@pytest.mark.asyncio
+async def test_tick_groups_alerts_by_phrase(db_connection: db.DbConnection):
+    config = Config()
+    config.tick_window = 0
+    processor = CollectProcessor()
+    alerts = [
+        db.Alert(email="first@test.local", phrase="iPhone 15", interval=2),
+        db.Alert(email="second@test.local", phrase=" iphone  15 ", interval=10),
+        db.Alert(email="third@test.local", phrase="other", interval=2),
+    ]
+    await db_connection.bulk_create(alerts)
+    client = FakeClient()
+    scheduler = AlertsScheduler(config, [processor], alerts, client)
+    scheduler.start()
+    scheduler.schedule(alert.id for alert in alerts)
+    emails = {(await processor.results.get()).email for _ in alerts}
+    assert emails == {a.email for a in alerts}
+    assert scheduler.last_tick.alerts == 3
+    assert scheduler.last_tick.searches == 2
+    assert scheduler.last_tick.fan_out == 1.5
+    assert sorted(client.searches) == ["iphone 15", "other"]
+    scheduler.shutdown()
+    await scheduler.close()
+
+
+class FailingProcessor(CollectProcessor):
+    async def load(self, result):
+        await super().load(result)
+        raise ConnectionError("processor is down")
+
+
+@pytest.mark.asyncio
+async def test_failed_items_are_sent_again(db_connection: db.DbConnection):
+    config = Config()
+    config.tick_window = 0
+    processor = FailingProcessor()
+    alert = db.Alert(email="first@test.local", phrase="iphone 15", interval=2)
+    await db_connection.bulk_create([alert])
+    scheduler = AlertsScheduler(config, [processor], [alert], FakeClient())
+    scheduler.start()
+    # the item is sent again on the next tick since its delivery failed
+    for attempt in range(1, 3):
+        scheduler.schedule([alert.id])
+        result = await asyncio.wait_for(processor.results.get(), 1)
+        assert [item["itemId"] for item in result.results] == ["1"]
+        while scheduler.queues[0].errors < attempt:
+            await asyncio.sleep(0.01)
+    scheduler.shutdown()
+    await scheduler.close()
+
+
+@pytest.mark.asyncio
+async def test_runs_in_the_same_second_are_delivered(db_connection: db.DbConnection):
+    config = Config()
+    config.tick_window = 0
+    config.search_cache_ttl = 0
+    processor = CollectProcessor()
+    alert = db.Alert(email="first@test.local", phrase="iphone", interval=2)
+    await db_connection.bulk_create([alert])
+    outbox = Outbox.from_config(db_connection, config, ["CollectProcessor"])
+    client = FakeClient(catalog=["iphone 15"])
+    scheduler = AlertsScheduler(config, [processor], [alert], client, outbox=outbox)
+    scheduler.start()
+    scheduler.schedule([alert.id])
+    first = await asyncio.wait_for(processor.results.get(), 1)
+    # the next run finds a new item right away, both results get their own rows
+    client.catalog.append("iphone 15 pro")
+    scheduler.schedule([alert.id])
+    second = await asyncio.wait_for(processor.results.get(), 1)
+    assert [item["itemId"] for item in first.results] == ["0"]
+    assert [item["itemId"] for item in second.results] == ["1"]
+    assert first.idempotency_key != second.idempotency_key
+    scheduler.shutdown()
+    await scheduler.close()
+
 
-    async with lock:
-        await output_queue.put(alert)
+def test_slots_spread_alerts_evenly():
+    wheel = TimerWheel(lambda interval, ids: None)
+    for alert_id in range(1, 12001):
+        wheel.add(alert_id, 2)
+    histogram = wheel.occupancy()[2]
+    assert len(histogram) == 120
+    assert sum(histogram) == 12000
+    assert max(histogram) - min(histogram) <= 10
+    assert slot_for(42, 120) == slot_for(42, 120)
 
 
 @pytest.mark.asyncio
-async def test_schedule_cron_job(db_connection: db.DbConnection):
-    output_queue = asyncio.Queue()
+async def test_search_results_are_reused_between_ticks(db_connection: db.DbConnection):
     config = Config()
-    alerts = [db.Alert(email="someone@test.local", phrase="test phrase", interval=1)]
+    config.tick_window = 0
+    processor = CollectProcessor()
+    alerts = [
+        db.Alert(email="first@test.local", phrase="iphone 15", interval=2),
+        db.Alert(email="second@test.local", phrase="iphone 15", interval=10),
+    ]
     await db_connection.bulk_create(alerts)
-    scheduler = AlertsScheduler(config, [], alerts)
-    # Here we mock our cron job to run each second instead of every minute
-    # and run our mock function
-    scheduler.jobs[alerts[0].id] = Cron(
-        "* * * * * */1",
-        func=process_job,
-        args=(alerts[0], output_queue, asyncio.Lock()),
+    client = FakeClient()
+    scheduler = AlertsScheduler(config, [processor], alerts, client)
+    scheduler.start()
+    for alert in alerts:
+        scheduler.schedule([alert.id])
+        await processor.results.get()
+    assert client.searches == ["iphone 15"]
+    assert scheduler.cache.hits == 1
+    scheduler.shutdown()
+    await scheduler.close()
+
+
+@pytest.mark.asyncio
+async def test_narrow_phrase_is_served_from_broader_results(
+    db_connection: db.DbConnection,
+):
+    config = Config()
+    config.tick_window = 0
+    processor = CollectProcessor()
+    alerts = [
+        db.Alert(email="first@test.local", phrase="iphone 15 pro 256gb", interval=2),
+        db.Alert(email="second@test.local", phrase="iPhone 15", interval=2),
+        db.Alert(email="third@test.local", phrase="-case iphone 15", interval=2),
+    ]
+    await db_connection.bulk_create(alerts)
+    client = FakeClient(
+        ["iPhone 15 Pro 256GB", "iPhone 15 128GB", "iPhone 15 Pro 256GB Blue"]
     )
+    scheduler = AlertsScheduler(config, [processor], alerts, client)
     scheduler.start()
-    res = await output_queue.get()
-    assert res == alerts[0]
+    scheduler.schedule(alert.id for alert in alerts)
+    results = {}
+    # nothing is found for the phrase with exclusion, so it has no result
+    for _ in range(2):
+        result = await processor.results.get()
+        results[result.email] = [item["title"] for item in result.results]
+    # the phrase with eBay operators is never answered locally
+    assert sorted(client.searches) == ["-case iphone 15", "iphone 15"]
+    assert results["first@test.local"] == [
+        "iPhone 15 Pro 256GB",
+        "iPhone 15 Pro 256GB Blue",
+    ]
+    assert len(results["second@test.local"]) == 3
+    assert scheduler.subsumption.stats()["hits"] == 1
+    scheduler.shutdown()
+    await scheduler.close()
+
+
+class SlowClient(FakeClient):
+    async def search_page(self, phrase: str, limit: int):
+        if not self.searches:
+            self.searches.append(phrase)
+            await asyncio.sleep(10)
+        return await super().search_page(phrase, limit)
+
+
+@pytest.mark.asyncio
+async def test_narrow_phrase_is_searched_when_broader_search_is_cancelled():
+    client = SlowClient(["iphone 15"])
+    scheduler = AlertsScheduler(Config(), [], [], client)
+    broader = asyncio.get_event_loop().create_task(scheduler.search("iphone"))
+    await asyncio.sleep(0)
+    narrower = asyncio.get_event_loop().create_task(scheduler.search("iphone 15"))
+    await asyncio.sleep(0)
+    broader.cancel()
+    items = await asyncio.wait_for(narrower, 1)
+    assert [item["title"] for item in items] == ["iphone 15"]
+    assert client.searches == ["iphone", "iphone 15"]
+    assert scheduler.subsumption.stats()["inflight"] == 0
+
+
+def test_incomplete_results_are_not_subsumed():
+    index = SubsumptionIndex(ttl=60, limit=20)
+    index.finish("iphone", [{"title": "iphone 15"}], total=2)
+    assert index.lookup("iphone 15") is None
+    index.finish("iphone", [{"title": "iphone 15"}, {"title": "iphone 14"}], total=2)
+    assert index.lookup("iphone 15") == [{"title": "iphone 15"}]
+    assert index.lookup("samsung") is None
+    index.ttl = -1
+    index.finish("samsung", [], total=0)
+    assert index.lookup("samsung galaxy") is None
+
+
+def test_delta_tracker():
+    delta = DeltaTracker(max_items=3)
+    items = [
+        {"itemId": "1", "price": {"value": "10.00"}},
+        {"itemId": "2", "price": {"value": "20.00"}},
+    ]
+    assert delta.diff(1, items) == items
+    delta.remember(1, items)
+    assert delta.diff(1, items) == []
+    cheaper = {"itemId": "2", "price": {"value": "15.00"}}
+    new = {"itemId": "3", "price": {"value": "30.00"}}
+    assert delta.diff(1, [items[0], cheaper, new]) == [cheaper, new]
+    delta.remember(1, [items[0], cheaper, new, {"itemId": "4"}])
+    # the oldest item is forgotten to keep the state bounded
+    assert delta.diff(1, [items[0]]) == [items[0]]
+    assert delta.diff(2, items) == items
+
+
+@pytest.mark.asyncio
+async def test_delta_is_reset_on_phrase_change(db_connection: db.DbConnection):
+    config = Config()
+    alert = db.Alert(email="first@test.local", phrase="iphone 15", interval=2)
+    await db_connection.bulk_create([alert])
+    scheduler = AlertsScheduler(config, [], [alert], FakeClient())
+    items = [{"itemId": "1", "price": {"value": "10.00"}}]
+    scheduler.delta.remember(alert.id, items)
+    scheduler.upsert_job(
+        db.Alert(id=alert.id, email=alert.email, phrase="iPhone  15", interval=10)
+    )
+    assert scheduler.delta.diff(alert.id, items) == []
+    scheduler.upsert_job(
+        db.Alert(id=alert.id, email=alert.email, phrase="iphone 14", interval=10)
+    )
+    assert scheduler.delta.diff(alert.id, items) == items
+
+
+def test_timer_wheel_removes_from_the_middle_of_slot():
+    wheel = TimerWheel(lambda interval, ids: None, unit=1, resolution=1)
+    ids = list(range(1, 101))
+    for alert_id in ids:
+        wheel.add(alert_id, 1)
+    for alert_id in ids[::3]:
+        wheel.remove(alert_id)
+    wheel.add(ids[1], 2)
+    [slot] = wheel.buckets[1]
+    assert sorted(slot) == sorted(set(ids) - set(ids[::3]) - {ids[1]})
+    assert all(slot[wheel.positions[alert_id]] == alert_id for alert_id in slot)
+    assert len(wheel) == 66